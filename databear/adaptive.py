@@ -0,0 +1,89 @@
+'''
+Adaptive sampling
+
+A sensor with an adaptive interval is scheduled at its configured
+measure interval (the fastest rate), but a measurement is only made
+when it is due under the current adaptive interval.
+
+After each measurement the most recent samples in the sensor
+buffer, including the new ones, are checked:
+- If any measurement changed by more than the threshold between its
+  last two samples, the interval drops back to the measure interval.
+- Otherwise the interval doubles, up to the adaptive (floor rate)
+  interval.
+
+'''
+
+from datetime import timedelta
+from numbers import Real
+from databear.errors import DataLogConfigError
+
+class AdaptiveRate:
+    '''
+    Tracks the current measurement interval of an adaptive sensor
+    '''
+    def __init__(self,fast_interval,slow_interval,threshold=None):
+        '''
+        Inputs
+        - fast_interval: measure interval used while the signal changes
+        - slow_interval: floor rate interval used while the signal is stable
+        - threshold: change between consecutive samples considered fast.
+          Default is 0 so that any change returns to the fast interval.
+        '''
+        if slow_interval < fast_interval:
+            raise DataLogConfigError(
+                'Adaptive interval must be larger than measure interval')
+
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.threshold = threshold or 0
+        self.interval = fast_interval
+        self.next_due = None
+
+        #Allow for rounding of scheduled times
+        self.tolerance = timedelta(seconds=fast_interval/2)
+
+    def due(self,scheduled_time):
+        '''
+        Return True if a measurement is due at scheduled_time
+        '''
+        if self.next_due is None:
+            return True
+        return scheduled_time >= self.next_due - self.tolerance
+
+    def start(self,scheduled_time):
+        '''
+        A measurement was started at scheduled_time. Until update is
+        called with its samples the next measurement is due after
+        the current interval.
+        '''
+        self.next_due = scheduled_time + timedelta(seconds=self.interval)
+
+    def variable(self,data):
+        '''
+        Return True if any measurement in data changed by more
+        than threshold between its two most recent samples.
+        Samples that are not numbers (failed readings) are ignored.
+        data - sensor data dictionary {<measurement>:[(dt,val),...]}
+        '''
+        for values in data.values():
+            if len(values) < 2:
+                continue
+            last, previous = values[-1][1], values[-2][1]
+            if not (isinstance(last,Real) and isinstance(previous,Real)):
+                continue
+            if abs(last - previous) > self.threshold:
+                return True
+        return False
+
+    def update(self,data,scheduled_time):
+        '''
+        Adjust the interval using the recent data and schedule
+        the next measurement relative to scheduled_time
+        '''
+        if self.variable(data):
+            self.interval = self.fast_interval
+        else:
+            self.interval = min(self.interval*2,self.slow_interval)
+
+        self.next_due = scheduled_time + timedelta(seconds=self.interval)
@@ -0,0 +1,284 @@
+'''
+Lossless compression of archived data
+
+Closed time ranges of the data table are compacted into blocks
+(data_blocks table). Each block holds the rows of one sensor and
+logging configuration:
+- timestamps: delta-of-delta encoded integer microseconds
+- vals: XOR encoded 64 bit floats (Gorilla)
+- flags: zlib compressed qc_flag and store_reason pairs
+
+Timestamp encoding (per timestamp after the first)
+    '0'                  delta of delta = 0
+    '10'   + 7 bits      zigzag delta of delta fits 7 bits
+    '110'  + 9 bits      ...fits 9 bits
+    '1110' + 12 bits     ...fits 12 bits
+    '1111' + 64 bits     anything else
+The first timestamp is stored in 64 bits.
+
+Value encoding (per value after the first)
+    '0'                                    same as last value
+    '10' + meaningful bits                 XOR fits last leading/trailing window
+    '11' + 5 bits leading + 6 bits length  new window followed by meaningful bits
+The first value is stored in 64 bits.
+
+'''
+
+import struct
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from databear.timeformat import TimestampFormatter
+
+EPOCH = datetime(1970,1,1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+#Length of a timestamp string for each isoformat timespec
+timespecs = {
+    16:'minutes',
+    19:'seconds',
+    23:'milliseconds',
+    26:'microseconds'
+}
+
+#Delta of delta buckets (prefix, prefix bits, value bits)
+dod_buckets = [
+    (0b10,2,7),
+    (0b110,3,9),
+    (0b1110,4,12),
+    (0b1111,4,64)
+]
+
+class BitWriter:
+    '''
+    Write a stream of bits, most significant bit first
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self,value,nbits):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.nbits += nbits
+        while self.nbits >= 8:
+            self.nbits -= 8
+            self.buffer.append((self.acc >> self.nbits) & 0xFF)
+        self.acc &= (1 << self.nbits) - 1
+
+    def getvalue(self):
+        '''
+        Return bytes, padding the last byte with zeros
+        '''
+        if self.nbits:
+            return bytes(self.buffer) + bytes([(self.acc << (8 - self.nbits)) & 0xFF])
+        return bytes(self.buffer)
+
+class BitReader:
+    '''
+    Read a stream of bits written by BitWriter
+    '''
+    def __init__(self,data):
+        self.data = data
+        self.pos = 0
+        self.acc = 0
+        self.nbits = 0
+
+    def read(self,nbits):
+        while self.nbits < nbits:
+            self.acc = (self.acc << 8) | self.data[self.pos]
+            self.pos += 1
+            self.nbits += 8
+        self.nbits -= nbits
+        value = self.acc >> self.nbits
+        self.acc &= (1 << self.nbits) - 1
+        return value
+
+def zigzag(n):
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+def unzigzag(n):
+    return (n >> 1) if not (n & 1) else -((n + 1) >> 1)
+
+def to_microseconds(dt):
+    '''
+    Convert a naive datetime to integer microseconds since EPOCH
+    '''
+    return (dt - EPOCH)//ONE_MICROSECOND
+
+def from_microseconds(us):
+    return EPOCH + timedelta(microseconds=us)
+
+def encode_timestamps(timestamps):
+    '''
+    Delta of delta encode a list of integer timestamps
+    '''
+    writer = BitWriter()
+    if not timestamps:
+        return writer.getvalue()
+
+    writer.write(timestamps[0],64)
+    last = timestamps[0]
+    lastdelta = 0
+    for ts in timestamps[1:]:
+        delta = ts - last
+        dod = zigzag(delta - lastdelta)
+        if dod == 0:
+            writer.write(0,1)
+        else:
+            for prefix,prefixbits,valuebits in dod_buckets:
+                if dod.bit_length() <= valuebits:
+                    writer.write(prefix,prefixbits)
+                    writer.write(dod,valuebits)
+                    break
+        last = ts
+        lastdelta = delta
+
+    return writer.getvalue()
+
+def decode_timestamps(data,count):
+    '''
+    Decode count timestamps from encode_timestamps output
+    '''
+    if not count:
+        return []
+
+    reader = BitReader(data)
+    last = reader.read(64)
+    if last >= 1 << 63:
+        last -= 1 << 64
+    timestamps = [last]
+    lastdelta = 0
+    for i in range(count-1):
+        if reader.read(1) == 0:
+            dod = 0
+        elif reader.read(1) == 0:
+            dod = unzigzag(reader.read(7))
+        elif reader.read(1) == 0:
+            dod = unzigzag(reader.read(9))
+        elif reader.read(1) == 0:
+            dod = unzigzag(reader.read(12))
+        else:
+            dod = unzigzag(reader.read(64))
+        lastdelta = lastdelta + dod
+        last = last + lastdelta
+        timestamps.append(last)
+
+    return timestamps
+
+def encode_values(values):
+    '''
+    XOR encode a list of floats
+    '''
+    writer = BitWriter()
+    if not values:
+        return writer.getvalue()
+
+    bits = struct.unpack('>{}Q'.format(len(values)),struct.pack('>{}d'.format(len(values)),*values))
+    writer.write(bits[0],64)
+    last = bits[0]
+    lastleading = -1
+    lasttrailing = 0
+    for value in bits[1:]:
+        xor = value ^ last
+        last = value
+        if xor == 0:
+            writer.write(0,1)
+            continue
+
+        leading = min(64 - xor.bit_length(),31)
+        trailing = (xor & -xor).bit_length() - 1
+        if (lastleading >= 0) and (leading >= lastleading) and (trailing >= lasttrailing):
+            writer.write(0b10,2)
+            writer.write(xor >> lasttrailing,64 - lastleading - lasttrailing)
+        else:
+            length = 64 - leading - trailing
+            writer.write(0b11,2)
+            writer.write(leading,5)
+            writer.write(length & 0x3F,6)
+            writer.write(xor >> trailing,length)
+            lastleading = leading
+            lasttrailing = trailing
+
+    return writer.getvalue()
+
+def decode_values(data,count):
+    '''
+    Decode count floats from encode_values output
+    '''
+    if not count:
+        return []
+
+    reader = BitReader(data)
+    last = reader.read(64)
+    bits = [last]
+    leading = 0
+    trailing = 0
+    for i in range(count-1):
+        if reader.read(1) == 0:
+            bits.append(last)
+            continue
+        if reader.read(1) == 1:
+            leading = reader.read(5)
+            length = reader.read(6) or 64
+            trailing = 64 - leading - length
+        last = last ^ (reader.read(64 - leading - trailing) << trailing)
+        bits.append(last)
+
+    return list(struct.unpack('>{}d'.format(count),struct.pack('>{}Q'.format(count),*bits)))
+
+def encode_flags(flags):
+    '''
+    Compress a list of (qc_flag,store_reason). None is stored as -1
+    '''
+    packed = array('i')
+    for qc_flag,store_reason in flags:
+        packed.append(-1 if qc_flag is None else qc_flag)
+        packed.append(-1 if store_reason is None else store_reason)
+    return zlib.compress(packed.tobytes())
+
+def decode_flags(data):
+    packed = array('i')
+    packed.frombytes(zlib.decompress(data))
+    return [(None if packed[i] == -1 else packed[i],
+             None if packed[i+1] == -1 else packed[i+1])
+            for i in range(0,len(packed),2)]
+
+def encode_block(rows):
+    '''
+    Compress rows of a single sensor and logging configuration
+    Inputs
+        - rows: [(dtstamp,value,qc_flag,store_reason),...] where all dtstamp
+          strings share the same length (isoformat timespec)
+    Output
+        - (timespec,timestamps,vals,flags) or None if the timestamps
+          cannot be reproduced exactly
+    '''
+    timespec = timespecs.get(len(rows[0][0]))
+    if not timespec:
+        return None
+
+    timestamps = []
+    for row in rows:
+        ts = to_microseconds(datetime.fromisoformat(row[0]))
+        if from_microseconds(ts).isoformat(sep=' ',timespec=timespec) != row[0]:
+            return None
+        timestamps.append(ts)
+
+    return (
+        timespec,
+        encode_timestamps(timestamps),
+        encode_values([float(row[1]) for row in rows]),
+        encode_flags([(row[2],row[3]) for row in rows]))
+
+def decode_block(count,timespec,timestamps,vals,flags):
+    '''
+    Decompress a block to [(dtstamp,value,qc_flag,store_reason),...]
+    '''
+    timeformat = TimestampFormatter(timespec)
+    dtstamps = [timeformat.format(from_microseconds(ts))
+                for ts in decode_timestamps(timestamps,count)]
+    values = decode_values(vals,count)
+    flagpairs = decode_flags(flags)
+    return [(dtstamps[i],values[i],flagpairs[i][0],flagpairs[i][1])
+            for i in range(count)]
@@ -0,0 +1,205 @@
+'''
+Framed control protocol for the DataBear API
+
+Commands are exchanged over TCP (localhost:62000, or the port in DBPORT)
+or a Unix domain socket (path in DBSOCKET) as length prefixed frames:
+    <4 byte big endian length><UTF-8 JSON>
+
+Requests
+    {'command': <cmd>, 'arg': <optional argument>, 'id': <optional request id>}
+Responses echo the request id. Several requests can be sent on a
+connection without waiting (pipelining); responses are returned in
+request order. Large responses are streamed as several frames marked
+with 'more': True, followed by a final frame with 'more': False.
+
+'''
+
+import socket
+import struct
+import json
+import os
+
+tcp_address = ('localhost',int(os.environ.get('DBPORT',62000)))
+
+#Maximum size of a single frame
+maxframe = 16*1024*1024
+
+class FrameError(Exception):
+    pass
+
+def encode_frame(msg):
+    '''
+    Encode a JSON serializable object as a frame
+    '''
+    payload = json.dumps(msg).encode('utf-8')
+    return struct.pack('>I',len(payload)) + payload
+
+def recvall(sock,n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise FrameError('Connection closed')
+        data.extend(chunk)
+    return bytes(data)
+
+def recv_frame(sock):
+    '''
+    Blocking read of a single frame
+    '''
+    length = struct.unpack('>I',recvall(sock,4))[0]
+    if length > maxframe:
+        raise FrameError('Frame too large')
+    return json.loads(recvall(sock,length))
+
+def unix_path():
+    '''
+    Path of the Unix domain control socket or None if not used
+    '''
+    if not hasattr(socket,'AF_UNIX'):
+        return None
+    return os.environ.get('DBSOCKET')
+
+def listen():
+    '''
+    Create listening control sockets: TCP and, if DBSOCKET
+    is set, a Unix domain socket
+    '''
+    sockets = []
+    tcpsock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    tcpsock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    tcpsock.bind(tcp_address)
+    tcpsock.listen()
+    tcpsock.setblocking(False)
+    sockets.append(tcpsock)
+
+    path = unix_path()
+    if path:
+        if os.path.exists(path):
+            os.remove(path)
+        unixsock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        unixsock.bind(path)
+        unixsock.listen()
+        unixsock.setblocking(False)
+        sockets.append(unixsock)
+
+    return sockets
+
+class ControlConnection:
+    '''
+    Server side of a control connection.
+    Buffers partial frames from a non-blocking read.
+    '''
+    def __init__(self,sock):
+        self.sock = sock
+        self.sock.settimeout(5) #For sending responses
+        self.buffer = bytearray()
+
+    def read(self):
+        '''
+        Read available data
+        Return a list of complete requests or None if the connection closed
+        '''
+        try:
+            data = self.sock.recv(65536)
+        except OSError:
+            return None
+        if not data:
+            return None
+        self.buffer.extend(data)
+
+        requests = []
+        while len(self.buffer) >= 4:
+            length = struct.unpack('>I',self.buffer[:4])[0]
+            if length > maxframe:
+                return None
+            if len(self.buffer) < length + 4:
+                break
+            payload = bytes(self.buffer[4:length+4])
+            del self.buffer[:length+4]
+            try:
+                requests.append(json.loads(payload))
+            except ValueError:
+                requests.append({'command':'invalid'})
+
+        return requests
+
+    def send(self,msg):
+        self.sock.sendall(encode_frame(msg))
+
+    def close(self):
+        self.sock.close()
+
+class ControlClient:
+    '''
+    Client for the framed control protocol
+    '''
+    def __init__(self,timeout=5,address=None):
+        '''
+        address - optional (host,port) to connect to with TCP,
+        otherwise DBSOCKET or tcp_address is used
+        '''
+        self.timeout = timeout
+        self.address = address
+        self.sock = None
+        self.nextid = 0
+
+    def connect(self):
+        path = unix_path()
+        if self.address:
+            self.sock = socket.create_connection(self.address,timeout=self.timeout)
+        elif path:
+            self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection(tcp_address,timeout=self.timeout)
+
+    def send(self,command,argument=None):
+        '''
+        Send a request without waiting for the response
+        Returns the request id
+        '''
+        if not self.sock:
+            self.connect()
+        self.nextid = self.nextid + 1
+        msg = {'command':command,'id':self.nextid}
+        if argument is not None: msg['arg'] = argument
+        self.sock.sendall(encode_frame(msg))
+        return self.nextid
+
+    def receive(self):
+        '''
+        Receive the next response frame
+        '''
+        return recv_frame(self.sock)
+
+    def stream(self,command,argument=None):
+        '''
+        Send a request and yield each response frame
+        '''
+        self.send(command,argument)
+        while True:
+            response = self.receive()
+            yield response
+            if not response.get('more'):
+                break
+
+    def request(self,command,argument=None):
+        '''
+        Send a request and return the response. Rows of
+        streamed responses are combined.
+        '''
+        response = None
+        for frame in self.stream(command,argument):
+            if response is None:
+                response = frame
+            else:
+                response['rows'].extend(frame.get('rows',[]))
+        response.pop('more',None)
+        return response
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
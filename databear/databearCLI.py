@@ -10,10 +10,11 @@ import json
 import os
 import sys
 import yaml
+from databear import control
 
 #Setup socket for communication with databear
 ipaddress = 'localhost'
-udp_port = 62000
+udp_port = control.tcp_address[1]
 sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
 sock.settimeout(5)
 
@@ -38,9 +39,14 @@ def runDataBear(yamlfile=None):
         print(shtdwnrsp)
     
     #Run logger in the background
-    print('Running databear with python -m databear.logger')
+    #Large sites can be split across several logger processes
+    if int(os.environ.get('DBSHARDS',1)) > 1:
+        module = 'databear.supervisor'
+    else:
+        module = 'databear.logger'
+    print('Running databear with python -m {}'.format(module))
     subprocess.Popen(
-        [sys.executable,'-m','databear.logger'],
+        [sys.executable,'-m',module],
         stdout=open('databear_error.log','a'),
         stderr=subprocess.STDOUT)
     '''
@@ -61,7 +67,9 @@ def updateAvailableSensors():
 
 def sendCommand(command,argument=None):
     '''
-    Send a command to DataBear
+    Send a command to DataBear using the framed control
+    socket. Falls back to UDP for older loggers.
+    Returns the response dictionary or None
     '''
     msg = {'command':command}
     if argument: msg['arg'] = argument
@@ -69,9 +77,19 @@ def sendCommand(command,argument=None):
     #Send and receive message
     print('Sending message: {}'.format(msg))
 
+    client = control.ControlClient()
+    try:
+        response = client.request(command,argument)
+        response.pop('id',None)
+        return response
+    except (OSError,control.FrameError):
+        pass
+    finally:
+        client.close()
+
     try:
         sock.sendto(json.dumps(msg).encode('utf-8'),(ipaddress,udp_port))
-        response = sock.recv(1024)
+        response = json.loads(sock.recv(65535))
     except:
         response = None
 
@@ -101,6 +119,22 @@ def findSensors():
             db.load_sensor(modinfo[1])
 
 
+def compactData(enddt):
+    '''
+    Compress data older than enddt (YYYY-MM-DD [HH:MM:SS])
+    for all logging configurations
+    '''
+    from databear import databearDB
+
+    db = databearDB.DataBearDB()
+    for configid in db.getConfigIDs('logging'):
+        compacted = db.compactData(configid,enddt)
+        print('Logging configuration {}: {} rows compacted'.format(configid,compacted))
+
+    #Release the space freed by compacted rows
+    db.curs.execute('VACUUM')
+    db.close()
+
 def loadYAML(yamlfile):
     '''
     parse a YAML configuration file and input
@@ -151,32 +185,75 @@ def loadYAML(yamlfile):
         #Check if configuration already in database
         oldsensorconfig = db.getSensorConfigID(
             sensorid,
-            sensorconfig['measure_interval']
+            sensorconfig['measure_interval'],
+            sensorconfig.get('adaptive_interval'),
+            sensorconfig.get('adaptive_threshold'),
+            sensorconfig.get('sample_group')
         )
 
         if not oldsensorconfig:
             db.addSensorConfig(
                 sensorid,
-                sensorconfig['measure_interval']
+                sensorconfig['measure_interval'],
+                sensorconfig.get('adaptive_interval'),
+                sensorconfig.get('adaptive_threshold'),
+                sensorconfig.get('sample_group')
             )
         else:
             db.setConfigStatus('sensor',oldsensorconfig,'activate')
+
+    #Load derived sensors, see databear.derived
+    from databear.derived import input_names
+    db.deactivateDerivedMeasurements()
+    for derivedconfig in config.get('derived',[]):
+        db.load_sensor('databear.derived')
+        name = derivedconfig['name']
+        sensorid = db.getSensorID(name,name,0,'derived','databear.derived')
+        if not sensorid:
+            sensorid = db.addSensor('databear.derived',name,name,0,'derived')
+
+        oldsensorconfig = db.getSensorConfigID(sensorid,0)
+        if not oldsensorconfig:
+            db.addSensorConfig(sensorid,0)
+        else:
+            db.setConfigStatus('sensor',oldsensorconfig,'activate')
+
+        for measurement in derivedconfig['measurements']:
+            #Check the expression before loading
+            input_names(measurement['expression'])
+            db.addDerivedMeasurement(
+                sensorid,
+                measurement['name'],
+                measurement['units'],
+                measurement['expression'],
+                measurement.get('description'))
             
     #Load logging configuration
     active_sensor_ids = db.active_sensor_ids
     process_ids = db.process_ids
     sensor_modules = db.sensor_modules
     for logsetting in config['datalogger']['settings']:
-            measureid = db.getMeasurementID(
-                logsetting['store'],
-                sensor_modules[logsetting['sensor']])
+            if sensor_modules[logsetting['sensor']] == 'databear.derived':
+                derivedids = {m['name']:m['measurement_id'] for m in
+                              db.getDerivedMeasurements(active_sensor_ids[logsetting['sensor']])}
+                measureid = derivedids.get(logsetting['store'])
+            else:
+                measureid = db.getMeasurementID(
+                    logsetting['store'],
+                    sensor_modules[logsetting['sensor']])
             
             #Check for existing logging config
             oldloggingconfig = db.getLoggingConfigID(
                 measureid,
                 active_sensor_ids[logsetting['sensor']],
                 logsetting['storage_interval'],
-                process_ids[logsetting['process']]
+                process_ids[logsetting['process']],
+                logsetting.get('deadband'),
+                logsetting.get('deadband_relative'),
+                logsetting.get('heartbeat'),
+                logsetting.get('allowed_lateness'),
+                logsetting.get('record_table'),
+                logsetting.get('qc')
             )
 
             if not oldloggingconfig:
@@ -185,11 +262,26 @@ def loadYAML(yamlfile):
                     active_sensor_ids[logsetting['sensor']],
                     logsetting['storage_interval'],
                     process_ids[logsetting['process']],
-                    1
+                    1,
+                    logsetting.get('deadband'),
+                    logsetting.get('deadband_relative'),
+                    logsetting.get('heartbeat'),
+                    logsetting.get('allowed_lateness'),
+                    logsetting.get('record_table'),
+                    logsetting.get('qc')
                 )
             else:
                 db.setConfigStatus('logging',oldloggingconfig,'activate')
 
+    #Load forwarding destinations
+    db.deactivateForwardDestinations()
+    for destination in config.get('forwarding',[]):
+        db.addForwardDestination(
+            destination['name'],
+            destination['url'],
+            destination.get('batch_size',1000)
+        )
+
 
 #---------------  Main ----------------
 def main_cli():
@@ -211,6 +303,11 @@ def main_cli():
         runDataBear(option)
     elif cmd=='initialize':
         findSensors()
+    elif cmd=='compact':
+        compactData(option)
+    elif cmd=='replay':
+        from databear import replay
+        replay.main(option)
     else:
         rsp = sendCommand(cmd,option)
         print(rsp)
@@ -11,6 +11,142 @@ import os
 import sys
 import sqlite3
 import importlib
+from datetime import datetime
+from databear import compression
+from databear.qc import QC_FLAGS
+from databear.metrics import registry, Timer
+
+commit_time = registry.histogram(
+    'databear_db_commit_seconds',
+    'Time to commit stored data to the database')
+
+#Tables whose changes increment the configversion (see databear.snapshot)
+config_tables = ['sensors_available','measurements','sensors','sensor_configuration',
+                 'logging_configuration','derived_measurements']
+
+#Upgrades for databases created with an older schema
+#Form: {<schemaversion>: <sql script to reach that version>}
+schema_upgrades = {
+    3: ('ALTER TABLE sensor_configuration ADD COLUMN "adaptive_interval" REAL;'
+        'ALTER TABLE sensor_configuration ADD COLUMN "adaptive_threshold" REAL;'),
+    4: ('ALTER TABLE logging_configuration ADD COLUMN "deadband" REAL;'
+        'ALTER TABLE logging_configuration ADD COLUMN "deadband_relative" REAL;'
+        'ALTER TABLE logging_configuration ADD COLUMN "heartbeat" REAL;'
+        'ALTER TABLE data ADD COLUMN "store_reason" INTEGER;'),
+    5: ('CREATE TABLE IF NOT EXISTS "data_blocks" ('
+        '"block_id" INTEGER NOT NULL,'
+        '"sensor_configid" INTEGER NOT NULL,'
+        '"logging_configid" INTEGER NOT NULL,'
+        '"start_dt" TEXT NOT NULL,'
+        '"end_dt" TEXT NOT NULL,'
+        '"count" INTEGER NOT NULL,'
+        '"timespec" TEXT NOT NULL,'
+        '"timestamps" BLOB NOT NULL,'
+        '"vals" BLOB NOT NULL,'
+        '"flags" BLOB NOT NULL,'
+        'FOREIGN KEY("logging_configid") REFERENCES "logging_configuration"("logging_configid"),'
+        'FOREIGN KEY("sensor_configid") REFERENCES "sensor_configuration"("sensor_configid"),'
+        'PRIMARY KEY("block_id" AUTOINCREMENT));'
+        'CREATE INDEX IF NOT EXISTS datablocks_index ON data_blocks ("logging_configid","start_dt");'),
+    6: ('CREATE TABLE IF NOT EXISTS "forward_destinations" ('
+        '"destination_id" INTEGER NOT NULL,'
+        '"name" TEXT NOT NULL,'
+        '"url" TEXT NOT NULL,'
+        '"batch_size" INTEGER NOT NULL DEFAULT 1000,'
+        '"last_data_id" INTEGER NOT NULL DEFAULT 0,'
+        '"status" INTEGER,'
+        'UNIQUE("name"),'
+        'PRIMARY KEY("destination_id" AUTOINCREMENT));'),
+    7: 'ALTER TABLE logging_configuration ADD COLUMN "allowed_lateness" REAL;',
+    8: 'ALTER TABLE sensor_configuration ADD COLUMN "sample_group" TEXT;',
+    9: 'ALTER TABLE logging_configuration ADD COLUMN "record_table" TEXT;',
+    10: ('CREATE TABLE IF NOT EXISTS "derived_measurements" ('
+         '"derived_id" INTEGER NOT NULL,'
+         '"sensor_id" INTEGER NOT NULL,'
+         '"measurement_id" INTEGER NOT NULL,'
+         '"expression" TEXT NOT NULL,'
+         '"status" INTEGER,'
+         'FOREIGN KEY("sensor_id") REFERENCES "sensors"("sensor_id") ON DELETE CASCADE,'
+         'FOREIGN KEY("measurement_id") REFERENCES "measurements"("measurement_id") ON DELETE CASCADE,'
+         'PRIMARY KEY("derived_id" AUTOINCREMENT));'),
+    11: ('ALTER TABLE logging_configuration ADD COLUMN "qc_min" REAL;'
+         'ALTER TABLE logging_configuration ADD COLUMN "qc_max" REAL;'
+         'ALTER TABLE logging_configuration ADD COLUMN "qc_step" REAL;'
+         'ALTER TABLE logging_configuration ADD COLUMN "qc_persistence" INTEGER;'
+         'ALTER TABLE logging_configuration ADD COLUMN "qc_gap" REAL;'),
+    12: ('CREATE TABLE IF NOT EXISTS "gaps" ('
+         '"gap_id" INTEGER NOT NULL,'
+         '"logging_configid" INTEGER NOT NULL,'
+         '"start_dt" TEXT NOT NULL,'
+         '"end_dt" TEXT NOT NULL,'
+         '"reason" INTEGER NOT NULL,'
+         'FOREIGN KEY("logging_configid") REFERENCES "logging_configuration"("logging_config_id"),'
+         'PRIMARY KEY("gap_id" AUTOINCREMENT));'
+         'CREATE INDEX IF NOT EXISTS gaps_index ON gaps ("logging_configid","end_dt");'),
+    13: ("INSERT INTO databear_configuration VALUES ('configversion',abs(random() % 1000000000));" +
+         ''.join('CREATE TRIGGER IF NOT EXISTS "{0}_{1}_config" AFTER {2} ON "{0}" BEGIN '
+                 "UPDATE databear_configuration SET value=value+1 WHERE name='configversion'; END;".format(
+                     table,event.lower(),event)
+                 for table in config_tables for event in ['INSERT','UPDATE','DELETE'])),
+}
+
+#Logging configurations with their measurement, process and sensor names
+logging_config_query = (
+    'SELECT l.logging_config_id, l.measurement_id, l.sensor_id, '
+    'm.name AS measurement_name, s.name AS sensor_name, '
+    'p.name AS process_name, storage_interval, '
+    'deadband, deadband_relative, heartbeat, allowed_lateness, record_table, '
+    'qc_min, qc_max, qc_step, qc_persistence, qc_gap '
+    'FROM logging_configuration l '
+    'INNER JOIN measurements m ON l.measurement_id = m.measurement_id '
+    'INNER JOIN processes p ON l.process_id = p.process_id '
+    'INNER JOIN sensors s on l.sensor_id = s.sensor_id ')
+
+def sensor_config(row):
+    '''
+    Sensor configuration dictionary from a row of sensors
+    joined with sensor_configuration
+    '''
+    sensor = {}
+    sensor["name"] = row["name"]
+    sensor["serial_number"] = row["serial_number"]
+    sensor["address"] = row["address"]
+    sensor["virtualport"] = row["virtualport"]
+    sensor["measure_interval"] = row["measure_interval"]
+    sensor["adaptive_interval"] = row["adaptive_interval"]
+    sensor["adaptive_threshold"] = row["adaptive_threshold"]
+    sensor["sample_group"] = row["sample_group"]
+    sensor["module_name"] = row["module_name"]
+    sensor["sensor_config_id"] = row["sensor_config_id"]
+    return sensor
+
+def logging_config(row):
+    '''
+    Logging configuration dictionary from a row of logging_config_query
+    '''
+    config = {}
+    config["measurement_id"] = row["measurement_id"]
+    config["sensor_id"] = row["sensor_id"]
+    config["measurement_name"] = row["measurement_name"]
+    config["sensor_name"] = row["sensor_name"]
+    config["storage_interval"] = row["storage_interval"]
+    config["process"] = row["process_name"]
+    config["deadband"] = row["deadband"]
+    config["deadband_relative"] = row["deadband_relative"]
+    config["heartbeat"] = row["heartbeat"]
+    config["allowed_lateness"] = row["allowed_lateness"]
+    config["record_table"] = row["record_table"]
+    config["qc"] = {}
+    for setting in ['min','max','step','persistence','gap']:
+        if row['qc_' + setting] is not None:
+            config["qc"][setting] = row['qc_' + setting]
+    return config
+
+def quote(identifier):
+    '''
+    Quote a table or column name for SQL
+    '''
+    return '"{}"'.format(identifier.replace('"','""'))
 
 #-------- Database Initialization and Setup ------
 class DataBearDB:
@@ -58,6 +194,44 @@ class DataBearDB:
                 sql_script = sql_init_file.read()
 
             self.curs.executescript(sql_script)
+        else:
+            self.upgradeSchema()
+
+    @property
+    def schemaversion(self):
+        '''
+        The schema version of the connected database
+        '''
+        self.curs.execute('SELECT value FROM databear_configuration '
+                          'WHERE name=?',('schemaversion',))
+        return self.curs.fetchone()['value']
+
+    @property
+    def configversion(self):
+        '''
+        Version of the configuration tables, changed
+        by triggers whenever they change
+        '''
+        self.curs.execute('SELECT value FROM databear_configuration '
+                          'WHERE name=?',('configversion',))
+        return self.curs.fetchone()['value']
+
+    def upgradeSchema(self):
+        '''
+        Bring a database created by an older version of
+        DataBear up to the current schema
+        '''
+        version = self.schemaversion
+        for upgradeversion in sorted(schema_upgrades):
+            if upgradeversion <= version:
+                continue
+
+            self.curs.executescript(
+                'BEGIN TRANSACTION;' +
+                schema_upgrades[upgradeversion] +
+                'UPDATE databear_configuration SET value={} '
+                "WHERE name='schemaversion';".format(upgradeversion) +
+                'COMMIT;')
         
     @property
     def sensors_available(self):
@@ -154,6 +328,55 @@ class DataBearDB:
 
         return self.curs.lastrowid
 
+    def addDerivedMeasurement(self,sensor_id,measurename,units,expression,description=None):
+        '''
+        Add or activate a derived measurement of a derived sensor
+        (see databear.derived)
+        Returns measurement_id
+        '''
+        self.curs.execute('SELECT measurement_id FROM measurements '
+                          'WHERE name=? AND units=? AND sensor_module=?',
+                          (measurename,units,'databear.derived'))
+        row = self.curs.fetchone()
+        if row:
+            measurement_id = row['measurement_id']
+        else:
+            measurement_id = self.addMeasurement('databear.derived',measurename,units,description)
+
+        self.curs.execute('SELECT derived_id FROM derived_measurements '
+                          'WHERE sensor_id=? AND measurement_id=? AND expression=?',
+                          (sensor_id,measurement_id,expression))
+        row = self.curs.fetchone()
+        if row:
+            self.curs.execute('UPDATE derived_measurements SET status=1 WHERE derived_id=?',
+                              (row['derived_id'],))
+        else:
+            self.curs.execute('INSERT INTO derived_measurements '
+                              '(sensor_id,measurement_id,expression,status) VALUES (?,?,?,1)',
+                              (sensor_id,measurement_id,expression))
+        self.conn.commit()
+
+        return measurement_id
+
+    def deactivateDerivedMeasurements(self):
+        '''
+        Set all derived measurements to not active
+        '''
+        self.curs.execute('UPDATE derived_measurements SET status=NULL')
+        self.conn.commit()
+
+    def getDerivedMeasurements(self,sensor_id):
+        '''
+        Active derived measurements of a sensor
+        [{'name':<measurement>,'measurement_id':<id>,'expression':<expression>},...]
+        '''
+        self.curs.execute('SELECT m.name AS name, d.measurement_id AS measurement_id, '
+                          'd.expression AS expression FROM derived_measurements d '
+                          'JOIN measurements m ON d.measurement_id=m.measurement_id '
+                          'WHERE d.sensor_id=? AND d.status=1 ORDER BY d.derived_id',
+                          (sensor_id,))
+        return [dict(row) for row in self.curs.fetchall()]
+
     def addSensor(self,modulename,sensorname,serialnumber,address,virtualport,description=None):
         '''
         Add a new sensor to the database
@@ -168,25 +391,44 @@ class DataBearDB:
 
         return self.curs.lastrowid
 
-    def addSensorConfig(self, sensor_id, measure_interval):
+    def addSensorConfig(self, sensor_id, measure_interval, adaptive_interval=None, adaptive_threshold=None,
+                        sample_group=None):
         '''
         Add a new sensor configuration to the system
+        adaptive_interval/adaptive_threshold - optional adaptive sampling
+        settings, see databear.adaptive
+        sample_group - optional name of a group of sensors measured together
         '''
+        params = (sensor_id,measure_interval,adaptive_interval,adaptive_threshold,sample_group,1)
         self.curs.execute('INSERT INTO sensor_configuration '
-                  '(sensor_id,measure_interval,status) '
-                  'VALUES (?,?,?)',(sensor_id,measure_interval,1))
+                  '(sensor_id,measure_interval,adaptive_interval,adaptive_threshold,sample_group,status) '
+                  'VALUES (?,?,?,?,?,?)',params)
         self.conn.commit()
 
         return self.curs.lastrowid
 
-    def addLoggingConfig(self, measurement_id, sensor_id, storage_interval, process_id, status):
+    def addLoggingConfig(self, measurement_id, sensor_id, storage_interval, process_id, status,
+                         deadband=None, deadband_relative=None, heartbeat=None,
+                         allowed_lateness=None, record_table=None, qc=None):
         '''
         Add a new logger configuration
+        deadband/deadband_relative/heartbeat - optional change based
+        storage settings, see databear.deadband
+        allowed_lateness - optional seconds to wait for measurements
+        in progress before a storage window is final
+        record_table - optional record table to store in, see databear.records
+        qc - optional quality control settings {'min','max','step',
+        'persistence','gap'}, see databear.qc
         '''
-        params = (measurement_id, sensor_id, storage_interval, process_id, status)
+        qc = qc or {}
+        params = (measurement_id, sensor_id, storage_interval, process_id, status,
+                  deadband, deadband_relative, heartbeat, allowed_lateness, record_table,
+                  qc.get('min'), qc.get('max'), qc.get('step'), qc.get('persistence'), qc.get('gap'))
         self.curs.execute('INSERT INTO logging_configuration '
-                  '(measurement_id, sensor_id, storage_interval, process_id, status) '
-                  'VALUES (?,?,?,?,?)',params)
+                  '(measurement_id, sensor_id, storage_interval, process_id, status, '
+                  'deadband, deadband_relative, heartbeat, allowed_lateness, record_table, '
+                  'qc_min, qc_max, qc_step, qc_persistence, qc_gap) '
+                  'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',params)
         self.conn.commit()
 
         return self.curs.lastrowid
@@ -261,14 +503,18 @@ class DataBearDB:
 
         return row['sensor_id']
 
-    def getSensorConfigID(self,sensor_id,measure_interval):
+    def getSensorConfigID(self,sensor_id,measure_interval,adaptive_interval=None,adaptive_threshold=None,
+                          sample_group=None):
         '''
         Get sensor configuration id associated with parameters
         Return sensor_config_id or none
         '''
-        params = (sensor_id,measure_interval)
+        params = (sensor_id,measure_interval,adaptive_interval,adaptive_threshold,sample_group)
         self.curs.execute('SELECT sensor_config_id FROM sensor_configuration '
-                          'WHERE sensor_id=? AND measure_interval=?',params)
+                          'WHERE sensor_id=? AND measure_interval=? '
+                          'AND adaptive_interval IS ? '
+                          'AND adaptive_threshold IS ? '
+                          'AND sample_group IS ?',params)
         
         row = self.curs.fetchone()
 
@@ -277,15 +523,24 @@ class DataBearDB:
 
         return row['sensor_config_id']
 
-    def getLoggingConfigID(self,measurement_id,sensor_id,storage_interval,process_id):
+    def getLoggingConfigID(self,measurement_id,sensor_id,storage_interval,process_id,
+                           deadband=None,deadband_relative=None,heartbeat=None,
+                           allowed_lateness=None,record_table=None,qc=None):
         '''
         Get logging configuration id associated with parameters
         Return sensor_config_id or none
         '''
-        params = (measurement_id,sensor_id,storage_interval,process_id)
+        qc = qc or {}
+        params = (measurement_id,sensor_id,storage_interval,process_id,
+                  deadband,deadband_relative,heartbeat,allowed_lateness,record_table,
+                  qc.get('min'),qc.get('max'),qc.get('step'),qc.get('persistence'),qc.get('gap'))
         self.curs.execute('SELECT logging_config_id FROM logging_configuration '
                           'WHERE measurement_id=? AND sensor_id=? '
-                          'AND storage_interval=? AND process_id=?',params)
+                          'AND storage_interval=? AND process_id=? '
+                          'AND deadband IS ? AND deadband_relative IS ? '
+                          'AND heartbeat IS ? AND allowed_lateness IS ? '
+                          'AND record_table IS ? AND qc_min IS ? AND qc_max IS ? '
+                          'AND qc_step IS ? AND qc_persistence IS ? AND qc_gap IS ?',params)
         
         row = self.curs.fetchone()
 
@@ -299,7 +554,6 @@ class DataBearDB:
         Return the given sensor's object as a sensor object (name, serial_number, etc.) 
         or None if id is invalid
         '''
-        sensor = {}
         sensor_id = (sensor_id,)
         self.curs.execute("Select * from sensors s inner join "
                           "sensor_configuration sc on s.sensor_id = sc.sensor_id "
@@ -309,39 +563,51 @@ class DataBearDB:
         if not row:
             return None
 
-        sensor["name"] = row["name"]
-        sensor["serial_number"] = row["serial_number"]
-        sensor["address"] = row["address"]
-        sensor["virtualport"] = row["virtualport"]
-        sensor["measure_interval"] = row["measure_interval"]
-        sensor["module_name"] = row["module_name"]
-        sensor["sensor_config_id"] = row["sensor_config_id"]
+        return sensor_config(row)
+
+    def getSensorConfigs(self):
+        '''
+        Return the configuration of all active sensors with one
+        query, see getSensorConfig. Each also includes 'sensor_id'.
+        '''
+        self.curs.execute("Select * from sensors s inner join "
+                          "sensor_configuration sc on s.sensor_id = sc.sensor_id "
+                          "where sc.status = 1 order by sc.sensor_config_id")
+        sensors = []
+        for row in self.curs.fetchall():
+            sensor = sensor_config(row)
+            sensor["sensor_id"] = row["sensor_id"]
+            sensors.append(sensor)
 
-        return sensor
+        return sensors
 
     def getLoggingConfig(self, logging_config_id):
         # Get a logging configuration by it's id
         # Logging configurations join with measurements, processes, and sensors to get all their details
 
-        config = {}
-        self.curs.execute(
-            'SELECT m.name AS measurement_name, s.name AS sensor_name, '
-            'p.name AS process_name, storage_interval FROM logging_configuration l '
-            'INNER JOIN measurements m ON l.measurement_id = m.measurement_id '
-            'INNER JOIN processes p ON l.process_id = p.process_id '
-            'INNER JOIN sensors s on l.sensor_id = s.sensor_id '
-            'WHERE l.logging_config_id = ?', (logging_config_id,))
+        self.curs.execute(logging_config_query + 'WHERE l.logging_config_id = ?', (logging_config_id,))
         
         row = self.curs.fetchone()
 
         if not row:
             return None
 
-        config["measurement_name"] = row["measurement_name"]
-        config["sensor_name"] = row["sensor_name"]
-        config["storage_interval"] = row["storage_interval"]
-        config["process"] = row["process_name"]
-        return config
+        return logging_config(row)
+
+    def getLoggingConfigs(self,activeonly=True):
+        '''
+        Return all active (or with activeonly=False all) logging configurations
+        with one query, see getLoggingConfig. Each also includes 'logging_config_id'.
+        '''
+        where = 'WHERE l.status = 1 ' if activeonly else ''
+        self.curs.execute(logging_config_query + where + 'ORDER BY l.logging_config_id')
+        configs = []
+        for row in self.curs.fetchall():
+            config = logging_config(row)
+            config["logging_config_id"] = row["logging_config_id"]
+            configs.append(config)
+
+        return configs
 
     def setConfigStatus(self,configtype,config_id,status='activate'):
         '''
@@ -358,23 +624,513 @@ class DataBearDB:
         self.curs.execute(qry,(togglecode[status],config_id))
         self.conn.commit()
     
-    def storeData(self, datetime, value, sensor_config_id, logging_config_id, qc_flag):
+    def storeData(self, datetime, value, sensor_config_id, logging_config_id, qc_flag, store_reason=0):
         '''
         Store data value in database
         Inputs:
             - datetime [string]
+            - store_reason: why the row was written, see databear.deadband
         Returns new rowid
         '''
         storeqry = ('INSERT INTO data '
-                    '(dtstamp,value,sensor_configid,logging_configid,qc_flag) '
-                    'VALUES (?,?,?,?,?)')
-        qryparams = (datetime, float(value), sensor_config_id, logging_config_id, qc_flag)
+                    '(dtstamp,value,sensor_configid,logging_configid,qc_flag,store_reason) '
+                    'VALUES (?,?,?,?,?,?)')
+        qryparams = (datetime, float(value), sensor_config_id, logging_config_id, qc_flag, store_reason)
 
         self.curs.execute(storeqry,qryparams)
-        self.conn.commit()
+        with Timer(commit_time):
+            self.conn.commit()
 
         return self.curs.lastrowid
 
+    def storeDataRows(self, rows):
+        '''
+        Store many data values with one commit
+        Inputs:
+            - rows: [(datetime,value,sensor_config_id,logging_config_id,
+                      qc_flag,store_reason),...]
+        Returns number of rows stored
+        '''
+        storeqry = ('INSERT INTO data '
+                    '(dtstamp,value,sensor_configid,logging_configid,qc_flag,store_reason) '
+                    'VALUES (?,?,?,?,?,?)')
+        self.curs.executemany(storeqry,rows)
+        with Timer(commit_time):
+            self.conn.commit()
+
+        return len(rows)
+
+    def getLatestSensorConfigID(self, sensor_id):
+        '''
+        Return the newest sensor configuration id of a
+        sensor, active or not, or None
+        '''
+        self.curs.execute('SELECT MAX(sensor_config_id) AS sensor_config_id '
+                          'FROM sensor_configuration WHERE sensor_id=?',(sensor_id,))
+        return self.curs.fetchone()['sensor_config_id']
+
+    def deleteData(self, logging_config_id, dtstamps):
+        '''
+        Delete stored rows of a logging configuration, used
+        to replace a storage window that received late data
+        Inputs:
+            - dtstamps: list of datetime strings
+        Returns number of rows deleted
+        '''
+        self.curs.executemany('DELETE FROM data WHERE logging_configid=? AND dtstamp=?',
+                              [(logging_config_id,dtstamp) for dtstamp in dtstamps])
+        self.conn.commit()
+
+        return self.curs.rowcount
+
+    def compactData(self, logging_config_id, enddt, blocksize=4096):
+        '''
+        Compress data rows with dtstamp < enddt for a logging
+        configuration into data_blocks (see databear.compression)
+        Compacted rows are read by getData (and the query APIs using it),
+        getDataRange, getQCSummary and getDataView, which returns the rows
+        of dataview including compacted data. SQL queries of the data
+        table and dataview don't include them.
+        Inputs:
+            - enddt [string]: end of the closed time range
+            - blocksize: maximum rows per block
+        Returns number of rows compacted
+        '''
+        #Rows not yet sent to all forwarding destinations are kept
+        self.curs.execute('SELECT MIN(last_data_id) AS mark FROM forward_destinations '
+                          'WHERE status=1')
+        mark = self.curs.fetchone()['mark']
+        if mark is None:
+            mark = sys.maxsize
+
+        #Rows are read from a temporary copy so data can be deleted while
+        #iterating without loading all rows into memory
+        reader = self.conn.cursor()
+        reader.execute('DROP TABLE IF EXISTS temp.compact_rows')
+        reader.execute('CREATE TEMP TABLE compact_rows AS '
+                       'SELECT data_id, dtstamp, value, qc_flag, store_reason, sensor_configid '
+                       'FROM data WHERE logging_configid=? AND dtstamp<? AND data_id<=? '
+                       'ORDER BY sensor_configid, dtstamp',(logging_config_id,enddt,mark))
+        reader.execute('SELECT * FROM temp.compact_rows ORDER BY rowid')
+
+        def storeblock(block):
+            encoded = compression.encode_block(
+                [(row['dtstamp'],row['value'],row['qc_flag'],row['store_reason']) for row in block])
+            if not encoded:
+                #Timestamps can't be reproduced exactly, leave in data
+                return 0
+
+            self.curs.execute('INSERT INTO data_blocks '
+                              '(sensor_configid,logging_configid,start_dt,end_dt,count,'
+                              'timespec,timestamps,vals,flags) VALUES (?,?,?,?,?,?,?,?,?)',
+                              (block[0]['sensor_configid'],logging_config_id,
+                               block[0]['dtstamp'],block[-1]['dtstamp'],len(block)) + encoded)
+            self.curs.executemany('DELETE FROM data WHERE data_id=?',
+                                  [(row['data_id'],) for row in block])
+            return len(block)
+
+        #Split into runs of the same sensor config and timestamp format
+        compacted = 0
+        block = []
+        for row in reader:
+            if block and ((len(block) >= blocksize) or
+                          (row['sensor_configid'] != block[0]['sensor_configid']) or
+                          (len(row['dtstamp']) != len(block[0]['dtstamp']))):
+                compacted = compacted + storeblock(block)
+                block = []
+            block.append(row)
+        if block:
+            compacted = compacted + storeblock(block)
+
+        reader.execute('DROP TABLE temp.compact_rows')
+        self.conn.commit()
+
+        return compacted
+
+    def getData(self, logging_config_id, startdt, enddt):
+        '''
+        Return data for a logging configuration with
+        startdt <= dtstamp < enddt from both the data table
+        and compressed data blocks
+        Inputs:
+            - startdt, enddt [string]
+        Output:
+            - [(dtstamp,value,qc_flag,store_reason),...] sorted by dtstamp
+        '''
+        return [row[:4] for row in self.getDataRows(logging_config_id,startdt,enddt)]
+
+    def getDataRows(self, logging_config_id, startdt, enddt):
+        '''
+        As getData, with the sensor configuration of each row
+        Output:
+            - [(dtstamp,value,qc_flag,store_reason,sensor_configid),...] sorted by dtstamp
+        '''
+        output = []
+        self.curs.execute('SELECT count, timespec, timestamps, vals, flags, sensor_configid '
+                          'FROM data_blocks WHERE logging_configid=? AND start_dt<? AND end_dt>=?',
+                          (logging_config_id,enddt,startdt))
+        for block in self.curs.fetchall():
+            for row in compression.decode_block(*block[:5]):
+                if (row[0] >= startdt) and (row[0] < enddt):
+                    output.append(row + (block[5],))
+
+        self.curs.execute('SELECT dtstamp, value, qc_flag, store_reason, sensor_configid FROM data '
+                          'WHERE logging_configid=? AND dtstamp>=? AND dtstamp<?',
+                          (logging_config_id,startdt,enddt))
+        for row in self.curs.fetchall():
+            output.append(tuple(row))
+
+        output.sort(key=lambda row: row[0])
+        return output
+
+    def getDataView(self, startdt, enddt, sensor=None):
+        '''
+        Return the rows of dataview with startdt <= dtstamp < enddt,
+        including compacted data that isn't in the view
+        Inputs:
+            - startdt, enddt [string]
+            - sensor: optional sensor name, default all sensors
+        Output:
+            - [{'dtstamp','value','sensor_name','measurement','process',
+                'measure_interval'},...] sorted by dtstamp
+        '''
+        qry = ('SELECT lc.logging_config_id, s.name AS sensor_name, m.name AS measurement, '
+               'p.name AS process FROM logging_configuration lc '
+               'JOIN sensors s ON lc.sensor_id=s.sensor_id '
+               'JOIN measurements m ON lc.measurement_id=m.measurement_id '
+               'JOIN processes p ON lc.process_id=p.process_id')
+        if sensor is None:
+            self.curs.execute(qry)
+        else:
+            self.curs.execute(qry + ' WHERE s.name=?',(sensor,))
+        configs = self.curs.fetchall()
+
+        self.curs.execute('SELECT sensor_config_id, measure_interval FROM sensor_configuration')
+        intervals = dict(self.curs.fetchall())
+
+        output = []
+        for config in configs:
+            for row in self.getDataRows(config['logging_config_id'],startdt,enddt):
+                output.append({
+                    'dtstamp':row[0],
+                    'value':row[1],
+                    'sensor_name':config['sensor_name'],
+                    'measurement':config['measurement'],
+                    'process':config['process'],
+                    'measure_interval':intervals.get(row[4])})
+
+        output.sort(key=lambda row: row['dtstamp'])
+        return output
+
+    def getDataRange(self, logging_config_id):
+        '''
+        Return (first dtstamp, last dtstamp) of the data of a logging
+        configuration in both the data table and compressed data blocks,
+        or (None,None) if there is none
+        '''
+        self.curs.execute('SELECT MIN(dtstamp), MAX(dtstamp) FROM data WHERE logging_configid=? '
+                          'UNION ALL SELECT MIN(start_dt), MAX(end_dt) FROM data_blocks '
+                          'WHERE logging_configid=?',(logging_config_id,logging_config_id))
+        rows = [row for row in self.curs.fetchall() if row[0] is not None]
+        if not rows:
+            return None, None
+
+        return min(row[0] for row in rows), max(row[1] for row in rows)
+
+    def getGroupData(self, sample_group, startdt, enddt):
+        '''
+        Return data of the active logging configurations of the
+        sensors in a sample group with startdt <= dtstamp < enddt.
+        Sensors in a group are measured together and stamped with
+        the same time, so rows of one measurement share a dtstamp.
+        Inputs:
+            - startdt, enddt [string]
+        Output:
+            - [(dtstamp,{'<sensor>:<measurement>':value,...}),...] sorted by dtstamp
+        '''
+        self.curs.execute('SELECT lc.logging_config_id, s.name AS sensor_name, '
+                          'm.name AS measurement FROM logging_configuration lc '
+                          'INNER JOIN sensor_configuration sc ON lc.sensor_id=sc.sensor_id '
+                          'JOIN sensors s ON lc.sensor_id=s.sensor_id '
+                          'JOIN measurements m ON lc.measurement_id=m.measurement_id '
+                          'WHERE sc.status=1 AND lc.status=1 AND sc.sample_group=?',
+                          (sample_group,))
+        configs = self.curs.fetchall()
+
+        rows = {} #Form {<dtstamp>:{<sensor:measurement>:value}}
+        for config in configs:
+            key = '{}:{}'.format(config['sensor_name'],config['measurement'])
+            for row in self.getData(config['logging_config_id'],startdt,enddt):
+                rows.setdefault(row[0],{})[key] = row[1]
+
+        return sorted(rows.items())
+
+    def getQCSummary(self, startdt, enddt, logging_config_id=None):
+        '''
+        Count stored rows with each quality control flag
+        (see databear.qc) with startdt <= dtstamp < enddt
+        Inputs:
+            - startdt, enddt [string]
+            - logging_config_id: optional, default all configurations
+        Output:
+            - {<logging_config_id>:{'count':<rows>,'flagged':<rows>,
+               'range':<rows>,'step':<rows>,'persistence':<rows>,'gap':<rows>}}
+        '''
+        columns = ', '.join('SUM((qc_flag & {}) > 0) AS "{}"'.format(bit,name)
+                            for name,bit in QC_FLAGS.items())
+        where = 'dtstamp>=? AND dtstamp<?'
+        params = (startdt,enddt)
+        if logging_config_id is not None:
+            where = where + ' AND logging_configid=?'
+            params = params + (logging_config_id,)
+
+        summary = {}
+        self.curs.execute('SELECT logging_configid, COUNT(*) AS count, '
+                          'SUM(qc_flag > 0) AS flagged, {} FROM data WHERE {} '
+                          'GROUP BY logging_configid'.format(columns,where),params)
+        for row in self.curs.fetchall():
+            summary[row['logging_configid']] = {
+                key:(row[key] or 0) for key in ['count','flagged'] + list(QC_FLAGS)}
+
+        #Flags of compressed rows
+        where = 'start_dt<? AND end_dt>=?'
+        params = (enddt,startdt)
+        if logging_config_id is not None:
+            where = where + ' AND logging_configid=?'
+            params = params + (logging_config_id,)
+        self.curs.execute('SELECT logging_configid, count, timespec, timestamps, vals, flags '
+                          'FROM data_blocks WHERE {}'.format(where),params)
+        for block in self.curs.fetchall():
+            counts = summary.setdefault(block[0],
+                dict.fromkeys(['count','flagged'] + list(QC_FLAGS),0))
+            for row in compression.decode_block(*block[1:]):
+                if not ((row[0] >= startdt) and (row[0] < enddt)):
+                    continue
+                counts['count'] += 1
+                flag = row[2] or 0
+                if flag:
+                    counts['flagged'] += 1
+                for name, bit in QC_FLAGS.items():
+                    if flag & bit:
+                        counts[name] += 1
+
+        return summary
+
+    def addGap(self, logging_config_id, startdt, enddt, reason):
+        '''
+        Record missing data of a logging configuration (see databear.gaps)
+        A gap ending at startdt with the same reason is extended
+        Inputs:
+            - startdt, enddt [string]
+        '''
+        self.curs.execute('UPDATE gaps SET end_dt=? WHERE logging_configid=? '
+                          'AND end_dt=? AND reason=?',
+                          (enddt,logging_config_id,startdt,reason))
+        if not self.curs.rowcount:
+            self.curs.execute('INSERT INTO gaps (logging_configid,start_dt,end_dt,reason) '
+                              'VALUES (?,?,?,?)',(logging_config_id,startdt,enddt,reason))
+        self.conn.commit()
+
+    def removeGap(self, logging_config_id, startdt, enddt):
+        '''
+        Remove startdt <= time < enddt from the gaps of a
+        logging configuration, used when late data fills a window
+        Inputs:
+            - startdt, enddt [string]
+        '''
+        self.curs.execute('SELECT gap_id, start_dt, end_dt, reason FROM gaps '
+                          'WHERE logging_configid=? AND end_dt>? AND start_dt<?',
+                          (logging_config_id,startdt,enddt))
+        for gap in self.curs.fetchall():
+            self.curs.execute('DELETE FROM gaps WHERE gap_id=?',(gap['gap_id'],))
+            #Keep the parts outside the range
+            for gapstart, gapend in [(gap['start_dt'],startdt),(enddt,gap['end_dt'])]:
+                if gapstart < gapend:
+                    self.curs.execute('INSERT INTO gaps (logging_configid,start_dt,end_dt,reason) '
+                                      'VALUES (?,?,?,?)',
+                                      (logging_config_id,gapstart,gapend,gap['reason']))
+        self.conn.commit()
+
+    def getGaps(self, logging_config_id, startdt, enddt):
+        '''
+        Return gaps of a logging configuration overlapping startdt - enddt
+        Inputs:
+            - startdt, enddt [string]
+        Output:
+            - [(start_dt,end_dt,reason),...] sorted by start_dt
+        '''
+        self.curs.execute('SELECT start_dt, end_dt, reason FROM gaps '
+                          'WHERE logging_configid=? AND end_dt>? AND start_dt<? '
+                          'ORDER BY start_dt',(logging_config_id,startdt,enddt))
+        return [tuple(row) for row in self.curs.fetchall()]
+
+    def getAvailability(self, startdt, enddt, sensor=None):
+        '''
+        Data availability of active logging configurations from
+        the recorded gaps with startdt <= time < enddt
+        Times after now are not counted.
+        Inputs:
+            - startdt, enddt [string]
+            - sensor: optional sensor name, default all sensors
+        Output:
+            - [{'logging_config_id','sensor','measurement','process',
+                'gaps':<number of gaps>,'missing_seconds','completeness'},...]
+        '''
+        enddt = min(enddt,datetime.now().isoformat(sep=' '))
+        where = 'lc.status=1'
+        params = (enddt,startdt,enddt,startdt,startdt,enddt)
+        if sensor is not None:
+            where = where + ' AND s.name=?'
+            params = params + (sensor,)
+
+        self.curs.execute(
+            'SELECT lc.logging_config_id, s.name AS sensor_name, m.name AS measurement, '
+            'p.name AS process, COUNT(g.gap_id) AS gaps, '
+            'SUM(julianday(MIN(g.end_dt,?)) - julianday(MAX(g.start_dt,?)))*86400 AS missing, '
+            '(julianday(?) - julianday(?))*86400 AS duration '
+            'FROM logging_configuration lc '
+            'JOIN sensors s ON lc.sensor_id=s.sensor_id '
+            'JOIN measurements m ON lc.measurement_id=m.measurement_id '
+            'JOIN processes p ON lc.process_id=p.process_id '
+            'LEFT JOIN gaps g ON g.logging_configid=lc.logging_config_id '
+            'AND g.end_dt>? AND g.start_dt<? '
+            'WHERE {} GROUP BY lc.logging_config_id'.format(where),params)
+
+        availability = []
+        for row in self.curs.fetchall():
+            missing = round(row['missing'] or 0,3)
+            duration = row['duration'] or 0
+            availability.append({
+                'logging_config_id':row['logging_config_id'],
+                'sensor':row['sensor_name'],
+                'measurement':row['measurement'],
+                'process':row['process'],
+                'gaps':row['gaps'],
+                'missing_seconds':missing,
+                'completeness':max(1 - missing/duration,0) if duration > 0 else None})
+        return availability
+
+    def createRecordTable(self, name, columns):
+        '''
+        Create record table record_<name> if needed and add any
+        missing value columns (see databear.records)
+        '''
+        table = quote('record_' + name)
+        self.curs.execute('CREATE TABLE IF NOT EXISTS {} ('
+                          '"dtstamp" TEXT NOT NULL PRIMARY KEY) WITHOUT ROWID'.format(table))
+        existing = [row['name'] for row in self.curs.execute('PRAGMA table_info({})'.format(table))]
+        for column in columns:
+            if column not in existing:
+                self.curs.execute('ALTER TABLE {} ADD COLUMN {} REAL'.format(table,quote(column)))
+        self.conn.commit()
+
+    def storeRecords(self, name, records):
+        '''
+        Store values in record table record_<name>, adding to
+        records that already exist
+        Inputs:
+            - records: {<dtstamp>:{<column>:value}}
+        '''
+        table = quote('record_' + name)
+        for dtstamp, values in records.items():
+            columns = [quote(column) for column in values]
+            self.curs.execute(
+                'INSERT INTO {} ("dtstamp",{}) VALUES (?{}) '
+                'ON CONFLICT("dtstamp") DO UPDATE SET {}'.format(
+                    table,
+                    ','.join(columns),
+                    ',?'*len(columns),
+                    ','.join('{0}=excluded.{0}'.format(column) for column in columns)),
+                [dtstamp] + [None if value is None else float(value) for value in values.values()])
+        with Timer(commit_time):
+            self.conn.commit()
+
+    def clearRecords(self, name, column, dtstamps):
+        '''
+        Clear the values of a column in record table record_<name>,
+        used to replace a storage window that received late data
+        '''
+        self.curs.executemany('UPDATE {} SET {}=NULL WHERE dtstamp=?'.format(
+                                  quote('record_' + name),quote(column)),
+                              [(dtstamp,) for dtstamp in dtstamps])
+        self.conn.commit()
+
+    def getRecords(self, name, startdt, enddt):
+        '''
+        Return records of record table record_<name>
+        with startdt <= dtstamp < enddt
+        Inputs:
+            - startdt, enddt [string]
+        Output:
+            - (['dtstamp',<column>,...],[(dtstamp,value,...),...]) sorted by dtstamp
+        '''
+        self.curs.execute('SELECT * FROM {} WHERE dtstamp>=? AND dtstamp<? '
+                          'ORDER BY dtstamp'.format(quote('record_' + name)),(startdt,enddt))
+        columns = [description[0] for description in self.curs.description]
+        return columns, [tuple(row) for row in self.curs.fetchall()]
+
+    def addForwardDestination(self, name, url, batch_size=1000):
+        '''
+        Add or update a forwarding destination and make it active.
+        The high water mark of an existing destination is kept.
+        '''
+        self.curs.execute('SELECT destination_id FROM forward_destinations WHERE name=?',(name,))
+        row = self.curs.fetchone()
+        if row:
+            self.curs.execute('UPDATE forward_destinations SET url=?, batch_size=?, status=1 '
+                              'WHERE destination_id=?',(url,batch_size,row['destination_id']))
+            destination_id = row['destination_id']
+        else:
+            self.curs.execute('INSERT INTO forward_destinations (name,url,batch_size,status) '
+                              'VALUES (?,?,?,1)',(name,url,batch_size))
+            destination_id = self.curs.lastrowid
+        self.conn.commit()
+
+        return destination_id
+
+    def deactivateForwardDestinations(self):
+        '''
+        Set all forwarding destinations to not active
+        '''
+        self.curs.execute('UPDATE forward_destinations SET status=NULL')
+        self.conn.commit()
+
+    def getForwardDestinations(self, activeonly=False):
+        '''
+        Return a list of forwarding destinations
+        [{'name':<name>,'url':<url>,'batch_size':<n>,'last_data_id':<id>},...]
+        '''
+        qry = 'SELECT name, url, batch_size, last_data_id FROM forward_destinations'
+        if activeonly:
+            qry = qry + ' WHERE status=1'
+
+        self.curs.execute(qry)
+        return [dict(row) for row in self.curs.fetchall()]
+
+    def getForwardData(self, last_data_id, limit):
+        '''
+        Return up to limit data rows with data_id > last_data_id
+        Rows are [data_id, dtstamp, value, sensor_name, measurement, process, qc_flag, store_reason]
+        '''
+        self.curs.execute(
+            'SELECT d.data_id, d.dtstamp, d.value, s.name AS sensor_name, '
+            'm.name AS measurement, p.name AS process, d.qc_flag, d.store_reason FROM data d '
+            'INNER JOIN sensor_configuration sc ON d.sensor_configid=sc.sensor_config_id '
+            'INNER JOIN logging_configuration lc ON d.logging_configid=lc.logging_config_id '
+            'JOIN sensors s ON sc.sensor_id=s.sensor_id '
+            'JOIN measurements m ON lc.measurement_id=m.measurement_id '
+            'JOIN processes p ON lc.process_id=p.process_id '
+            'WHERE d.data_id>? ORDER BY d.data_id LIMIT ?',(last_data_id,limit))
+        return [list(row) for row in self.curs.fetchall()]
+
+    def setForwardMark(self, name, last_data_id):
+        '''
+        Record the last data_id sent to a forwarding destination
+        '''
+        self.curs.execute('UPDATE forward_destinations SET last_data_id=? WHERE name=?',
+                          (last_data_id,name))
+        self.conn.commit()
+
     def close(self):
         '''
         Close all connections
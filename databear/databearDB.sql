@@ -14,6 +14,7 @@ CREATE TABLE IF NOT EXISTS "data" (
 	"sensor_configid"	INTEGER NOT NULL,
 	"logging_configid"	INTEGER NOT NULL,
 	"qc_flag"	INTEGER,
+	"store_reason"	INTEGER,
 	FOREIGN KEY("logging_configid") REFERENCES "logging_configuration"("logging_configid"),
 	FOREIGN KEY("sensor_configid") REFERENCES "sensor_configuration"("sensor_configid"),
 	PRIMARY KEY("data_id" AUTOINCREMENT)
@@ -21,6 +22,24 @@ CREATE TABLE IF NOT EXISTS "data" (
 
 CREATE INDEX IF NOT EXISTS data_index ON data ("dtstamp");
 
+CREATE TABLE IF NOT EXISTS "data_blocks" (
+	"block_id"	INTEGER NOT NULL,
+	"sensor_configid"	INTEGER NOT NULL,
+	"logging_configid"	INTEGER NOT NULL,
+	"start_dt"	TEXT NOT NULL,
+	"end_dt"	TEXT NOT NULL,
+	"count"	INTEGER NOT NULL,
+	"timespec"	TEXT NOT NULL,
+	"timestamps"	BLOB NOT NULL,
+	"vals"	BLOB NOT NULL,
+	"flags"	BLOB NOT NULL,
+	FOREIGN KEY("logging_configid") REFERENCES "logging_configuration"("logging_configid"),
+	FOREIGN KEY("sensor_configid") REFERENCES "sensor_configuration"("sensor_configid"),
+	PRIMARY KEY("block_id" AUTOINCREMENT)
+);
+
+CREATE INDEX IF NOT EXISTS datablocks_index ON data_blocks ("logging_configid","start_dt");
+
 CREATE TABLE IF NOT EXISTS "processes" (
 	"process_id"	INTEGER NOT NULL,
 	"name"	TEXT NOT NULL,
@@ -33,6 +52,9 @@ CREATE TABLE IF NOT EXISTS "sensor_configuration" (
 	"sensor_id"	INTEGER NOT NULL,
 	"measure_interval"	REAL NOT NULL,
 	"status"    INTEGER,
+	"adaptive_interval"	REAL,
+	"adaptive_threshold"	REAL,
+	"sample_group"	TEXT,
 	FOREIGN KEY("sensor_id") REFERENCES "sensors"("sensor_id") ON DELETE CASCADE,
 	PRIMARY KEY("sensor_config_id" AUTOINCREMENT)
 );
@@ -46,6 +68,16 @@ CREATE TABLE IF NOT EXISTS "logging_configuration" (
 	"storage_interval"	INTEGER NOT NULL,
 	"process_id"	INTEGER NOT NULL,
 	"status"	INTEGER,
+	"deadband"	REAL,
+	"deadband_relative"	REAL,
+	"heartbeat"	REAL,
+	"allowed_lateness"	REAL,
+	"record_table"	TEXT,
+	"qc_min"	REAL,
+	"qc_max"	REAL,
+	"qc_step"	REAL,
+	"qc_persistence"	INTEGER,
+	"qc_gap"	REAL,
 	FOREIGN KEY("measurement_id") REFERENCES "measurements"("measurement_id") ON DELETE CASCADE,
 	FOREIGN KEY("process_id") REFERENCES "processes"("process_id") ON UPDATE CASCADE,
 	FOREIGN KEY("sensor_id") REFERENCES "sensors"("sensor_id") ON DELETE CASCADE,
@@ -75,11 +107,42 @@ CREATE TABLE IF NOT EXISTS "measurements" (
 	FOREIGN KEY("sensor_module") REFERENCES "sensors_available"("sensor_module") ON DELETE CASCADE,
 	PRIMARY KEY("measurement_id" AUTOINCREMENT)
 );
+CREATE TABLE IF NOT EXISTS "derived_measurements" (
+	"derived_id"	INTEGER NOT NULL,
+	"sensor_id"	INTEGER NOT NULL,
+	"measurement_id"	INTEGER NOT NULL,
+	"expression"	TEXT NOT NULL,
+	"status"	INTEGER,
+	FOREIGN KEY("sensor_id") REFERENCES "sensors"("sensor_id") ON DELETE CASCADE,
+	FOREIGN KEY("measurement_id") REFERENCES "measurements"("measurement_id") ON DELETE CASCADE,
+	PRIMARY KEY("derived_id" AUTOINCREMENT)
+);
+CREATE TABLE IF NOT EXISTS "forward_destinations" (
+	"destination_id"	INTEGER NOT NULL,
+	"name"	TEXT NOT NULL,
+	"url"	TEXT NOT NULL,
+	"batch_size"	INTEGER NOT NULL DEFAULT 1000,
+	"last_data_id"	INTEGER NOT NULL DEFAULT 0,
+	"status"	INTEGER,
+	UNIQUE("name"),
+	PRIMARY KEY("destination_id" AUTOINCREMENT)
+);
+CREATE TABLE IF NOT EXISTS "gaps" (
+	"gap_id"	INTEGER NOT NULL,
+	"logging_configid"	INTEGER NOT NULL,
+	"start_dt"	TEXT NOT NULL,
+	"end_dt"	TEXT NOT NULL,
+	"reason"	INTEGER NOT NULL,
+	FOREIGN KEY("logging_configid") REFERENCES "logging_configuration"("logging_config_id"),
+	PRIMARY KEY("gap_id" AUTOINCREMENT)
+);
+CREATE INDEX IF NOT EXISTS gaps_index ON gaps ("logging_configid","end_dt");
 CREATE TABLE IF NOT EXISTS "databear_configuration" (
     "name" TEXT NOT NULL PRIMARY KEY,
     "value" INTEGER NOT NULL
 );
 
+-- Rows of the data table only, DataBearDB.getDataView includes compacted data
 CREATE VIEW dataview AS
 SELECT d.dtstamp, d.value, s.name AS sensor_name, m.name AS measurement, 
        p.name AS process, sc.measure_interval AS measure_interval 
@@ -95,5 +158,62 @@ INSERT INTO "processes" VALUES (2,'Average','Calculate the average value of meas
 INSERT INTO "processes" VALUES (3,'Max','Select the maximum value from measurement in the storage interval');
 INSERT INTO "processes" VALUES (4,'Min','Select the minimum value from measurement in the storage interval');
 INSERT INTO "processes" VALUES (5,'Dump','Select all measurements from the storage interval for storage');
-INSERT INTO "databear_configuration" VALUES("schemaversion", 2);
+INSERT INTO "databear_configuration" VALUES("schemaversion", 13);
+INSERT INTO "databear_configuration" VALUES("configversion", abs(random() % 1000000000));
+
+-- Count configuration changes, see databear.snapshot
+CREATE TRIGGER IF NOT EXISTS "sensors_available_insert_config" AFTER INSERT ON "sensors_available" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensors_available_update_config" AFTER UPDATE ON "sensors_available" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensors_available_delete_config" AFTER DELETE ON "sensors_available" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "measurements_insert_config" AFTER INSERT ON "measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "measurements_update_config" AFTER UPDATE ON "measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "measurements_delete_config" AFTER DELETE ON "measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensors_insert_config" AFTER INSERT ON "sensors" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensors_update_config" AFTER UPDATE ON "sensors" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensors_delete_config" AFTER DELETE ON "sensors" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensor_configuration_insert_config" AFTER INSERT ON "sensor_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensor_configuration_update_config" AFTER UPDATE ON "sensor_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "sensor_configuration_delete_config" AFTER DELETE ON "sensor_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "logging_configuration_insert_config" AFTER INSERT ON "logging_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "logging_configuration_update_config" AFTER UPDATE ON "logging_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "logging_configuration_delete_config" AFTER DELETE ON "logging_configuration" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "derived_measurements_insert_config" AFTER INSERT ON "derived_measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "derived_measurements_update_config" AFTER UPDATE ON "derived_measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
+CREATE TRIGGER IF NOT EXISTS "derived_measurements_delete_config" AFTER DELETE ON "derived_measurements" BEGIN
+	UPDATE databear_configuration SET value=value+1 WHERE name='configversion';
+END;
 COMMIT;
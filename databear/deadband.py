@@ -0,0 +1,81 @@
+'''
+Deadband (change based) storage
+
+A logging configuration with a deadband only writes a processed
+value when it differs from the last written value by more than
+an absolute and/or relative deadband, or when the heartbeat
+(maximum time without a write) expires.
+
+The reason a row was written is recorded in data.store_reason
+
+Values that are not numbers (a failed reading stored as None, text)
+are never stored and don't change the last written value.
+'''
+
+from datetime import timedelta
+from numbers import Real
+
+#Values for data.store_reason
+STORE_INTERVAL = 0  #Regular interval storage
+STORE_INITIAL = 1  #First value after logger start
+STORE_CHANGE = 2  #Value moved outside the deadband
+STORE_HEARTBEAT = 3  #Heartbeat expired
+
+class Deadband:
+    '''
+    Filters processed data for a single logging configuration
+    '''
+    def __init__(self,absolute=None,relative=None,heartbeat=None):
+        '''
+        Inputs
+        - absolute: store when abs(value - last) > absolute
+        - relative: store when abs(value - last) > relative*abs(last)
+        - heartbeat: seconds after which a value is stored regardless
+        With no absolute or relative deadband any change is stored.
+        '''
+        self.absolute = absolute
+        self.relative = relative
+        self.heartbeat = timedelta(seconds=heartbeat) if heartbeat else None
+
+        #Last written value
+        self.last_dt = None
+        self.last_value = None
+
+    def changed(self,value):
+        '''
+        Return True if value is outside the deadband
+        '''
+        change = abs(value - self.last_value)
+        if (self.absolute is None) and (self.relative is None):
+            return change > 0
+        if (self.absolute is not None) and (change > self.absolute):
+            return True
+        if (self.relative is not None) and (change > self.relative*abs(self.last_value)):
+            return True
+        return False
+
+    def filter(self,data):
+        '''
+        Inputs
+        - data: processed data [(datetime,val),...]
+        Output
+        - data to be stored [(datetime,val,store_reason),...]
+        '''
+        output = []
+        for dt,value in data:
+            if not isinstance(value,Real):
+                continue
+            if self.last_dt is None:
+                reason = STORE_INITIAL
+            elif self.changed(value):
+                reason = STORE_CHANGE
+            elif self.heartbeat and (dt - self.last_dt >= self.heartbeat):
+                reason = STORE_HEARTBEAT
+            else:
+                continue
+
+            self.last_dt = dt
+            self.last_value = value
+            output.append((dt,value,reason))
+
+        return output
@@ -0,0 +1,278 @@
+'''
+Derived (virtual) measurements
+
+A derived sensor has measurements computed from measurements of other
+sensors, defined in the YAML configuration:
+
+derived:
+  - name: metcalc
+    measurements:
+      - {name: dewpoint, expression: 'dewpoint(tph1.air_temperature,tph1.relative_humidity)', units: C}
+      - {name: temp_f, expression: 'tph1.air_temperature*9/5 + 32', units: F}
+
+Inputs are written <sensor>.<measurement>. Expressions may use numbers,
++ - * / ** % //, comparisons and the functions in FUNCTIONS. Each
+expression is checked and compiled once into a function of NumPy arrays.
+
+Derived samples are computed when they are read (storage, getdata), for
+all input samples added since the last read in one vectorized call, so
+each sample costs a few array operations. A derived sample is made for
+each sample of the first input, with the other inputs taken as of the
+same timestamp (their latest sample at or before it; use a sample group
+for exact alignment). The newest sample waits until the other inputs
+have a sample at least as new. Samples where an input is missing or the
+result is not a finite number are skipped.
+'''
+
+import ast
+import threading
+from array import array
+from bisect import bisect_right
+from databear.sensors.sensor import Sensor
+from databear.samples import SampleBuffer
+from databear.errors import SensorConfigError
+
+#Functions available in expressions: {<name>:<numpy attribute>}
+FUNCTIONS = {
+    'abs':'abs', 'sqrt':'sqrt', 'exp':'exp', 'log':'log', 'log10':'log10',
+    'sin':'sin', 'cos':'cos', 'tan':'tan', 'arcsin':'arcsin', 'arccos':'arccos',
+    'arctan':'arctan', 'arctan2':'arctan2', 'degrees':'degrees', 'radians':'radians',
+    'minimum':'minimum', 'maximum':'maximum', 'where':'where', 'clip':'clip',
+    'floor':'floor', 'ceil':'ceil', 'round':'round'
+}
+CONSTANTS = ['pi','e']
+
+#Syntax allowed in expressions
+allowed_nodes = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name,
+    ast.Attribute, ast.Constant, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv,
+    ast.USub, ast.UAdd, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq
+)
+
+def dewpoint(temperature,rh):
+    '''
+    Dew point (C) from air temperature (C) and relative humidity (%),
+    Magnus formula
+    '''
+    import numpy as np
+    gamma = np.log(rh/100) + 17.62*temperature/(243.12 + temperature)
+    return 243.12*gamma/(17.62 - gamma)
+
+class InputRenamer(ast.NodeTransformer):
+    '''
+    Replace <sensor>.<measurement> with argument names
+    '''
+    def __init__(self):
+        self.inputs = [] #Form [(<sensor>,<measurement>),...]
+
+    def visit_Attribute(self,node):
+        if not isinstance(node.value,ast.Name):
+            raise SensorConfigError('Invalid input .{}'.format(node.attr))
+        key = (node.value.id,node.attr)
+        if key not in self.inputs:
+            self.inputs.append(key)
+        return ast.copy_location(
+            ast.Name(id='_input{}'.format(self.inputs.index(key)),ctx=ast.Load()),node)
+
+def parse_expression(expression):
+    '''
+    Check an expression
+    Returns (syntax tree with inputs renamed, [(<sensor>,<measurement>),...])
+    '''
+    try:
+        tree = ast.parse(expression,mode='eval')
+    except SyntaxError as err:
+        raise SensorConfigError('Invalid expression {}: {}'.format(expression,err))
+
+    for node in ast.walk(tree):
+        if not isinstance(node,allowed_nodes):
+            raise SensorConfigError('{} not allowed in expression {}'.format(
+                type(node).__name__,expression))
+        if isinstance(node,ast.Call) and not (
+                isinstance(node.func,ast.Name) and (
+                    (node.func.id in FUNCTIONS) or (node.func.id == 'dewpoint'))):
+            raise SensorConfigError('Unknown function in expression {}'.format(expression))
+        if isinstance(node,ast.Constant) and not isinstance(node.value,(int,float)):
+            raise SensorConfigError('Invalid constant in expression {}'.format(expression))
+
+    renamer = InputRenamer()
+    tree = renamer.visit(tree)
+    for node in ast.walk(tree):
+        if isinstance(node,ast.Name) and not (
+                node.id.startswith('_input') or (node.id in FUNCTIONS) or
+                (node.id in CONSTANTS) or (node.id == 'dewpoint')):
+            raise SensorConfigError('Unknown name {} in expression {}'.format(node.id,expression))
+    if not renamer.inputs:
+        raise SensorConfigError('Expression {} has no inputs'.format(expression))
+
+    return tree, renamer.inputs
+
+def input_names(expression):
+    '''
+    Inputs of an expression [(<sensor>,<measurement>),...]
+    '''
+    return parse_expression(expression)[1]
+
+def compile_expression(expression):
+    '''
+    Compile an expression
+    Returns (function of one array per input, [(<sensor>,<measurement>),...])
+    '''
+    import numpy as np
+
+    tree, inputs = parse_expression(expression)
+    arguments = ast.arguments(
+        posonlyargs=[],
+        args=[ast.arg(arg='_input{}'.format(i)) for i in range(len(inputs))],
+        kwonlyargs=[],kw_defaults=[],defaults=[])
+    function = ast.Expression(body=ast.Lambda(args=arguments,body=tree.body))
+    ast.fix_missing_locations(function)
+
+    namespace = {name:getattr(np,attr) for name,attr in FUNCTIONS.items()}
+    namespace.update({name:getattr(np,name) for name in CONSTANTS})
+    namespace['dewpoint'] = dewpoint
+    namespace['__builtins__'] = {}
+    return eval(compile(function,'<{}>'.format(expression),'eval'),namespace), inputs
+
+class DerivedMeasurement:
+    '''
+    A measurement computed from the sample buffers of other sensors
+    '''
+    def __init__(self,expression,sensors):
+        '''
+        Inputs
+        - expression: see module description
+        - sensors: {<sensor name>:Sensor} providing the inputs
+        '''
+        self.expression = expression
+        self.function, inputs = compile_expression(expression)
+        self.inputs = [] #Form [(Sensor,<measurement>),...]
+        for sensorname, measurement in inputs:
+            if (sensorname not in sensors) or (measurement not in sensors[sensorname].data):
+                raise SensorConfigError('Input {}.{} of {} not found'.format(
+                    sensorname,measurement,expression))
+            self.inputs.append((sensors[sensorname],measurement))
+        #Buffers are kept when samples are restored from the journal
+        self.buffers = [sensor.data[measurement] for sensor,measurement in self.inputs]
+        self.done = 0 #Samples of the first input already computed
+        self.ordered = True #False if the last update was not in time order
+
+    def arrays(self,buffer,start_ns=None):
+        '''
+        Timestamps and values of a buffer as NumPy arrays sorted by
+        time, from the last sample at or before start_ns if given.
+        Values that are not numbers are NaN.
+        Samples are copied since port workers may be adding to the buffer.
+        '''
+        import numpy as np
+        n = len(buffer)
+        first = 0
+        if buffer.ordered and (start_ns is not None):
+            first = max(bisect_right(buffer.timestamps,start_ns,0,n) - 1,0)
+        timestamps = np.array(buffer.timestamps[first:n],dtype=np.int64)
+        values = np.array(buffer.values[first:n],dtype=np.float64)
+        for i in list(buffer.objects):
+            if first <= i < n:
+                values[i - first] = np.nan
+        if not buffer.ordered:
+            order = np.argsort(timestamps,kind='stable')
+            timestamps, values = timestamps[order], values[order]
+        return timestamps, values
+
+    def update(self):
+        '''
+        Compute derived samples for new samples of the first input
+        Returns (timestamps,values) arrays of the new samples
+        '''
+        import numpy as np
+        buffers = self.buffers
+        first = buffers[0]
+        if len(first) < self.done:
+            #Buffer was cleared
+            self.done = 0
+        n = len(first)
+        start = self.done
+        timestamps = np.array(first.timestamps[start:n],dtype=np.int64)
+
+        #The newest sample waits for the other inputs to be measured.
+        #If they fail it is computed when the next sample arrives.
+        for buffer in buffers[1:]:
+            if len(timestamps) and (
+                    (not len(buffer)) or (buffer.timestamps[len(buffer) - 1] < timestamps[-1])):
+                n = n - 1
+                timestamps = timestamps[:-1]
+                break
+        self.done = n
+        self.ordered = first.ordered
+        if not len(timestamps):
+            return timestamps, timestamps.astype(np.float64)
+
+        arguments = []
+        for buffer in buffers:
+            if buffer is first:
+                values = np.array(first.values[start:n],dtype=np.float64)
+                for i in list(first.objects):
+                    if start <= i < n:
+                        values[i - start] = np.nan
+            else:
+                #Latest sample at or before each timestamp
+                itimes, ivalues = self.arrays(buffer,int(timestamps.min()))
+                index = np.searchsorted(itimes,timestamps,side='right') - 1
+                values = np.where(index >= 0,ivalues[np.maximum(index,0)],np.nan)
+            arguments.append(values)
+
+        with np.errstate(all='ignore'):
+            results = np.broadcast_to(
+                np.asarray(self.function(*arguments),dtype=np.float64),timestamps.shape)
+        valid = np.isfinite(results)
+        return timestamps[valid], results[valid]
+
+class DerivedSensor(Sensor):
+    '''
+    Virtual sensor with derived measurements. It is not measured,
+    samples are computed from its inputs when data is read.
+    '''
+    measurements = []
+    units = {}
+
+    def __init__(self,name,sn,address):
+        super().__init__(name,sn,address)
+        self.measurements = []
+        self.derived = {} #Form {<measurement>:DerivedMeasurement}
+        #Storage (run loop) and getdata commands (control thread) both update
+        self.lock = threading.Lock()
+
+    def addMeasurement(self,name,expression,sensors):
+        '''
+        Add a derived measurement with inputs from sensors {<name>:Sensor}
+        '''
+        self.derived[name] = DerivedMeasurement(expression,sensors)
+        if name not in self.measurements:
+            self.measurements.append(name)
+        self.data[name] = SampleBuffer()
+
+    def update(self):
+        '''
+        Compute samples added to the inputs since the last update
+        '''
+        with self.lock:
+            for name, derived in self.derived.items():
+                timestamps, values = derived.update()
+                self.data[name].record_many(
+                    array('d',values.tobytes()),
+                    array('q',timestamps.tobytes()),
+                    derived.ordered)
+
+    def measure(self):
+        self.update()
+
+    def getcurrentdata(self):
+        self.update()
+        return super().getcurrentdata()
+
+    def getdata(self,name,startdt,enddt):
+        self.update()
+        return super().getdata(name,startdt,enddt)
+
+dbsensor = DerivedSensor
@@ -0,0 +1,203 @@
+'''
+Store and forward uplink
+
+Each active forwarding destination is served by a Forwarder thread
+with its own database connection, so the logging loop is never blocked.
+The forwarder sends rows with data_id above the destination's high water
+mark (forward_destinations.last_data_id) in batches and only advances
+the mark after the transport confirms delivery. Sending resumes from the
+mark after a restart or power loss. Failed deliveries and database
+errors are logged and retried with exponential backoff.
+
+Payload (zlib compressed JSON):
+    {'destination':<name>,
+     'columns':['data_id','dtstamp','value','sensor','measurement',
+                'process','qc_flag','store_reason'],
+     'rows':[[...],...]}
+
+Transports are selected by URL scheme:
+- http://, https:// - HTTP POST with Content-Encoding: deflate
+- tcp://host:port - Length prefixed frames (4 byte big endian length).
+  The server replies with a frame containing b'OK' for each batch.
+Additional transports can be added with register_transport.
+'''
+
+from databear.databearDB import DataBearDB
+import threading
+import logging
+import socket
+import sqlite3
+import struct
+import json
+import zlib
+import urllib.request
+import urllib.parse
+
+columns = ['data_id','dtstamp','value','sensor','measurement',
+           'process','qc_flag','store_reason']
+
+class TransportError(Exception):
+    pass
+
+class HTTPTransport:
+    '''
+    Send payloads with HTTP POST
+    '''
+    def __init__(self,url,timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self,payload):
+        request = urllib.request.Request(
+            self.url,
+            data=payload,
+            headers={
+                'Content-Type':'application/json',
+                'Content-Encoding':'deflate'},
+            method='POST')
+        try:
+            with urllib.request.urlopen(request,timeout=self.timeout) as response:
+                if response.status >= 300:
+                    raise TransportError('HTTP status {}'.format(response.status))
+        except OSError as oe:
+            #URLError and HTTPError are both OSError
+            raise TransportError(str(oe))
+
+    def close(self):
+        pass
+
+class TCPTransport:
+    '''
+    Send length prefixed payloads over a persistent TCP connection
+    '''
+    def __init__(self,url,timeout=30):
+        parsed = urllib.parse.urlparse(url)
+        self.address = (parsed.hostname,parsed.port)
+        self.timeout = timeout
+        self.sock = None
+
+    def recvall(self,n):
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise TransportError('Connection closed')
+            data = data + chunk
+        return data
+
+    def send(self,payload):
+        try:
+            if not self.sock:
+                self.sock = socket.create_connection(self.address,timeout=self.timeout)
+            self.sock.sendall(struct.pack('>I',len(payload)) + payload)
+            length = struct.unpack('>I',self.recvall(4))[0]
+            ack = self.recvall(length)
+        except (OSError,TransportError) as err:
+            self.close()
+            raise TransportError(str(err))
+
+        if ack != b'OK':
+            raise TransportError('Batch not acknowledged: {}'.format(ack))
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+#Form {<url scheme>:<transport class>}
+transports = {
+    'http':HTTPTransport,
+    'https':HTTPTransport,
+    'tcp':TCPTransport
+}
+
+def register_transport(scheme,transportclass):
+    '''
+    Add a transport class for a URL scheme. The class is created
+    with the URL and must provide send(payload) and close()
+    '''
+    transports[scheme] = transportclass
+
+def get_transport(url):
+    scheme = urllib.parse.urlparse(url).scheme
+    transportclass = transports.get(scheme)
+    if not transportclass:
+        raise ValueError('No transport for {}'.format(url))
+    return transportclass(url)
+
+class Forwarder(threading.Thread):
+    '''
+    Forward data to a single destination
+    '''
+    def __init__(self,name,url,batch_size=1000,interval=5,backoff=1,maxbackoff=300):
+        '''
+        Inputs
+        - name: destination name in forward_destinations
+        - url: destination url
+        - batch_size: maximum rows per payload
+        - interval: seconds to wait for new data when caught up
+        - backoff/maxbackoff: initial and maximum seconds between retries
+        '''
+        super().__init__(name='forwarder-{}'.format(name),daemon=True)
+        self.destination = name
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.transport = get_transport(url)
+        self.stopevent = threading.Event()
+
+    def payload(self,rows):
+        msg = {
+            'destination':self.destination,
+            'columns':columns,
+            'rows':rows}
+        return zlib.compress(json.dumps(msg).encode('utf-8'))
+
+    def run(self):
+        #Use a separate connection from the logger
+        db = DataBearDB()
+        lastid = None
+
+        backoff = self.backoff
+        while not self.stopevent.is_set():
+            #Database errors (such as a locked database while the logger
+            #writes) are retried like failed deliveries
+            try:
+                if lastid is None:
+                    marks = {destination['name']:destination['last_data_id']
+                             for destination in db.getForwardDestinations()}
+                    lastid = marked = marks.get(self.destination,0)
+
+                rows = db.getForwardData(lastid,self.batch_size)
+                if rows:
+                    self.transport.send(self.payload(rows))
+                    lastid = rows[-1][0]
+
+                #A mark that failed to update is retried without sending again
+                if marked != lastid:
+                    db.setForwardMark(self.destination,lastid)
+                    marked = lastid
+
+                if not rows:
+                    self.stopevent.wait(self.interval)
+                    continue
+            except (TransportError,sqlite3.Error) as err:
+                logging.warning('Forwarding to {} failed, retry in {}s: {}'.format(
+                    self.destination,backoff,err))
+                self.stopevent.wait(backoff)
+                backoff = min(backoff*2,self.maxbackoff)
+                continue
+
+            backoff = self.backoff
+
+        self.transport.close()
+        db.close()
+
+    def stop(self):
+        '''
+        Stop forwarding and wait for the thread to end
+        '''
+        self.stopevent.set()
+        self.join()
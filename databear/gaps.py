@@ -0,0 +1,25 @@
+'''
+Missing data index
+
+Storage windows of a logging configuration without any samples are
+recorded in the gaps table as they are stored, so outages can be found
+without scanning the data table. Consecutive missing windows extend the
+same gap, so an outage is a single row. A gap is removed again if late
+data fills the window (see databear.lateness).
+
+DataBearDB.getAvailability sums the recorded gaps of each logging
+configuration over a time range.
+'''
+
+from datetime import timedelta
+
+#Values for gaps.reason
+GAP_NO_DATA = 1  #No samples in the storage window
+
+def gap_window(startdt,enddt,interval):
+    '''
+    Time range recorded as missing for a storage window
+    The first window after start up reaches back a day to include all
+    samples, only its last storage interval is recorded.
+    '''
+    return max(startdt,enddt - timedelta(seconds=interval)), enddt
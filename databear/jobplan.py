@@ -0,0 +1,31 @@
+'''
+Job plans
+
+When the configuration is loaded each scheduled job gets an immutable
+plan holding everything it needs: the Sensor object, the sample buffer,
+the process function and the storage settings of a logging
+configuration. Measurement and storage jobs use the plan directly, so
+running a job needs no lookups by name in the logger's dictionaries and
+no database access besides writing the stored rows.
+
+Plans are rebuilt on reload. Sample buffers are kept when samples are
+restored from the journal (SampleBuffer.reset) so plan references stay
+valid.
+'''
+
+from collections import namedtuple
+
+#Measurement job of one sensor
+#adaptive - AdaptiveRate or None
+MeasurePlan = namedtuple('MeasurePlan',['sensorname','sensor','interval','adaptive'])
+
+#Measurement job of a sample group
+#members - list of MeasurePlan, sensors are removed when stopped
+GroupPlan = namedtuple('GroupPlan',['groupname','interval','members'])
+
+#Storage job of one logging configuration
+#calculate - process function called as calculate(data,storetime)
+#deadband, latedata, recordtable, qc - settings of the configuration or None
+StoragePlan = namedtuple('StoragePlan',[
+    'logconfigid','name','sensorname','sensor','buffer','process','calculate',
+    'interval','deadband','latedata','recordtable','qc'])
@@ -0,0 +1,276 @@
+'''
+Crash-safe journal of in-memory samples
+
+When DBJOURNAL is set to a file path the logger appends every new sample
+of a stored measurement to the journal, and a checkpoint each time a
+logging configuration finishes a storage window. Records are buffered
+and written with a single write and fsync at most every DBJOURNALSYNC
+seconds (default 1), and right after storage so checkpoints reach disk
+with the stored data.
+
+On start up (and reload) the logger reads the journal, puts samples that
+were not yet stored back into the sensor buffers and continues storage
+from the last checkpoint, so a storage window spanning a restart or power
+cut is complete. When the file is larger than DBJOURNALSIZE bytes
+(default 16 MB) it is rewritten with only the samples still needed.
+
+The file starts with the 4 bytes JOURNAL_MAGIC followed by records.
+Record format (little endian)
+    0   c    type
+    1   I    payload length
+    5   I    CRC32 of type and payload
+    9        payload
+Types
+    K   key definition: H key id, UTF-8 '<sensor>\\0<measurement>'
+    S   sample: H key id, q timestamp (microseconds, see compression), d value
+    N   sample with value None: H key id, q timestamp
+    J   sample with other value: H key id, q timestamp, UTF-8 JSON value
+    C   checkpoint: I logging config id, q end of last stored window
+Reading stops at the first incomplete or corrupt record (torn write).
+A value that can't be written as JSON is journaled as None. A file that
+doesn't start with JOURNAL_MAGIC is not read or written.
+'''
+
+import os
+import struct
+import threading
+import zlib
+import json
+import time
+import logging
+from numbers import Real
+from databear.compression import to_microseconds, from_microseconds
+
+JOURNAL_MAGIC = b'DBJ\x02'
+recordheader = struct.Struct('<cII')
+keyrecord = struct.Struct('<H')
+samplerecord = struct.Struct('<Hqd')
+nonerecord = struct.Struct('<Hq')
+checkpointrecord = struct.Struct('<Iq')
+
+def encode_record(rtype,payload):
+    crc = zlib.crc32(rtype + payload)
+    return recordheader.pack(rtype,len(payload),crc) + payload
+
+def read_journal(path):
+    '''
+    Read a journal file without opening it for writing
+    Returns (samples,checkpoints,valid size,keys)
+    samples - {(<sensor>,<measurement>):[(datetime,value),...]}
+    checkpoints - {<logging config id>:datetime}
+    keys - {(<sensor>,<measurement>):<id>} defined in the file
+    Raises ValueError if the file is not a journal
+    '''
+    samples = {}
+    checkpoints = {}
+    keys = {} #Form {<id>:(<sensor>,<measurement>)}
+    filekeys = {}
+    try:
+        with open(path,'rb') as fin:
+            data = fin.read()
+    except FileNotFoundError:
+        return samples, checkpoints, 0, filekeys
+
+    if JOURNAL_MAGIC.startswith(data):
+        #Empty, or torn before the magic was written
+        return samples, checkpoints, 0, filekeys
+    if not data.startswith(JOURNAL_MAGIC):
+        raise ValueError('{} is not a DataBear journal'.format(path))
+
+    offset = len(JOURNAL_MAGIC)
+    while offset + recordheader.size <= len(data):
+        rtype, length, crc = recordheader.unpack_from(data,offset)
+        start = offset + recordheader.size
+        payload = data[start:start+length]
+        if (len(payload) < length) or (zlib.crc32(rtype + payload) != crc):
+            break
+        offset = start + length
+
+        if rtype == b'K':
+            keyid = keyrecord.unpack_from(payload)[0]
+            key = tuple(payload[keyrecord.size:].decode('utf-8').split('\0',1))
+            keys[keyid] = key
+            filekeys[key] = keyid
+        elif rtype == b'S':
+            keyid, ts, value = samplerecord.unpack(payload)
+            samples.setdefault(keys[keyid],[]).append((from_microseconds(ts),value))
+        elif rtype == b'N':
+            keyid, ts = nonerecord.unpack(payload)
+            samples.setdefault(keys[keyid],[]).append((from_microseconds(ts),None))
+        elif rtype == b'J':
+            keyid, ts = nonerecord.unpack_from(payload)
+            value = json.loads(payload[nonerecord.size:])
+            samples.setdefault(keys[keyid],[]).append((from_microseconds(ts),value))
+        elif rtype == b'C':
+            configid, ts = checkpointrecord.unpack(payload)
+            checkpoints[configid] = from_microseconds(ts)
+
+    return samples, checkpoints, offset, filekeys
+
+class Journal:
+    '''
+    Append only journal of samples and storage checkpoints
+    '''
+    def __init__(self,path,syncinterval=1,maxsize=16*1024*1024):
+        self.path = path
+        self.syncinterval = syncinterval
+        self.maxsize = maxsize
+        self.lock = threading.RLock()
+        self.pending = bytearray()
+        self.checkpointed = False #Checkpoints waiting for fsync
+        self.lastsync = time.monotonic()
+        self.keyids = {} #Form {(<sensor>,<measurement>):<id>}
+        self.lastsample = {} #Form {(<sensor>,<measurement>):<datetime>}
+        self.checkpoints = {} #Form {<logging config id>:<datetime>}
+        self.unencodable = set() #Keys with values journaled as None
+
+        #Read existing journal, dropping any torn record at the end
+        self.checkpoints, validsize = self.read()[1:]
+        self.file = open(self.path,'ab')
+        if self.file.tell() != validsize:
+            logging.warning('Journal {} truncated to {} bytes'.format(self.path,validsize))
+            self.file.truncate(validsize)
+            self.file.seek(validsize)
+        if not validsize:
+            self.file.write(JOURNAL_MAGIC)
+
+        #Continue key ids of the existing file
+        self.keyids = dict(self.filekeys)
+
+    def read(self):
+        '''
+        Read the journal file
+        Returns (samples,checkpoints,valid size), see read_journal
+        '''
+        samples, checkpoints, validsize, self.filekeys = read_journal(self.path)
+        return samples, checkpoints, validsize
+
+    def encodeSample(self,key,dt,value):
+        '''
+        Encode a sample, defining the key if needed
+        '''
+        output = b''
+        keyid = self.keyids.get(key)
+        if keyid is None:
+            keyid = len(self.keyids)
+            self.keyids[key] = keyid
+            keyname = '{}\0{}'.format(*key).encode('utf-8')
+            output = encode_record(b'K',keyrecord.pack(keyid) + keyname)
+
+        ts = to_microseconds(dt)
+        if value is None:
+            return output + encode_record(b'N',nonerecord.pack(keyid,ts))
+        if isinstance(value,Real):
+            return output + encode_record(b'S',samplerecord.pack(keyid,ts,value))
+        try:
+            payload = json.dumps(value).encode('utf-8')
+        except (TypeError,ValueError) as err:
+            if key not in self.unencodable:
+                self.unencodable.add(key)
+                logging.warning('{}:{} - Value journaled as None: {}'.format(key[0],key[1],err))
+            return output + encode_record(b'N',nonerecord.pack(keyid,ts))
+        return output + encode_record(b'J',nonerecord.pack(keyid,ts) + payload)
+
+    def publishSamples(self,sensor,measurements):
+        '''
+        Journal samples of sensor measurements newer than
+        those already journaled
+        '''
+        with self.lock:
+            for measurement in measurements:
+                key = (sensor.name,measurement)
+                last = self.lastsample.get(key)
+                newdata = []
+                for value in reversed(sensor.data.get(measurement,[])):
+                    if (last is not None) and (value[0] <= last):
+                        break
+                    newdata.append(value)
+
+                for dt, value in reversed(newdata):
+                    self.pending.extend(self.encodeSample(key,dt,value))
+                if newdata:
+                    self.lastsample[key] = newdata[0][0]
+
+    def replayed(self,key,dt):
+        '''
+        Mark samples up to dt as already journaled
+        '''
+        with self.lock:
+            last = self.lastsample.get(key)
+            if (last is None) or (dt > last):
+                self.lastsample[key] = dt
+
+    def checkpoint(self,configid,dt):
+        '''
+        Record that storage for a logging configuration
+        is complete up to dt
+        '''
+        with self.lock:
+            self.checkpoints[configid] = dt
+            self.pending.extend(encode_record(
+                b'C',checkpointrecord.pack(configid,to_microseconds(dt))))
+            self.checkpointed = True
+
+    def flush(self,force=False):
+        '''
+        Write and fsync pending records if the sync interval
+        has passed, checkpoints are pending or forced
+        '''
+        with self.lock:
+            now = time.monotonic()
+            due = (now - self.lastsync) >= self.syncinterval
+            if not self.pending or not (force or due or self.checkpointed):
+                return
+            self.file.write(self.pending)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = bytearray()
+            self.checkpointed = False
+            self.lastsync = now
+
+    @property
+    def size(self):
+        return self.file.tell()
+
+    def rotate(self,getsamples):
+        '''
+        Rewrite the journal with current checkpoints and
+        the samples returned by getsamples():
+            {(<sensor>,<measurement>):[(datetime,value),...]}
+        Pending records are replaced by the new file.
+        '''
+        with self.lock:
+            self.rewrite(getsamples())
+
+    def rewrite(self,samples):
+        '''
+        Replace the journal file with current checkpoints
+        and samples {(<sensor>,<measurement>):[(datetime,value),...]}
+        '''
+        with self.lock:
+            self.keyids = {}
+            self.pending = bytearray()
+            output = bytearray(JOURNAL_MAGIC)
+            for configid, dt in self.checkpoints.items():
+                output.extend(encode_record(
+                    b'C',checkpointrecord.pack(configid,to_microseconds(dt))))
+            for key, values in samples.items():
+                for dt, value in values:
+                    output.extend(self.encodeSample(key,dt,value))
+                if values:
+                    self.lastsample[key] = values[-1][0]
+
+            tmppath = self.path + '.tmp'
+            with open(tmppath,'wb') as fout:
+                fout.write(output)
+                fout.flush()
+                os.fsync(fout.fileno())
+            self.file.close()
+            os.replace(tmppath,self.path)
+            self.file = open(self.path,'ab')
+            self.checkpointed = False
+            self.lastsync = time.monotonic()
+
+    def close(self):
+        self.flush(force=True)
+        self.file.close()
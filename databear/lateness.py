@@ -0,0 +1,71 @@
+'''
+Late data handling for storage windows
+
+A storage job stores samples with last_time <= timestamp < scheduled_time.
+A measurement that started before scheduled_time but is still running
+(a slow bus read or a busy workerpool) adds samples to that window after
+it was processed. Logging configurations with allowed_lateness (seconds)
+handle this:
+- When the storage job runs and no measurement of the sensor that started
+  before the end of the window is in progress, the window is stored right
+  away. Otherwise storage waits until those measurements complete or
+  allowed_lateness has passed, whichever is first.
+- Samples that arrive after their window was stored are routed into it:
+  the window is processed again and its stored rows replaced. The last
+  maxwindows stored windows are kept for this; older late samples are
+  counted and dropped.
+'''
+
+import collections
+
+class LateData:
+    '''
+    Stored windows of a logging configuration
+    '''
+    def __init__(self,allowed_lateness,maxwindows=100):
+        '''
+        Inputs
+        - allowed_lateness: seconds to wait for measurements in progress
+        '''
+        self.allowed_lateness = allowed_lateness
+        self.windows = collections.deque(maxlen=maxwindows) #Form [[start,end,[<dtstamp>,...]],...]
+        self.checked = 0 #Samples in the sensor buffer already checked
+
+    def stored(self,startdt,enddt,dtstamps):
+        '''
+        Record a stored window and the timestamps of its rows
+        '''
+        self.windows.append([startdt,enddt,dtstamps])
+
+    def late(self,data):
+        '''
+        Check samples added to data [(datetime,value),...] since the last call
+        Returns (windows with late samples, late samples routed, late samples dropped)
+        '''
+        if len(data) < self.checked:
+            #Buffer was replaced, check all samples
+            self.checked = 0
+        newdata = data[self.checked:]
+        self.checked = len(data)
+
+        affected = []
+        routed = 0
+        dropped = 0
+        if not self.windows:
+            return affected, routed, dropped
+
+        lastend = self.windows[-1][1]
+        for dt, value in newdata:
+            if dt >= lastend:
+                #On time for a window not stored yet
+                continue
+            for window in self.windows:
+                if window[0] <= dt < window[1]:
+                    if window not in affected:
+                        affected.append(window)
+                    routed = routed + 1
+                    break
+            else:
+                dropped = dropped + 1
+
+        return affected, routed, dropped
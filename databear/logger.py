@@ -6,23 +6,56 @@ The DataBear data logger
 
 import databear.schedule as schedule
 import databear.process as processdata
-import databear.databearDB as databearDB
 from databear import sensorfactory
+from databear.adaptive import AdaptiveRate
+from databear.deadband import Deadband, STORE_INTERVAL
+from databear.lateness import LateData
+from databear.portworkers import PortWorkerPool, PortJob
+from databear.records import RecordBuffer, column_name
+from databear.qc import QualityControl, row_flags
+from databear.gaps import GAP_NO_DATA, gap_window
+from databear.jobplan import MeasurePlan, GroupPlan, StoragePlan
+from databear import snapshot
+from databear.samples import to_ns
+from databear.timeformat import TimestampFormatter, storage_timespec
+from databear import control
+from databear.subscriptions import SubscriptionManager
+from databear.metrics import registry
 from databear.errors import DataLogConfigError, MeasureError
 from databear.databearDB import DataBearDB
 from datetime import datetime, timedelta
-import concurrent.futures
+from numbers import Real
+import math
+import queue
 import threading #For IPC
 import selectors #For IPC via UDP
 import socket
 import json
 import time #For sleeping during execution
-import csv
-import sys #For command line args
 import logging
 import os
 import importlib
-
+import sqlite3
+
+
+#-------- Runtime Metrics ------
+measurements_attempted = registry.counter(
+    'databear_measurements_attempted_total','Measurements started',['sensor'])
+measurements_succeeded = registry.counter(
+    'databear_measurements_succeeded_total','Measurements completed without error',['sensor'])
+measurements_failed = registry.counter(
+    'databear_measurements_failed_total','Measurements completed with an error',['sensor'])
+measurements_skipped = registry.counter(
+    'databear_measurements_skipped_total','Measurements not started',['sensor','reason'])
+store_time = registry.histogram(
+    'databear_store_seconds','Time to process and store a storage window',['sensor'])
+rows_written = registry.counter(
+    'databear_rows_written_total','Rows written to the data table',['sensor','measurement'])
+missing_windows = registry.counter(
+    'databear_missing_windows_total','Storage windows without data',['sensor','measurement'])
+late_samples = registry.counter(
+    'databear_late_samples_total','Samples that arrived after their window was stored',
+    ['sensor','measurement','result'])
 
 #-------- Logger Initialization and Setup ------
 class DataLogger:
@@ -43,6 +76,23 @@ class DataLogger:
         #Initialize attributes
         self.sensors = {}
         self.portlocks = {}
+        self.adaptive = {} #Form {<sensor>:AdaptiveRate}
+        self.samplegroups = {} #Form {<group>:{'interval':<s>,'sensors':[<sensor>,...],'plan':GroupPlan}}
+        self.storageplans = {} #Form {<logging config id>:StoragePlan}
+        self.deadbands = {} #Form {<logging config id>:Deadband}
+        self.forwarders = []
+        self.ringbuffers = {} #Form {<sensor>:RingBufferWriter}
+        self.journalkeys = {} #Form {<sensor>:{<measurement>:[<logging config ids>]}}
+        self.latedata = {} #Form {<logging config id>:LateData}
+        self.recordtables = {} #Form {<logging config id>:(<record table>,<column>)}
+        self.records = RecordBuffer()
+        self.qcchecks = {} #Form {<logging config id>:QualityControl}
+        self.inflight = {} #Form {<sensor>:[<scheduled time>,...]}
+        self.inflightlock = threading.Lock()
+        self.pendingwindows = [] #Form [(<deadline>,(StoragePlan,<start>,<end>)),...]
+        self.completed = queue.SimpleQueue() #Sensors with completed measurements
+        self.results = queue.SimpleQueue() #Completed measurement jobs
+        self.wakeup = threading.Event() #Wake up the run loop
         self.loggersettings = [] #Form (<measurement>,<sensor>)
         self.logschedule = schedule.Scheduler()
 
@@ -67,14 +117,64 @@ class DataLogger:
         #Set up database connection
         self.db = DataBearDB()
 
+        #Cache the active configuration in a snapshot file if requested
+        self.snapshotpath = os.environ.get('DBSNAPSHOT')
+
+        #Journal samples to survive restarts if requested
+        self.journal = None
+        if 'DBJOURNAL' in os.environ:
+            from databear.journal import Journal
+            self.journal = Journal(
+                os.environ['DBJOURNAL'],
+                float(os.environ.get('DBJOURNALSYNC',1)),
+                int(os.environ.get('DBJOURNALSIZE',16*1024*1024)))
+
         #Configure UDP socket for API
         self.udpsocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        self.udpsocket.bind(('localhost',62000))
+        self.udpsocket.bind(control.tcp_address)
         self.udpsocket.setblocking(False)
         self.sel = selectors.DefaultSelector()
-        self.sel.register(self.udpsocket,selectors.EVENT_READ)
+        self.sel.register(self.udpsocket,selectors.EVENT_READ,self.readUDP)
+
+        #Configure framed control sockets for API
+        self.controlsockets = control.listen()
+        for csock in self.controlsockets:
+            self.sel.register(csock,selectors.EVENT_READ,self.acceptControl)
+
+        #Commands with streamed responses (framed control only)
+        #Form {<command>:<generator function of arg>}
+        self.streamcommands = {'query':self.queryData}
+        self.querychunk = 1000 #Rows per streamed frame
+        self.querydb = None
+
+        #Live data subscriptions (framed control only)
+        self.subscriptions = SubscriptionManager()
+        self.sel.register(
+            self.subscriptions.wakeup,
+            selectors.EVENT_READ,
+            self.subscriptions.flush)
+
         self.listen = False
         self.messages = []
+        self.profiler = None
+
+        #Metrics collected when scraped
+        self.workerpool = None
+        registry.gauge(
+            'databear_workerpool_queue_depth',
+            'Measurements waiting for a worker thread',
+            callback=self.queueDepth)
+        registry.gauge(
+            'databear_buffer_samples',
+            'Samples held in memory per sensor measurement',
+            ['sensor','measurement'],
+            callback=self.bufferSizes)
+
+        #Serve metrics over HTTP if requested
+        self.metricsserver = None
+        if 'DBMETRICSPORT' in os.environ:
+            from databear.metricsserver import MetricsServer
+            self.metricsserver = MetricsServer(int(os.environ['DBMETRICSPORT']))
 
         #Set up error logging
         logging.basicConfig(
@@ -83,38 +183,76 @@ class DataLogger:
             filename='databear_error.log'
             )
 
-    def register_sensors(self):
+    def queueDepth(self):
+        '''
+        Metrics callback: measurement jobs waiting in the workerpool
+        '''
+        if not self.workerpool:
+            return {}
+        return {():self.workerpool.qsize()}
+
+    def bufferSizes(self):
+        '''
+        Metrics callback: samples in memory per sensor measurement
+        '''
+        sizes = {}
+        for sensor in list(self.sensors.values()):
+            for measurement, values in sensor.data.items():
+                sizes[(sensor.name,measurement)] = len(values)
+        return sizes
+
+    def register_sensors(self,module_names=None):
         '''
-        Register all sensor classes in sensors_available with the factory
+        Register all sensor modules in sensors_available with the factory.
+        Modules are imported by the factory only for sensors in use.
+        module_names - optional list of modules, default from the database
         '''
-        #Get sensors from database
-        module_names = self.db.sensors_available
+        if module_names is None:
+            module_names = self.db.sensors_available
 
-        #Import all sensor classes
         for module_name in module_names:
-            sensor_module = importlib.import_module(module_name)
-            sensor_class = getattr(sensor_module,'dbsensor')
+            #Keep classes that were already imported
+            if module_name in sensorfactory.factory.sensortypes:
+                continue
 
-            #Register sensor with factory
+            #Register sensor module with factory
             sensorfactory.factory.register_sensor(
                 module_name,
-                sensor_class)
+                module_name)
 
     def loadconfig(self):
         '''
         Get configuration out of database and
         start sensors
         '''
+        #Get active configuration from the snapshot or database
+        config = snapshot.load_config(self.db,self.snapshotpath)
+
         #Register available sensors
-        self.register_sensors()
+        self.register_sensors(config['sensors_available'])
+        self.journalkeys = {}
+        self.latedata = {}
+        self.pendingwindows = []
+        self.samplegroups = {}
+        self.recordtables = {}
+        self.qcchecks = {}
+        self.storageplans = {}
         
-        #Get list of active sensors and logging
-        sensorids = self.db.getSensorIDs(activeonly=True)
-        loggingconfigs = self.db.getConfigIDs('logging',activeonly=True)
+        #Only run the sensors of this shard (see databear.supervisor)
+        sensorshards = None
+        if 'DBSHARD' in os.environ:
+            from databear.supervisor import assign_sensors
+            sensorshards = assign_sensors(config,int(os.environ['DBSHARDS']))
         
         #Configure logger
-        for sensorid in sensorids:
-            sensorsettings = self.db.getSensorConfig(sensorid)
+        derivedsensors = []
+        for sensorsettings in config['sensors']:
+            if sensorshards and (sensorshards[sensorsettings['name']] != int(os.environ['DBSHARD'])):
+                continue
+            if sensorsettings['module_name'] == 'databear.derived':
+                #Added once their input sensors exist
+                derivedsensors.append(sensorsettings)
+                continue
 
             self.addSensor(
                 sensorsettings['name'],
@@ -126,19 +264,39 @@ class DataLogger:
                 )
             self.scheduleMeasurement(
                 sensorsettings['name'],
-                sensorsettings['measure_interval']
+                sensorsettings['measure_interval'],
+                sensorsettings['adaptive_interval'],
+                sensorsettings['adaptive_threshold'],
+                sensorsettings['sample_group']
                 )
 
-        for loggingid in loggingconfigs:
-            storagesetting = self.db.getLoggingConfig(loggingid)
+        for sensorsettings in derivedsensors:
+            self.addDerivedSensor(
+                sensorsettings['name'],
+                sensorsettings['sensor_config_id'],
+                config['derived'][str(sensorsettings['sensor_id'])])
+
+        for storagesetting in config['logging']:
+            if sensorshards and (sensorshards[storagesetting['sensor_name']] != int(os.environ['DBSHARD'])):
+                #Sensor runs in another shard
+                continue
                 
             self.scheduleStorage(
-                loggingid,
+                storagesetting['logging_config_id'],
                 storagesetting['measurement_name'],
                 storagesetting['sensor_name'],
                 storagesetting['storage_interval'],
-                storagesetting['process'])
-                  
+                storagesetting['process'],
+                storagesetting['deadband'],
+                storagesetting['deadband_relative'],
+                storagesetting['heartbeat'],
+                storagesetting['allowed_lateness'],
+                storagesetting['record_table'],
+                storagesetting['qc'])
+
+        #Restore samples not yet stored before the restart
+        self.replayJournal()
+
     def addSensor(self,name,sn,address,virtualport,sensortype,sensorconfigid):
         '''
         Add a sensor to the logger
@@ -167,21 +325,117 @@ class DataLogger:
             sensor.connect(hardware_port)
 
         #Add sensor to collection
+        sensor.virtualport = virtualport
+        self.sensors[name] = sensor
+
+        #Publish live data to a shared ring buffer if requested
+        if 'DBRINGDIR' in os.environ:
+            from databear.ringbuffer import RingBufferWriter
+            oldring = self.ringbuffers.pop(name,None)
+            if oldring:
+                oldring.close()
+            self.ringbuffers[name] = RingBufferWriter(
+                os.path.join(os.environ['DBRINGDIR'],name + '.ring'),
+                sensor.measurements)
+
+    def addDerivedSensor(self,name,sensorconfigid,measurements):
+        '''
+        Add a derived sensor computing its measurements from
+        sensors of the logger (see databear.derived)
+        measurements - [{'name','expression',..},...] from getDerivedMeasurements
+        '''
+        sensor = sensorfactory.factory.get_sensor(
+            'databear.derived',
+            name,
+            name,
+            0
+            )
+        sensor.configid = sensorconfigid
+        sensor.virtualport = 'derived'
+        for derived in measurements:
+            sensor.addMeasurement(derived['name'],derived['expression'],self.sensors)
         self.sensors[name] = sensor
 
+    def journalStart(self,sensorname,measurement):
+        '''
+        Datetime of the oldest sample of a measurement that is not
+        stored by all of its logging configurations, None if unknown
+        '''
+        starts = []
+        for configid in self.journalkeys[sensorname][measurement]:
+            checkpoint = self.journal.checkpoints.get(configid)
+            if checkpoint is None:
+                return None
+            starts.append(checkpoint)
+        return min(starts)
+
+    def journalSamples(self):
+        '''
+        Samples needed to rewrite the journal
+        Returns {(<sensor>,<measurement>):[(datetime,value),...]}
+        '''
+        samples = {}
+        for sensorname, measurements in self.journalkeys.items():
+            sensor = self.sensors[sensorname]
+            for measurement in measurements:
+                start = self.journalStart(sensorname,measurement)
+                samples[(sensorname,measurement)] = [
+                    value for value in list(sensor.data[measurement])
+                    if (start is None) or (value[0] >= start)]
+        return samples
+
+    def replayJournal(self):
+        '''
+        Put journaled samples that are not yet stored
+        back into the sensor buffers
+        '''
+        if not self.journal:
+            return
+
+        self.journal.flush(force=True)
+        samples = self.journal.read()[0]
+        for sensorname, measurements in self.journalkeys.items():
+            sensor = self.sensors[sensorname]
+            for measurement in measurements:
+                key = (sensorname,measurement)
+                start = self.journalStart(sensorname,measurement)
+                values = [value for value in samples.get(key,[])
+                          if (start is None) or (value[0] >= start)]
+                if not values:
+                    continue
+
+                #Keep any newer samples already measured
+                lastdt = values[-1][0]
+                newer = [value for value in sensor.data[measurement] if value[0] > lastdt]
+                sensor.data[measurement].reset(values + newer)
+                self.journal.replayed(key,lastdt)
+                logging.info('{}:{} - Restored {} samples from journal'.format(
+                    sensorname,measurement,len(values)))
+
     def stopSensor(self,name):
         '''
         Stop sensor measurement and storage
         Input - sensor name
         '''
         successflag = 0
-        for job in self.logschedule.jobs:
+        for job in list(self.logschedule.jobs):
             jobsettings = job.getsettings()
-            #Extract sensor name
-            if jobsettings['function'] == 'doMeasurement':
-                sensorname = jobsettings['args'][0]
-            elif jobsettings['function'] == 'storeMeasurement':
-                sensorname = jobsettings['args'][1]
+            plan = jobsettings['args'][0]
+            if jobsettings['function'] == 'doGroupMeasurement':
+                #Sensors of a sample group share a job, cancelled with the last sensor
+                group = self.samplegroups[plan.groupname]
+                sensorname = None
+                if name in group['sensors']:
+                    group['sensors'].remove(name)
+                    plan.members[:] = [member for member in plan.members if member.sensorname != name]
+                    if plan.members:
+                        logging.warning('Shutdown sensor {}'.format(name))
+                        successflag = 1
+                    else:
+                        sensorname = name
+            else:
+                #Measurement and storage plans
+                sensorname = plan.sensorname
 
             #Cancel job if matches sensor name
             if sensorname == name:
@@ -191,70 +445,233 @@ class DataLogger:
 
         return successflag
     
+    def startForwarders(self):
+        '''
+        Start a forwarder thread for each active destination
+        When sharded only the first shard forwards data
+        '''
+        if os.environ.get('DBSHARD','0') != '0':
+            return
+
+        destinations = self.db.getForwardDestinations(activeonly=True)
+        if not destinations:
+            return
+
+        from databear.forwarder import Forwarder
+        for destination in destinations:
+            forwarder = Forwarder(
+                destination['name'],
+                destination['url'],
+                destination['batch_size'])
+            forwarder.start()
+            self.forwarders.append(forwarder)
+
+    def stopForwarders(self):
+        '''
+        Stop all forwarder threads
+        '''
+        for forwarder in self.forwarders:
+            forwarder.stop()
+        self.forwarders = []
+
     def reload(self):
         successflag = True
 
         # First stop all current jobs
-        for job in self.logschedule.jobs:
+        for job in list(self.logschedule.jobs):
             self.logschedule.cancel_job(job)
 
         # Then stop workerpool threads
         self.workerpool.shutdown()
+        self.endMeasurements()
+        self.stopForwarders()
+
+        # Store any windows waiting for measurements
+        if self.latedata:
+            self.finishWindows()
+        self.records.flush(self.db)
 
         # reload configuration, creating sensors as needed
         self.loadconfig()
+        self.startForwarders()
 
-        # lastly recreate workerpool based on new number of sensors
-        self.workerpool = concurrent.futures.ThreadPoolExecutor(
-            # use at least 1 worker
-            max_workers=max(len(self.sensors),1))
+        # lastly recreate workerpool, port workers start when first used
+        self.workerpool = PortWorkerPool(self.results,self.wakeup)
 
         return successflag
 
-    def scheduleMeasurement(self,sensorname,interval):
+    def scheduleMeasurement(self,sensorname,interval,adaptive_interval=None,adaptive_threshold=None,
+                            sample_group=None):
         '''
         Schedule a measurement:
         Interval is seconds
+        adaptive_interval - optional slowest interval for adaptive sampling.
+        The measurement is then scheduled at interval but only performed
+        when due (see databear.adaptive)
+        sample_group - optional group name. Sensors of a group are measured
+        by one job and their samples stamped with the scheduled time
         '''
         
         #Check interval to ensure it isn't too small
         if interval < self.sensors[sensorname].min_interval:
             raise DataLogConfigError('Logger frequency exceeds sensor max')
+
+        if sample_group:
+            if adaptive_interval:
+                raise DataLogConfigError(
+                    'Sensor {} in sample group {} can not use adaptive sampling'.format(
+                        sensorname,sample_group))
+            self.adaptive.pop(sensorname,None)
+
+            plan = MeasurePlan(sensorname,self.sensors[sensorname],interval,None)
+            group = self.samplegroups.get(sample_group)
+            if group:
+                if group['interval'] != interval:
+                    raise DataLogConfigError(
+                        'Sensors in sample group {} must have the same measure interval'.format(
+                            sample_group))
+                group['sensors'].append(sensorname)
+                group['plan'].members.append(plan)
+            else:
+                groupplan = GroupPlan(sample_group,interval,[plan])
+                self.samplegroups[sample_group] = {
+                    'interval':interval,'sensors':[sensorname],'plan':groupplan}
+                m = self.doGroupMeasurement
+                self.logschedule.every(interval).do(m,groupplan)
+            return
+
+        if adaptive_interval:
+            self.adaptive[sensorname] = AdaptiveRate(
+                interval,
+                adaptive_interval,
+                adaptive_threshold)
+        else:
+            self.adaptive.pop(sensorname,None)
         
         #Schedule measurement
+        plan = MeasurePlan(
+            sensorname,
+            self.sensors[sensorname],
+            interval,
+            self.adaptive.get(sensorname))
         m = self.doMeasurement
-        self.logschedule.every(interval).do(m,sensorname,interval)
+        self.logschedule.every(interval).do(m,plan)
     
-    def doMeasurement(self,sensorname,interval,scheduled_time,last_time):
+    def doMeasurement(self,plan,scheduled_time,last_time):
         '''
         Perform a measurement on a sensor
         Inputs
-        - Sensor name
-        - storetime and lasttime are not currently used here
-          but are passed by Schedule when this function is called.
+        - plan: MeasurePlan of the sensor
+        - scheduled_time is used to check the job is on time and
+          for adaptive sampling. last_time is not currently used here
+          but is passed by Schedule when this function is called.
         '''
         #Check to see if job is on time. Skip measurement if
         #current time - scheduled time is more than the measurement interval
         dtdiff = datetime.now() - scheduled_time
-        if dtdiff.total_seconds() > interval:
+        if dtdiff.total_seconds() > plan.interval:
             #Too late, skip measurement
-            logging.error('Skipping measurement for {}'.format(sensorname))
-        else:
-            mfuture = self.workerpool.submit(self.sensors[sensorname].measure)
-            mfuture.sname = sensorname
-            mfuture.add_done_callback(self.endMeasurement)
+            logging.error('Skipping measurement for {}'.format(plan.sensorname))
+            measurements_skipped.inc(sensor=plan.sensorname,reason='late')
+            return
+
+        #Adaptive sensors only measure when due
+        adaptiverate = plan.adaptive
+        if adaptiverate:
+            if not adaptiverate.due(scheduled_time):
+                measurements_skipped.inc(sensor=plan.sensorname,reason='adaptive')
+                return
+            #The rate is updated with the new samples by endMeasurement
+            adaptiverate.start(scheduled_time)
+
+        self.submitMeasurement(plan,scheduled_time)
+
+    def doGroupMeasurement(self,groupplan,scheduled_time,last_time):
+        '''
+        Measure all sensors of a sample group on one tick. Samples
+        are stamped with scheduled_time so measurements of the group
+        share a timestamp. Sensors on different ports run in parallel.
+        '''
+        dtdiff = datetime.now() - scheduled_time
+        if dtdiff.total_seconds() > groupplan.interval:
+            #Too late, skip measurement
+            logging.error('Skipping measurement for sample group {}'.format(groupplan.groupname))
+            for plan in groupplan.members:
+                measurements_skipped.inc(sensor=plan.sensorname,reason='late')
+            return
+
+        sampletime = to_ns(scheduled_time)
+        for plan in groupplan.members:
+            self.submitMeasurement(plan,scheduled_time,sampletime)
+
+    def submitMeasurement(self,plan,scheduled_time,sampletime=None):
+        '''
+        Hand a measurement to the worker of the sensor's port
+        '''
+        measurements_attempted.inc(sensor=plan.sensorname)
+        with self.inflightlock:
+            self.inflight.setdefault(plan.sensorname,[]).append(scheduled_time)
+        self.workerpool.submit(
+            plan.sensor.virtualport,
+            PortJob(plan.sensor,plan.sensorname,scheduled_time,sampletime))
+
+    def endMeasurements(self):
+        '''
+        Handle completed measurement jobs returned by the port workers
+        '''
+        while not self.results.empty():
+            self.endMeasurement(self.results.get())
+
+    def measuring(self,sensorname,enddt):
+        '''
+        True if a measurement of the sensor started
+        before enddt is in progress
+        '''
+        with self.inflightlock:
+            for scheduled_time in self.inflight.get(sensorname,[]):
+                if scheduled_time < enddt:
+                    return True
+        return False
         
     def endMeasurement(self,mfuture):
         '''
-        A callback after measurement is complete
+        Called by the run loop after measurement is complete
         Use to log any exceptions that occurred
-        input: mfuture - a futures object that gets passed when complete
+        input: mfuture - the completed PortJob
         '''
         #print(self.sensors[mfuture.sname])
 
         #Retrieve exception. Returns none is no exceptions
         merrors = mfuture.exception()
 
+        with self.inflightlock:
+            self.inflight[mfuture.sname].remove(mfuture.scheduled_time)
+        if self.latedata:
+            #Let the run loop finish waiting windows and check for late samples
+            self.completed.put(mfuture.sname)
+            self.wakeup.set()
+
+        #Adjust the adaptive rate with the new samples
+        adaptiverate = self.adaptive.get(mfuture.sname)
+        if adaptiverate:
+            adaptiverate.update(mfuture.sensor.data,mfuture.scheduled_time)
+
+        #Push new samples to any subscribers and ring buffer
+        if self.subscriptions.keys:
+            self.subscriptions.publishSamples(mfuture.sensor)
+        ringbuffer = self.ringbuffers.get(mfuture.sname)
+        if ringbuffer:
+            ringbuffer.publishSamples(mfuture.sensor)
+        if self.journal and (mfuture.sname in self.journalkeys):
+            self.journal.publishSamples(
+                mfuture.sensor,
+                self.journalkeys[mfuture.sname])
+
+        if merrors:
+            measurements_failed.inc(sensor=mfuture.sname)
+        else:
+            measurements_succeeded.inc(sensor=mfuture.sname)
+
         #Log exceptions
         if merrors:
             try:
@@ -263,101 +680,303 @@ class DataLogger:
                             merrors.sensor,
                             m,
                             merrors.messages[m]))
-            except:
-                raise RuntimeError(merrors)
+            except AttributeError:
+                #Not a MeasureError, runs in the run loop so log it
+                logging.error('{} - Measurement failed: {!r}'.format(mfuture.sname,merrors))
 
-    def scheduleStorage(self,configid,name,sensor,interval,process):
+    def scheduleStorage(self,configid,name,sensor,interval,process,
+                        deadband=None,deadband_relative=None,heartbeat=None,
+                        allowed_lateness=None,record_table=None,qc=None):
         '''
         Schedule when storage takes place
+        deadband, deadband_relative, heartbeat - optional change based
+        storage (see databear.deadband)
+        allowed_lateness - optional late data handling (see databear.lateness)
+        record_table - optional record table to store in (see databear.records)
+        qc - optional quality control settings (see databear.qc)
         '''
         #Check storage frequency doesn't exceed measurement frequency
         if interval < self.sensors[sensor].min_interval:
             raise DataLogConfigError('Storage frequency exceeds sensor measurement frequency')
+        if process not in processdata.processes:
+            raise DataLogConfigError('Unknown process {}'.format(process))
+        if name not in self.sensors[sensor].data:
+            raise DataLogConfigError('Sensor {} has no measurement {}'.format(sensor,name))
+
+        if (deadband is not None) or (deadband_relative is not None) or heartbeat:
+            self.deadbands[configid] = Deadband(deadband,deadband_relative,heartbeat)
+        else:
+            self.deadbands.pop(configid,None)
+
+        if record_table:
+            if process == 'Dump':
+                raise DataLogConfigError('Dump can not be stored in record table {}'.format(record_table))
+            if qc:
+                #Record tables have no qc_flag column
+                raise DataLogConfigError(
+                    'Quality control can not be used with record table {}'.format(record_table))
+            column = column_name(sensor,name,process)
+            self.db.createRecordTable(record_table,[column])
+            self.recordtables[configid] = (record_table,column)
+
+        if qc:
+            self.qcchecks[configid] = QualityControl(
+                qc.get('min'),qc.get('max'),qc.get('step'),
+                qc.get('persistence'),qc.get('gap'))
+        else:
+            self.qcchecks.pop(configid,None)
+
+        if allowed_lateness is not None:
+            self.latedata[configid] = LateData(allowed_lateness)
+
+        plan = StoragePlan(
+            configid,
+            name,
+            sensor,
+            self.sensors[sensor],
+            self.sensors[sensor].data[name],
+            process,
+            processdata.processes[process],
+            interval,
+            self.deadbands.get(configid),
+            self.latedata.get(configid),
+            self.recordtables.get(configid),
+            self.qcchecks.get(configid))
+        self.storageplans[configid] = plan
 
         s = self.storeMeasurement
         #Note: Some parameters for function supplied by Job class in Schedule
-        self.logschedule.every(interval).do(s,configid,name,sensor,process,interval)
+        job = self.logschedule.every(interval).do(s,plan)
 
-    def storeMeasurement(self,logconfigid,name,sensor,process,interval,scheduled_time,last_time):
+        if self.journal:
+            measurements = self.journalkeys.setdefault(sensor,{})
+            measurements.setdefault(name,[]).append(configid)
+
+            #Continue from the last stored window, at most one interval back
+            checkpoint = self.journal.checkpoints.get(configid)
+            if checkpoint:
+                job.last_run = max(
+                    checkpoint,
+                    job.next_run - timedelta(seconds=interval))
+
+    def storeMeasurement(self,plan,scheduled_time,last_time):
         '''
         Store measurement data according to process.
         Inputs
-        - logconfigid for database
-        - name: measurement name
-        - sensor: sensor name
-        - process: A valid process type
-        - interval: storage interval (used to determine temporal resolution)
+        - plan: StoragePlan of the logging configuration
         - storetime: datetime of the scheduled storage
         - lasttime: datetime of last storage event
-        - Process = 'average','min','max','dump','sample'
         '''
-
         #Deal with missing last time on start-up
         #Set to storetime - 1 day to ensure all data is included
         if not last_time:
             last_time = scheduled_time - timedelta(1)
 
+        #Wait for measurements in progress that can add data to the window
+        #Windows of a logging configuration are stored in order
+        latedata = plan.latedata
+        if latedata and latedata.allowed_lateness and (
+                self.measuring(plan.sensorname,scheduled_time) or
+                any(window[0] is plan for deadline,window in self.pendingwindows)):
+            deadline = scheduled_time + timedelta(seconds=latedata.allowed_lateness)
+            self.pendingwindows.append((deadline,(plan,last_time,scheduled_time)))
+            return
+
+        self.storeWindow(plan,last_time,scheduled_time)
+
+    def storeWindow(self,plan,startdt,enddt,final=True):
+        '''
+        Process and store data with startdt <= timestamp < enddt
+        plan - StoragePlan of the logging configuration
+        final - False when a window is stored again with late data
+        Returns list of datetime strings of the stored rows
+        '''
+        starttime = time.perf_counter()
+        scheduled_time = enddt
+        logconfigid = plan.logconfigid
+        name = plan.name
+        sensor = plan.sensorname
+        process = plan.process
+        interval = plan.interval
+        latedata = plan.latedata
+
         #Get datetimes associated with current storage and prior
-        data = self.sensors[sensor].getdata(name,last_time,scheduled_time)
+        data = plan.sensor.getdata(name,startdt,enddt)
 
         if not data:
             #No data found to be stored
             logging.warning(
                 '{}:{} - No data available for storage'.format(sensor,name))
-            return
-        
-        #Process data
-        storedata = processdata.calculate(process,data,scheduled_time)
+            if final:
+                gapformat = TimestampFormatter()
+                gapstart, gapend = gap_window(startdt,enddt,interval)
+                self.db.addGap(
+                    logconfigid,
+                    gapformat.format(gapstart),
+                    gapformat.format(gapend),
+                    GAP_NO_DATA)
+                missing_windows.inc(sensor=sensor,measurement=name)
+            if self.journal and final:
+                self.journal.checkpoint(logconfigid,scheduled_time)
+            if latedata and final:
+                latedata.stored(startdt,enddt,[])
+            return []
+
+        if not final:
+            #Late data may fill a window recorded as missing
+            gapformat = TimestampFormatter()
+            self.db.removeGap(logconfigid,gapformat.format(startdt),gapformat.format(enddt))
 
-        #Write data to database
-        if interval < 1:
-            tresolution = 'microseconds'
-        elif interval < 60:
-            tresolution = 'seconds'
+        #Process data
+        storedata = plan.calculate(data,scheduled_time)
+
+        #Failed readings (None, text or NaN) can't be stored
+        numeric = [(dt,val) for dt,val in storedata
+                   if isinstance(val,Real) and not math.isnan(val)]
+        if len(numeric) < len(storedata):
+            logging.warning('{}:{} - {} values that are not numbers not stored'.format(
+                sensor,name,len(storedata) - len(numeric)))
+            storedata = numeric
+
+        #Apply deadband or mark all rows as interval storage
+        deadband = plan.deadband
+        if deadband:
+            storedata = deadband.filter(storedata)
         else:
-            tresolution = 'minutes'
+            storedata = [(dt,val,STORE_INTERVAL) for dt,val in storedata]
+
+        #Flag rows with quality control checks of the window samples.
+        #A window stored again with late data is checked on its own.
+        qc = plan.qc
+        if qc:
+            timestamps, values = plan.buffer.arrays(
+                to_ns(startdt),to_ns(enddt))
+            flags = row_flags(
+                process,storedata,timestamps,qc.check(timestamps,values,carry=final))
+        else:
+            flags = [0]*len(storedata)
 
-        #Include microseconds if dump is used
-        if process == 'Dump':
-            tresolution = 'microseconds'
+        #Records are stamped with the storage time
+        recordtable = plan.recordtable
+        if recordtable:
+            storedata = [(scheduled_time,val,reason) for dt,val,reason in storedata]
 
-        for row in storedata:
-            dtstr = row[0].isoformat(sep=' ',timespec=tresolution)
+        dtstamps = []
+        #Write data to database
+        timeformat = TimestampFormatter(storage_timespec(process,interval))
+        for row, flag in zip(storedata,flags):
+            dtstr = timeformat.format(row[0])
             value = row[1]
+            dtstamps.append(dtstr)
+
+            if recordtable:
+                #Written with other columns of the record by the run loop
+                self.records.add(recordtable[0],recordtable[1],dtstr,value)
+                continue
 
             self.db.storeData(
                 dtstr,
                 value,
-                self.sensors[sensor].configid,
+                plan.sensor.configid,
                 logconfigid,
-                0)
+                flag,
+                row[2])
+        if self.journal and final:
+            self.journal.checkpoint(logconfigid,scheduled_time)
+        if latedata and final:
+            latedata.stored(startdt,enddt,dtstamps)
+        rows_written.inc(len(storedata),sensor=sensor,measurement=name)
+        store_time.observe(time.perf_counter() - starttime,sensor=sensor)
+
+        #Push stored data to any subscribers
+        if storedata and self.subscriptions.wants(sensor,name):
+            self.subscriptions.publish(
+                'stored',
+                sensor,
+                name,
+                [(row[0],row[1]) for row in storedata],
+                logging_config_id=logconfigid)
+
+        return dtstamps
+
+    def finishWindows(self):
+        '''
+        Store windows that were waiting for measurements in progress
+        and route samples that arrived after their window was stored
+        '''
+        sensornames = set()
+        while not self.completed.empty():
+            sensornames.add(self.completed.get())
+
+        now = datetime.now()
+        waiting = []
+        for deadline, window in self.pendingwindows:
+            if (now < deadline) and self.measuring(window[0].sensorname,window[2]):
+                waiting.append((deadline,window))
+            else:
+                self.storeWindow(*window)
+        self.pendingwindows = waiting
+
+        for logconfigid, latedata in self.latedata.items():
+            plan = self.storageplans[logconfigid]
+            name, sensor = plan.name, plan.sensorname
+            if sensor not in sensornames:
+                continue
+
+            affected, routed, dropped = latedata.late(plan.buffer)
+            if dropped or (affected and plan.deadband):
+                #Deadband state can't be replayed for an earlier window
+                if plan.deadband:
+                    dropped = dropped + routed
+                    routed = 0
+                    affected = []
+                logging.warning('{}:{} - {} late samples not stored'.format(sensor,name,dropped))
+                late_samples.inc(dropped,sensor=sensor,measurement=name,result='dropped')
+
+            recordtable = plan.recordtable
+            for window in affected:
+                if recordtable:
+                    self.records.flush(self.db)
+                    self.db.clearRecords(recordtable[0],recordtable[1],window[2])
+                else:
+                    self.db.deleteData(logconfigid,window[2])
+                window[2] = self.storeWindow(plan,window[0],window[1],final=False)
+            if routed:
+                logging.info('{}:{} - {} late samples stored'.format(sensor,name,routed))
+                late_samples.inc(routed,sensor=sensor,measurement=name,result='stored')
             
-    def listenUDP(self):
+    def listenControl(self):
         '''
-        Listen on UDP socket
+        Listen on the UDP and framed control sockets
         '''
         while self.listen:
-            #Check for UDP comm
-            event = self.sel.select(timeout=1)
-            if event:
-                self.readUDP()
-
-    def readUDP(self):
+            #Check for comm
+            events = self.sel.select(timeout=1)
+            for key, mask in events:
+                if isinstance(key.data,control.ControlConnection):
+                    self.readControl(key.data)
+                else:
+                    #Socket specific callback
+                    key.data(key.fileobj)
+
+        #Close framed control connections
+        for key in list(self.sel.get_map().values()):
+            if isinstance(key.data,control.ControlConnection):
+                key.data.close()
+        if self.querydb:
+            self.querydb.close()
+            self.querydb = None
+
+    def readUDP(self,sock):
         '''
         Read message, respond, add any messages
         to the message queue
         Message should be JSON
         {'command': <cmd> , 'arg': <optional argument>}
-
-        Commands
-        - status
-        - getdata
-            -- argument: sensor name
-        - stop
-            -- argument: sensor name
-        - shutdown
+        UDP responses are limited to a single datagram,
+        see readControl for the framed protocol
         '''
-        msgraw, address = self.udpsocket.recvfrom(1024)
+        msgraw, address = sock.recvfrom(65535)
 
         #Decode message
         try:
@@ -368,24 +987,186 @@ class DataLogger:
             msg = {}
             msg['command'] = 'invalid'
 
-        if msg['command'] == 'getdata':
+        if msg.get('command') in self.streamcommands:
+            response = {'response':'Command requires the framed control socket'}
+        else:
+            response = self.handleCommand(msg)
+            
+        #Send a response
+        sock.sendto(json.dumps(response).encode('utf-8'),address)
+
+    def acceptControl(self,sock):
+        '''
+        Accept a new framed control connection
+        '''
+        try:
+            conn, address = sock.accept()
+        except OSError:
+            return
+        cconn = control.ControlConnection(conn)
+        self.sel.register(conn,selectors.EVENT_READ,cconn)
+
+    def readControl(self,cconn):
+        '''
+        Read framed requests from a control connection
+        and respond to each in order
+        '''
+        requests = cconn.read()
+        if requests is None:
+            self.closeConnection(cconn)
+            return
+
+        try:
+            for msg in requests:
+                if msg.get('command') in self.streamcommands:
+                    frames = self.streamcommands[msg['command']](msg.get('arg'))
+                elif msg.get('command') == 'subscribe':
+                    frames = [self.subscribe(cconn,msg.get('arg'))]
+                elif msg.get('command') == 'unsubscribe':
+                    self.subscriptions.unsubscribe(cconn)
+                    frames = [{'response':'OK'}]
+                else:
+                    frames = [self.handleCommand(msg)]
+
+                for frame in frames:
+                    frame['id'] = msg.get('id')
+                    cconn.send(frame)
+        except OSError:
+            #Client went away
+            self.closeConnection(cconn)
+
+    def closeConnection(self,cconn):
+        '''
+        Close a framed control connection and its subscriptions
+        '''
+        self.subscriptions.unsubscribe(cconn)
+        self.sel.unregister(cconn.sock)
+        cconn.close()
+
+    def subscribe(self,cconn,arg):
+        '''
+        Subscribe a control connection to live data
+        arg - see databear.subscriptions
+        '''
+        try:
+            for sensorname, measurement in arg['measurements']:
+                if measurement not in self.sensors[sensorname].measurements:
+                    return {'response':'Invalid measurement {}:{}'.format(sensorname,measurement)}
+            self.subscriptions.subscribe(cconn,arg)
+        except (KeyError,TypeError,ValueError) as err:
+            return {'response':'Invalid subscription: {}'.format(err)}
+
+        return {'response':'OK'}
+
+    def queryData(self,arg):
+        '''
+        Stream stored data for a logging configuration or record table
+        arg = {'logging_config_id':<id>,'start':<datetime str>,'end':<datetime str>}
+           or {'record_table':<name>,'start':<datetime str>,'end':<datetime str>}
+        Yields frames {'rows':[[dtstamp,value,qc_flag,store_reason],...],'more':True/False}
+        Record table rows are [dtstamp,<value>,...] and the first frame
+        includes 'columns':['dtstamp',<column>,...]
+        '''
+        #Queries use a separate connection from the run loop
+        if not self.querydb:
+            self.querydb = DataBearDB()
+
+        try:
+            if 'record_table' in arg:
+                columns, rows = self.querydb.getRecords(arg['record_table'],arg['start'],arg['end'])
+                yield {'columns':columns,'rows':[],'more':True}
+            else:
+                rows = self.querydb.getData(arg['logging_config_id'],arg['start'],arg['end'])
+        except (KeyError,TypeError,sqlite3.Error) as err:
+            yield {'response':'Invalid query: {}'.format(err),'more':False}
+            return
+
+        for i in range(0,len(rows),self.querychunk):
+            yield {'rows':rows[i:i+self.querychunk],'more':True}
+        yield {'rows':[],'more':False}
+
+    def qcSummary(self,arg):
+        '''
+        Count stored rows with each quality control flag
+        arg = {'start':<datetime str>,'end':<datetime str>,'logging_config_id':<optional id>}
+        '''
+        if not self.querydb:
+            self.querydb = DataBearDB()
+
+        try:
+            summary = self.querydb.getQCSummary(
+                arg['start'],arg['end'],arg.get('logging_config_id'))
+        except (KeyError,TypeError,AttributeError,sqlite3.Error) as err:
+            return {'response':'Invalid query: {}'.format(err)}
+        return {'qc':summary}
+
+    def availability(self,arg):
+        '''
+        Data availability from the recorded gaps
+        arg = {'start':<datetime str>,'end':<datetime str>,'sensor':<optional name>}
+        '''
+        if not self.querydb:
+            self.querydb = DataBearDB()
+
+        try:
+            availability = self.querydb.getAvailability(arg['start'],arg['end'],arg.get('sensor'))
+        except (KeyError,TypeError,AttributeError,sqlite3.Error) as err:
+            return {'response':'Invalid query: {}'.format(err)}
+        return {'availability':availability}
+
+    def handleCommand(self,msg):
+        '''
+        Respond to a command message
+        {'command': <cmd> , 'arg': <optional argument>}
+
+        Commands
+        - status
+        - getdata
+            -- argument: sensor name
+        - getsensor
+            -- argument: sensor name
+        - stop
+            -- argument: sensor name
+        - reload
+        - metrics
+        - profile
+            -- argument: seconds to profile (default 30)
+               or 'stop' to end profiling early
+        - qcsummary
+            -- argument: {'start','end','logging_config_id' (optional)}
+        - availability
+            -- argument: {'start','end','sensor' (optional)}
+        - shutdown
+        Framed control connections also support query,
+        subscribe and unsubscribe
+        '''
+        try:
+            return self.runCommand(msg)
+        except Exception as err:
+            logging.error('Command {} failed: {}'.format(msg,err))
+            return {'response':'Command failed: {}'.format(err)}
+
+    def runCommand(self,msg):
+        command = msg.get('command')
+        if command == 'getdata':
             sensorname = msg['arg']
             data = self.sensors[sensorname].getcurrentdata()
             #Convert to JSON appropriate
             response = {}
+            timeformat = TimestampFormatter('minutes')
             for name, val in data.items():
                 if val:
-                    dtstr = val[0].strftime('%Y-%m-%d %H:%M')
+                    dtstr = timeformat.format(val[0])
                     response[name] = (dtstr,val[1])
                 else:
                     response[name] = val 
                     
-        elif msg['command'] == 'status':
+        elif command == 'status':
             #Get active sensor names
             sensornames = list(self.sensors.keys())
             response = {'status':'running','sensors':sensornames}
         
-        elif msg['command'] == 'getsensor':
+        elif command == 'getsensor':
             '''
             Return {'measurements':[(measure1,units1),(...)]}
             '''
@@ -398,16 +1179,48 @@ class DataLogger:
 
             response = {'measurements':measurelist}
 
-        elif msg['command'] == 'shutdown':
-            self.messages.append(msg['command'])
+        elif command == 'metrics':
+            response = {'metrics':registry.render()}
+
+        elif command == 'profile':
+            if msg.get('arg') == 'stop':
+                if self.profiler:
+                    #Outputs are written by the run loop
+                    self.profiler.expire()
+                    self.wakeup.set()
+                    response = {'response':'OK','files':self.profiler.outputs}
+                else:
+                    response = {'response':'Profiling not running'}
+            elif self.profiler:
+                response = {'response':'Profiling already running'}
+            else:
+                duration = float(msg.get('arg') or 30)
+                prefix = 'databear_profile_{}'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+                if 'DBSHARD' in os.environ:
+                    #Shards profile at the same time in the same directory
+                    prefix = '{}.shard{}'.format(prefix,os.environ['DBSHARD'])
+                from databear.profiler import Profiler
+                self.profiler = Profiler(duration,os.path.abspath(prefix))
+                #Profiling is started by the run loop
+                self.messages.append(command)
+                response = {'response':'OK','duration':duration,'files':self.profiler.outputs}
+
+        elif command == 'qcsummary':
+            response = self.qcSummary(msg.get('arg'))
+
+        elif command == 'availability':
+            response = self.availability(msg.get('arg'))
+
+        elif command == 'shutdown':
+            self.messages.append(command)
             response = {'response':'OK'}
-        elif msg['command'] == 'stop':
+        elif command == 'stop':
             success = self.stopSensor(msg['arg'])
             if success:
                 response = {'response':'OK'}
             else:
                 response = {'response':'Sensor not found'}
-        elif msg['command'] == 'reload':
+        elif command == 'reload':
             success = self.reload()
             if success:
                 response = {'response':'OK'}
@@ -415,9 +1228,20 @@ class DataLogger:
                 response = {'response':'Reload failed'}
         else:
             response = {'response':'Invalid Command'}
-            
-        #Send a response
-        self.udpsocket.sendto(json.dumps(response).encode('utf-8'),address)
+
+        return response
+
+    def closeControl(self):
+        '''
+        Close the UDP and framed control sockets
+        '''
+        self.udpsocket.close()
+        for csock in self.controlsockets:
+            csock.close()
+        self.subscriptions.close()
+        path = control.unix_path()
+        if path and os.path.exists(path):
+            os.remove(path)
 
     def run(self):
         '''
@@ -427,29 +1251,60 @@ class DataLogger:
         #Load configuration
         self.loadconfig()
 
-        #Start listening for UDP
+        #Start forwarding data to any destinations
+        self.startForwarders()
+
+        if self.metricsserver:
+            self.metricsserver.start()
+
+        #Start listening for UDP and framed control
         self.listen = True
-        t = threading.Thread(target=self.listenUDP)
+        t = threading.Thread(target=self.listenControl)
         t.start()
 
-        #Create threadpool for concurrent sensor measurement
-        self.workerpool = concurrent.futures.ThreadPoolExecutor(
-            # use at least 1 worker
-            max_workers=max(len(self.sensors),1))
+        #Create port workers for concurrent sensor measurement
+        self.workerpool = PortWorkerPool(self.results,self.wakeup)
 
         logging.info('Starting run loop')
         exiting = False
         while not exiting:
             try:
+                self.wakeup.clear()
+                self.endMeasurements()
                 self.logschedule.run_pending()
                 sleeptime = self.logschedule.idle_seconds
 
+                #Late data handling
+                if self.latedata:
+                    self.finishWindows()
+                    for deadline, window in self.pendingwindows:
+                        sleeptime = min(sleeptime,(deadline - datetime.now()).total_seconds())
+
+                #Write records stored during this pass
+                if self.records.pending:
+                    self.records.flush(self.db)
+
+                #Write journal, rewriting it when too large
+                if self.journal:
+                    self.journal.flush()
+                    if self.journal.size > self.journal.maxsize:
+                        self.journal.rotate(self.journalSamples)
+
+                #Stop profiling when done
+                if self.profiler and self.profiler.expired:
+                    outputs = self.profiler.stop()
+                    logging.info('Profile written to {}'.format(outputs))
+                    self.profiler = None
+
                 #Check for messages
                 if self.messages:
                     msg = self.messages.pop()
-                    if msg == 'shutdown':
+                    if msg == 'profile':
+                        self.profiler.start()
+                    elif msg == 'shutdown':
                         #Shut down threads
                         self.workerpool.shutdown()
+                        self.stopForwarders()
                         self.listen=False
                         t.join() #Wait for thread to end
                         print('Shutting down')
@@ -461,11 +1316,12 @@ class DataLogger:
                 #Sleep for maximum of 1 sec
                 if sleeptime > 1: sleeptime = 1
                 if sleeptime < 0: sleeptime = 0
-                time.sleep(sleeptime)
+                self.wakeup.wait(sleeptime)
                 
             except KeyboardInterrupt:
                 #Shut down threads
                 self.workerpool.shutdown()
+                self.stopForwarders()
                 self.listen=False
                 t.join() #Wait for thread to end
                 print('Shutting down')
@@ -474,12 +1330,31 @@ class DataLogger:
                 #Handle any other exception so threads
                 #don't keep running
                 self.workerpool.shutdown()
+                self.stopForwarders()
                 self.listen=False
                 t.join() #Wait for thread to end
                 raise
 
 
-        #Close database after stopping
+        #Handle measurements completed during shutdown and
+        #store any windows waiting for them
+        self.endMeasurements()
+        if self.latedata:
+            self.finishWindows()
+        self.records.flush(self.db)
+
+        #Write any profile in progress
+        if self.profiler:
+            self.profiler.stop()
+
+        #Close control sockets and database after stopping
+        if self.metricsserver:
+            self.metricsserver.stop()
+        for ringbuffer in self.ringbuffers.values():
+            ringbuffer.close()
+        if self.journal:
+            self.journal.close()
+        self.closeControl()
         self.db.close()
       
             
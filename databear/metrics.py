@@ -0,0 +1,197 @@
+'''
+Runtime metrics for DataBear
+
+A small metrics registry rendered in the Prometheus text
+exposition format (version 0.0.4). Metrics are available:
+- Using the 'metrics' command on the control socket
+- Over HTTP (GET /metrics) when DBMETRICSPORT is set (see metricsserver)
+
+Metrics are created from the module level registry:
+    rows = registry.counter('databear_rows_written_total','Rows written',['sensor'])
+    rows.inc(sensor='tph1')
+
+Gauges can be given a callback returning {<label values tuple>:<value>}
+that is called each time metrics are rendered.
+'''
+
+import threading
+import logging
+import time
+import os
+
+class Metric:
+    '''
+    Base class for a metric family
+    '''
+    metrictype = 'untyped'
+
+    def __init__(self,name,description,labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = {} #Form {<label values tuple>:<value>}
+        self.lock = threading.Lock()
+
+    def key(self,labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def labelstr(self,key,extra=None):
+        pairs = list(zip(self.labelnames,key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for name,value in pairs:
+            value = value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+            escaped.append('{}="{}"'.format(name,value))
+        return '{' + ','.join(escaped) + '}'
+
+    def samples(self):
+        '''
+        Return [(name,labelstr,value),...]
+        '''
+        with self.lock:
+            return [(self.name,self.labelstr(key),value) for key,value in self.values.items()]
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name,self.description),
+            '# TYPE {} {}'.format(self.name,self.metrictype)]
+        for name,labels,value in self.samples():
+            lines.append('{}{} {}'.format(name,labels,repr(float(value))))
+        return lines
+
+class Counter(Metric):
+    metrictype = 'counter'
+
+    def inc(self,amount=1,**labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key,0) + amount
+
+class Gauge(Metric):
+    metrictype = 'gauge'
+
+    def __init__(self,name,description,labelnames=(),callback=None):
+        super().__init__(name,description,labelnames)
+        self.callback = callback
+
+    def set(self,value,**labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.callback:
+            try:
+                values = self.callback()
+            except Exception as err:
+                logging.warning('Metric {} callback failed: {}'.format(self.name,err))
+                values = {}
+            with self.lock:
+                self.values = {tuple(str(v) for v in key):value for key,value in values.items()}
+        return super().samples()
+
+class Histogram(Metric):
+    metrictype = 'histogram'
+    defaultbuckets = (0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+
+    def __init__(self,name,description,labelnames=(),buckets=defaultbuckets):
+        super().__init__(name,description,labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self,value,**labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                #Form [<bucket counts>...,<sum>,<count>]
+                counts = [0]*len(self.buckets) + [0.0,0]
+                self.values[key] = counts
+            for i,bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        output = []
+        with self.lock:
+            for key,counts in self.values.items():
+                for i,bound in enumerate(self.buckets):
+                    output.append((self.name + '_bucket',self.labelstr(key,('le',repr(float(bound)))),counts[i]))
+                output.append((self.name + '_bucket',self.labelstr(key,('le','+Inf')),counts[-1]))
+                output.append((self.name + '_sum',self.labelstr(key),counts[-2]))
+                output.append((self.name + '_count',self.labelstr(key),counts[-1]))
+        return output
+
+class Timer:
+    '''
+    Context manager observing elapsed seconds in a histogram
+    '''
+    def __init__(self,histogram,**labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.histogram.observe(time.perf_counter() - self.start,**self.labels)
+
+class Registry:
+    '''
+    A collection of metrics
+    '''
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self,metric):
+        '''
+        Add a metric, replacing any metric with the same name
+        '''
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self,name,description,labelnames=()):
+        return self.register(Counter(name,description,labelnames))
+
+    def gauge(self,name,description,labelnames=(),callback=None):
+        return self.register(Gauge(name,description,labelnames,callback))
+
+    def histogram(self,name,description,labelnames=(),buckets=Histogram.defaultbuckets):
+        return self.register(Histogram(name,description,labelnames,buckets))
+
+    def render(self):
+        '''
+        Return all metrics in text exposition format
+        '''
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def process_rss():
+    '''
+    Resident set size of this process in bytes
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError,ValueError,AttributeError):
+        #Not Linux, fall back to peak RSS
+        import resource
+        import sys
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+#Default registry used by DataBear
+registry = Registry()
+registry.gauge('databear_process_rss_bytes','Resident memory of the logger process',
+               callback=lambda: {():process_rss()})
@@ -0,0 +1,42 @@
+'''
+HTTP endpoint for DataBear metrics
+Serves the metrics registry at /metrics. Kept separate from
+databear.metrics so http.server is only imported when used.
+'''
+
+import threading
+import http.server
+from databear.metrics import registry
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/','/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+class MetricsServer:
+    '''
+    Serve a registry over HTTP from a background thread
+    '''
+    def __init__(self,port,host='localhost',metricsregistry=registry):
+        self.server = http.server.ThreadingHTTPServer((host,port),MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = metricsregistry
+        self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,184 @@
+'''
+Measurement workers, one thread per virtual port
+
+Each virtual port has a single I/O thread that runs the measurements of
+the sensors on that port, so a site with many sensors on a few ports only
+uses a few threads and sensors on a port never contend for it. Jobs are
+handed to a port worker and completed jobs returned to the run loop
+through queue.SimpleQueue, which needs no Python level locking.
+
+Bus sensors (see databear.sensors.sensor.BusSensor) are run in two steps:
+startMeasure, then readMeasure after the wait it returns. While waiting
+the worker runs other jobs on the port, so concurrent measurements on a
+bus still overlap. Other sensors are measured with measure().
+
+Jobs of a sample group carry the shared time of the measurement, which
+is set as sensor.sampletime while the sensor runs so its samples are
+stamped with it (see Sensor.record and BusSensor.measuretime). Samples
+a sensor appends itself with another time are not aligned, a warning is
+logged once for each such sensor.
+'''
+
+import threading
+import queue
+import heapq
+import time
+import itertools
+import logging
+from databear.sensors.sensor import BusSensor
+from databear.samples import from_ns
+
+unaligned = set() #Sensors warned for samples without the shared time
+
+def check_aligned(job):
+    '''
+    Warn if a sample group measurement added samples
+    newer than the shared time of the job
+    '''
+    sensor = job.sensor
+    if job.sname in unaligned:
+        return
+    sampletime = from_ns(job.sampletime)
+    for measurement, values in sensor.data.items():
+        if len(values) and (values[-1][0] > sampletime):
+            unaligned.add(job.sname)
+            logging.warning('{}:{} - Samples are not stamped with the sample group time, '
+                            'use record() to align them'.format(job.sname,measurement))
+            return
+
+class PortJob:
+    '''
+    A measurement of a sensor. Provides exception() like
+    the futures of concurrent.futures.
+    '''
+    def __init__(self,sensor,sname,scheduled_time,sampletime=None):
+        '''
+        sampletime - optional timestamp (ns) for all samples of the job
+        '''
+        self.sensor = sensor
+        self.sname = sname
+        self.scheduled_time = scheduled_time
+        self.sampletime = sampletime
+        self.error = None
+
+    def exception(self):
+        return self.error
+
+class PortWorker(threading.Thread):
+    '''
+    Run measurement jobs of one virtual port
+    '''
+    def __init__(self,port,results,wakeup=None):
+        '''
+        Inputs
+        - results: SimpleQueue receiving completed jobs
+        - wakeup: optional threading.Event set when a job completes
+        '''
+        super().__init__(name='port-{}'.format(port),daemon=True)
+        self.port = port
+        self.jobs = queue.SimpleQueue()
+        self.results = results
+        self.wakeup = wakeup
+        self.reads = [] #Bus reads waiting, heap of (due,sequence,job,start datetime)
+        self.sequence = itertools.count()
+
+    def submit(self,job):
+        self.jobs.put(job)
+
+    def finish(self,job,error=None):
+        if job.sampletime and (error is None):
+            check_aligned(job)
+        job.error = error
+        self.results.put(job)
+        if self.wakeup:
+            self.wakeup.set()
+
+    def start_job(self,job):
+        sensor = job.sensor
+        twostep = isinstance(sensor,BusSensor) and (type(sensor).measure is BusSensor.measure)
+        sensor.sampletime = job.sampletime
+        try:
+            if not twostep:
+                sensor.measure()
+                self.finish(job)
+                return
+
+            dt = sensor.measuretime()
+            wait = sensor.startMeasure() or 0
+            due = time.monotonic() + wait
+            heapq.heappush(self.reads,(due,next(self.sequence),job,dt))
+        except Exception as err:
+            self.finish(job,err)
+        finally:
+            sensor.sampletime = None
+
+    def read_job(self,job,dt):
+        job.sensor.sampletime = job.sampletime
+        try:
+            job.sensor.readMeasure(dt)
+            self.finish(job)
+        except Exception as err:
+            self.finish(job,err)
+        finally:
+            job.sensor.sampletime = None
+
+    def run(self):
+        stopping = False
+        while (not stopping) or self.reads:
+            #Run bus reads that are due
+            while self.reads and (self.reads[0][0] <= time.monotonic()):
+                due, sequence, job, dt = heapq.heappop(self.reads)
+                self.read_job(job,dt)
+
+            timeout = None
+            if self.reads:
+                timeout = max(self.reads[0][0] - time.monotonic(),0)
+            if stopping:
+                #Finish bus reads in progress
+                if self.reads:
+                    time.sleep(timeout)
+                continue
+
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            if job is None:
+                stopping = True
+                continue
+            self.start_job(job)
+
+class PortWorkerPool:
+    '''
+    Port workers of a logger, created when a port is first used
+    '''
+    def __init__(self,results,wakeup=None):
+        self.results = results
+        self.wakeup = wakeup
+        self.workers = {} #Form {<virtual port>:PortWorker}
+
+    def submit(self,port,job):
+        worker = self.workers.get(port)
+        if not worker:
+            worker = PortWorker(port,self.results,self.wakeup)
+            worker.start()
+            self.workers[port] = worker
+        worker.submit(job)
+        return job
+
+    def qsize(self):
+        '''
+        Jobs waiting to start on all ports
+        '''
+        return sum(worker.jobs.qsize() for worker in self.workers.values())
+
+    def shutdown(self):
+        '''
+        Finish queued jobs and stop all workers
+        '''
+        for worker in self.workers.values():
+            worker.jobs.put(None)
+        for worker in self.workers.values():
+            worker.join()
+        self.workers = {}
@@ -6,10 +6,11 @@ General Algorithm
 1. Store data following process type
 2. Clear data associated with storage from memory
 
+NumPy is imported by the functions that use it when first
+needed, to keep logger start up fast.
 '''
 
 from datetime import datetime
-import numpy as np
 
 
 def calculate(processtype,data,storetime):
@@ -22,21 +23,8 @@ def calculate(processtype,data,storetime):
     Output:
         - list of data to be stored [(datetime,val),...]
     '''
-    if processtype=='Dump':
-        output = dump(data)
-    elif processtype=='Sample':
-        output = sample(data)
-    elif processtype=='Average':
-        output = average(data,storetime)
-    elif processtype=='Max':
-        output = datamax(data,storetime)
-    elif processtype=='Min':
-        output = datamin(data,storetime)
-    else:
-        raise KeyError(processtype)
-
-    return output
-    
+    return processes[processtype](data,storetime)
+
 
 def dump(data):
     '''
@@ -65,6 +53,8 @@ def average(data,storetime):
     Average input data
     Assumes data is evenly spaced
     '''
+    import numpy as np
+
     #Extract values to list
     vals = [x[1] for x in data]
     datanp = np.array(vals)
@@ -81,6 +71,8 @@ def datamax(data,storetime):
     '''
     Output max
     '''
+    import numpy as np
+
     #Extract values to list
     vals = [x[1] for x in data]
     datanp = np.array(vals)
@@ -97,6 +89,8 @@ def datamin(data,storetime):
     '''
     Output min
     '''
+    import numpy as np
+
     #Extract values to list
     vals = [x[1] for x in data]
     datanp = np.array(vals)
@@ -109,13 +103,45 @@ def datamin(data,storetime):
 
     return [(dt,dAve)]
 
-
-
-   
-
-
-
-
-
-
-
+def calculate_windows(processtype,timestamps,values,interval):
+    '''
+    Vectorized calculate for many storage windows, used to
+    replay raw data (see databear.replay)
+    Inputs:
+        - timestamps - NumPy array of sample times (ns) in time order
+        - values - NumPy array of sample values
+        - interval - storage interval (ns). Windows are
+          k*interval <= timestamp < (k+1)*interval and stored
+          at their end time like the logger's storage jobs
+    Output:
+        - (timestamps,values) NumPy arrays of the rows to be stored
+    '''
+    import numpy as np
+
+    if (processtype == 'Dump') or not len(values):
+        return timestamps, values
+
+    #Index of the first sample of each window with data
+    windows = timestamps//interval
+    starts = np.flatnonzero(np.diff(windows,prepend=windows[0] - 1))
+    if processtype == 'Sample':
+        return timestamps[starts], values[starts]
+
+    storetimes = (windows[starts] + 1)*interval
+    if processtype == 'Average':
+        counts = np.diff(np.append(starts,len(values)))
+        return storetimes, np.add.reduceat(values,starts)/counts
+    elif processtype == 'Max':
+        return storetimes, np.maximum.reduceat(values,starts)
+    elif processtype == 'Min':
+        return storetimes, np.minimum.reduceat(values,starts)
+    raise KeyError(processtype)
+
+#Process functions by process type, called as function(data,storetime)
+processes = {
+    'Dump':lambda data,storetime: dump(data),
+    'Sample':lambda data,storetime: sample(data),
+    'Average':average,
+    'Max':datamax,
+    'Min':datamin
+}
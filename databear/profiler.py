@@ -0,0 +1,111 @@
+'''
+Profiling a running logger
+
+The profile command starts a Profiler for a number of seconds:
+- A sampling thread records the stacks of all threads (scheduler loop,
+  measurement workers, listener, forwarders) and writes them in
+  collapsed stack format (<prefix>.collapsed), one line per unique
+  stack: "<thread>;<outer frame>;...;<inner frame> <samples>".
+  This can be used directly by flamegraph tools.
+- cProfile records per function timings of the run loop thread, which
+  runs the scheduler and database writes (<prefix>.pstats).
+
+'profile stop' ends a run early. The run loop stops the Profiler
+and writes the outputs on its next pass, since cProfile must be
+disabled from the thread that enabled it.
+'''
+
+import cProfile
+import threading
+import collections
+import sys
+import os
+import time
+
+class Profiler:
+    '''
+    Profile the logger for a fixed duration
+    '''
+    def __init__(self,duration,prefix,interval=0.005):
+        '''
+        Inputs
+        - duration: seconds to profile
+        - prefix: output path prefix
+        - interval: seconds between stack samples
+        '''
+        self.duration = duration
+        self.prefix = prefix
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.stacks = collections.Counter()
+        self.stopevent = threading.Event()
+        self.sampler = threading.Thread(target=self.sample,name='profiler',daemon=True)
+        self.endtime = None
+
+    @property
+    def outputs(self):
+        return [self.prefix + '.pstats',self.prefix + '.collapsed']
+
+    @property
+    def expired(self):
+        return (self.endtime is not None) and (time.monotonic() >= self.endtime)
+
+    def expire(self):
+        '''
+        End profiling early, the outputs are written
+        when the run loop next checks expired
+        '''
+        self.duration = 0
+        if self.endtime is not None:
+            self.endtime = time.monotonic()
+
+    def start(self):
+        '''
+        Start profiling. Must be called from the thread to be profiled
+        with cProfile (the run loop).
+        '''
+        self.endtime = time.monotonic() + self.duration
+        self.sampler.start()
+        self.profile.enable()
+
+    def sample(self):
+        '''
+        Record stacks of all other threads until stopped
+        '''
+        ownid = threading.get_ident()
+        while not self.stopevent.wait(self.interval):
+            names = {t.ident:t.name for t in threading.enumerate()}
+            for threadid, frame in sys._current_frames().items():
+                if threadid == ownid:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename),
+                        code.co_name).replace(' ','_'))
+                    frame = frame.f_back
+                stack.append(names.get(threadid,str(threadid)))
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        '''
+        Stop profiling and write outputs
+        Returns list of output files
+        '''
+        if self.endtime is None:
+            #Never started
+            return []
+
+        self.profile.disable()
+        self.stopevent.set()
+        self.sampler.join()
+
+        pstatsfile, collapsedfile = self.outputs
+        self.profile.dump_stats(pstatsfile)
+        with open(collapsedfile,'w') as collapsed:
+            for stack, count in self.stacks.most_common():
+                collapsed.write('{} {}\n'.format(stack,count))
+
+        return self.outputs
@@ -0,0 +1,116 @@
+'''
+Quality control of stored data
+
+A logging configuration with qc settings checks the samples of each
+storage window before they are processed and stored, and records the
+result as bit flags in data.qc_flag:
+    QC_RANGE        1 - value below qc min or above qc max
+    QC_STEP         2 - change from the previous sample larger than qc step
+    QC_PERSISTENCE  4 - value unchanged for qc persistence or more samples
+    QC_GAP          8 - more than qc gap seconds since the previous sample
+Checks run on NumPy arrays of the window and carry the previous sample
+and current run of equal values over to the next window.
+
+Rows of Dump and Sample get the flags of their sample. Rows of other
+processes (Average, Max, Min) get all flags raised in the window.
+'''
+
+from databear.compression import to_microseconds
+
+QC_RANGE = 1
+QC_STEP = 2
+QC_PERSISTENCE = 4
+QC_GAP = 8
+QC_FLAGS = {'range':QC_RANGE,'step':QC_STEP,'persistence':QC_PERSISTENCE,'gap':QC_GAP}
+
+class QualityControl:
+    '''
+    QC checks for a single logging configuration
+    '''
+    def __init__(self,minimum=None,maximum=None,step=None,persistence=None,gap=None):
+        '''
+        Inputs (all optional)
+        - minimum, maximum: valid range
+        - step: largest valid change between consecutive samples
+        - persistence: number of equal consecutive samples flagged as stuck
+        - gap: seconds between samples flagged as a gap
+        '''
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.persistence = persistence
+        self.gap = gap
+        self.lastvalue = None #Value of the last checked sample
+        self.lastts = None #Timestamp (ns) of the last checked sample
+        self.runlength = 0 #Equal samples ending with the last checked sample
+
+    def check(self,timestamps,values,carry=True):
+        '''
+        Flag samples of a window
+        Inputs
+        - timestamps (ns) and values as NumPy arrays in time order
+        - carry: False to check the window without the previous
+          window, such as an earlier window stored again
+        Returns NumPy array of flags
+        '''
+        import numpy as np
+        flags = np.zeros(len(values),dtype=np.int64)
+        if not len(values):
+            return flags
+
+        with np.errstate(invalid='ignore'):
+            if self.minimum is not None:
+                flags[values < self.minimum] |= QC_RANGE
+            if self.maximum is not None:
+                flags[values > self.maximum] |= QC_RANGE
+
+            #Compare each sample with the one before it
+            previous = np.empty_like(values)
+            previous[1:] = values[:-1]
+            previous[0] = np.nan if (self.lastvalue is None) or not carry else self.lastvalue
+            if self.step is not None:
+                flags[np.abs(values - previous) > self.step] |= QC_STEP
+
+            if self.gap is not None:
+                previousts = np.empty_like(timestamps)
+                previousts[1:] = timestamps[:-1]
+                previousts[0] = timestamps[0] if (self.lastts is None) or not carry else self.lastts
+                flags[(timestamps - previousts) > self.gap*1e9] |= QC_GAP
+
+            #Length of the run of equal values ending at each sample
+            changed = values != previous
+            starts = np.flatnonzero(changed)
+            runstart = np.zeros(len(values),dtype=np.int64)
+            runstart[starts] = starts
+            runstart = np.maximum.accumulate(runstart)
+            runlength = np.arange(len(values)) - runstart + 1
+            if carry and not changed[0]:
+                #First run continues from the last window
+                runlength[runstart == 0] += self.runlength
+            if self.persistence:
+                flags[runlength >= self.persistence] |= QC_PERSISTENCE
+
+        if not carry:
+            return flags
+        self.lastvalue = float(values[-1])
+        self.lastts = int(timestamps[-1])
+        self.runlength = int(runlength[-1])
+        return flags
+
+def row_flags(process,storedata,timestamps,flags):
+    '''
+    Flags of processed rows [(datetime,value,...),...] of a window
+    timestamps - NumPy array of sample timestamps (ns)
+    flags - NumPy array of sample flags from QualityControl.check
+    Returns list of flags, one per row
+    '''
+    if process in ('Dump','Sample'):
+        #Rows keep the datetime (microseconds) of their sample
+        sampleflags = {}
+        for ts_us, flag in zip((timestamps//1000).tolist(),flags.tolist()):
+            sampleflags[ts_us] = sampleflags.get(ts_us,0) | flag
+        return [sampleflags.get(to_microseconds(row[0]),0) for row in storedata]
+
+    import numpy as np
+    windowflag = int(np.bitwise_or.reduce(flags)) if len(flags) else 0
+    return [windowflag]*len(storedata)
@@ -0,0 +1,43 @@
+'''
+Record table storage
+
+Logging configurations with a record_table setting are stored in a wide
+table "record_<name>" instead of the data table, with one row per
+timestamp and a column per logging configuration, like the tables of a
+classic datalogger. Columns are named <sensor>_<measurement>_<process>
+and added when a logging configuration first uses the table.
+
+Values stored during a pass of the run loop are collected by
+RecordBuffer and written with one insert (or update) per record, so a
+table of 30 measurements needs one row and index entry per storage
+interval instead of 30. Record tables hold values only (no qc_flag or
+store_reason) and are not forwarded or compressed.
+'''
+
+def column_name(sensor,measurement,process):
+    '''
+    Column of a logging configuration in a record table
+    '''
+    return '{}_{}_{}'.format(sensor,measurement,process)
+
+class RecordBuffer:
+    '''
+    Values waiting to be written to record tables
+    '''
+    def __init__(self):
+        self.pending = {} #Form {<table>:{<dtstamp>:{<column>:value}}}
+
+    def add(self,table,column,dtstamp,value):
+        self.pending.setdefault(table,{}).setdefault(dtstamp,{})[column] = value
+
+    def flush(self,db):
+        '''
+        Write pending values to the database
+        Returns number of records written
+        '''
+        count = 0
+        for table, records in self.pending.items():
+            db.storeRecords(table,records)
+            count = count + len(records)
+        self.pending = {}
+        return count
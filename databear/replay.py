@@ -0,0 +1,278 @@
+'''
+Offline replay of raw data
+
+databear replay <yaml file> processes raw samples again with new
+storage settings, for example to add 5 minute maximums to a site that
+stored one minute averages. Raw samples come from the rows of Dump
+logging configurations or from a journal file (see databear.journal).
+Each replay stores its results under a new, inactive logging
+configuration, so the logger never stores to it and the data of
+existing configurations is not changed. The new ids are printed.
+
+YAML form:
+    replay:
+      - sensor: tph1
+        store: air_temperature
+        process: Max
+        storage_interval: 300
+        start: '2021-05-01'       #Optional, default first raw sample
+        end: '2021-06-01'         #Optional, default after the last raw sample
+    journal: /var/databear/journal   #Optional, read samples from a journal
+    workers: 4                       #Optional, default CPU count
+
+The raw samples of a sensor and measurement are the rows of all its Dump
+logging configurations. Replays read the samples in chunks of whole
+storage windows covering about a day, so memory use doesn't grow with
+the time range, and calculate all windows of a chunk at once with
+process.calculate_windows, which gives the same rows as the logger's
+storage jobs. Chunks of all replays are processed in parallel by a pool
+of worker processes, each with its own database connection, and the
+results are written by this process with one commit per chunk. Samples
+that are not numbers are skipped. Windows are aligned to multiples of
+the storage interval, like the logger's schedule, and start and end
+are extended to whole windows.
+'''
+
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from databear.errors import DataLogConfigError
+from databear.journal import read_journal
+from databear.process import processes, calculate_windows
+from databear.samples import SampleBuffer, from_ns
+from databear.timeformat import TimestampFormatter, storage_timespec
+
+NS = 1000000000
+CHUNK_SECONDS = 86400 #Minimum time covered by a chunk
+
+workerdb = None #Database connection of a worker process
+
+def parse_ns(dtstamps):
+    '''
+    NumPy array of nanoseconds from datetime strings
+    '''
+    import numpy as np
+    return np.array(dtstamps,dtype='datetime64[us]').astype(np.int64)*1000
+
+def format_ns(timestamps,timespec='microseconds'):
+    '''
+    Datetime strings from nanoseconds
+    '''
+    timeformat = TimestampFormatter(timespec)
+    return [timeformat.format(from_ns(ts)) for ts in timestamps]
+
+def chunks(start_ns,end_ns,interval_ns):
+    '''
+    Split start_ns <= timestamp < end_ns into chunks of whole
+    storage windows of about CHUNK_SECONDS
+    Returns [(chunk start,chunk end),...] as datetime strings
+    '''
+    chunk_ns = -(-CHUNK_SECONDS*NS//interval_ns)*interval_ns
+    bounds = list(range(start_ns,end_ns,chunk_ns)) + [end_ns]
+    dtstamps = format_ns(bounds)
+    return list(zip(dtstamps[:-1],dtstamps[1:]))
+
+def process_samples(processtype,interval,timestamps,values):
+    '''
+    Rows to store from raw samples
+    Inputs:
+        - timestamps, values - NumPy arrays in time order
+        - interval - storage interval (seconds)
+    Returns ([dtstamp,...],[value,...])
+    '''
+    import numpy as np
+
+    numeric = np.isfinite(values)
+    timestamps, values = calculate_windows(
+        processtype,timestamps[numeric],values[numeric],int(round(interval*NS)))
+    return format_ns(timestamps.tolist(),storage_timespec(processtype,interval)), values.tolist()
+
+def replay_chunk(sources,processtype,interval,startdt,enddt):
+    '''
+    Process one chunk of raw rows, run in a worker process
+    Inputs:
+        - sources - list of Dump logging configuration ids
+        - startdt, enddt - datetime strings of the chunk
+    Returns (rows to store as process_samples,number of samples)
+    '''
+    import numpy as np
+    global workerdb
+    if workerdb is None:
+        from databear.databearDB import DataBearDB
+        workerdb = DataBearDB()
+
+    rows = []
+    for source in sources:
+        rows.extend(workerdb.getData(source,startdt,enddt))
+    if len(sources) > 1:
+        rows.sort(key=lambda row: row[0])
+
+    timestamps = parse_ns([row[0] for row in rows])
+    values = np.array([row[1] for row in rows],dtype=np.float64)
+    return process_samples(processtype,interval,timestamps,values), len(rows)
+
+def resolve_measurement(db,sensor,store):
+    '''
+    Return (sensor id,measurement id) of a measurement of an active sensor
+    '''
+    active_sensor_ids = db.active_sensor_ids
+    if sensor not in active_sensor_ids:
+        raise DataLogConfigError('Replay sensor {} is not active'.format(sensor))
+
+    sensor_id = active_sensor_ids[sensor]
+    module_name = db.sensor_modules[sensor]
+    if module_name == 'databear.derived':
+        derivedids = {m['name']:m['measurement_id'] for m in db.getDerivedMeasurements(sensor_id)}
+        measurement_id = derivedids.get(store)
+    else:
+        measurement_id = db.getMeasurementID(store,module_name)
+    if not measurement_id:
+        raise DataLogConfigError('Replay measurement {} not found for {}'.format(store,sensor))
+
+    return sensor_id, measurement_id
+
+def dump_sources(db,sensor_id,measurement_id):
+    '''
+    Return ids of all Dump logging configurations of a measurement
+    '''
+    return [config['logging_config_id'] for config in db.getLoggingConfigs(activeonly=False)
+            if (config['sensor_id'] == sensor_id) and (
+                config['measurement_id'] == measurement_id) and (config['process'] == 'Dump')]
+
+def plan_replay(db,setting,journal=None):
+    '''
+    Check one replay setting
+    Returns a dictionary of the replay, see replay
+    '''
+    for key in ['sensor','store','process','storage_interval']:
+        if key not in setting:
+            raise DataLogConfigError('Replay setting missing {}'.format(key))
+    processtype = setting['process']
+    if processtype not in processes:
+        raise DataLogConfigError('Unknown process {}'.format(processtype))
+    interval = setting['storage_interval']
+    if (not isinstance(interval,(int,float))) or (interval <= 0):
+        raise DataLogConfigError('Replay storage_interval must be positive')
+
+    sensor_id, measurement_id = resolve_measurement(db,setting['sensor'],setting['store'])
+    job = {
+        'sensor':setting['sensor'],
+        'store':setting['store'],
+        'process':processtype,
+        'interval':interval,
+        'sensor_id':sensor_id,
+        'measurement_id':measurement_id,
+        'sensor_config_id':db.getLatestSensorConfigID(sensor_id),
+        'sources':[],
+        'chunks':[]
+    }
+
+    interval_ns = int(round(interval*NS))
+    if journal is None:
+        job['sources'] = dump_sources(db,sensor_id,measurement_id)
+        if not job['sources']:
+            raise DataLogConfigError('No Dump data for {} {}'.format(
+                setting['sensor'],setting['store']))
+        ranges = [db.getDataRange(source) for source in job['sources']]
+        ranges = [datarange for datarange in ranges if datarange[0] is not None]
+        if not ranges:
+            ranges = [('1970-01-01','1970-01-01')]
+        start_ns, end_ns = parse_ns([setting.get('start',min(start for start,end in ranges)),
+                                     setting.get('end',max(end for start,end in ranges))]).tolist()
+        if 'end' not in setting:
+            end_ns = end_ns + 1 #Include the last sample
+
+        #Whole storage windows
+        start_ns = start_ns//interval_ns*interval_ns
+        end_ns = -(-end_ns//interval_ns)*interval_ns
+        job['chunks'] = chunks(start_ns,end_ns,interval_ns)
+    else:
+        samples = journal.get((setting['sensor'],setting['store']),[])
+        timestamps, values = SampleBuffer(samples).arrays(-2**63,2**63 - 1)
+        selected = timestamps == timestamps
+        if 'start' in setting:
+            start_ns = parse_ns([setting['start']]).tolist()[0]
+            selected &= timestamps >= start_ns//interval_ns*interval_ns
+        if 'end' in setting:
+            end_ns = parse_ns([setting['end']]).tolist()[0]
+            selected &= timestamps < -(-end_ns//interval_ns)*interval_ns
+        job['samples'] = (timestamps[selected],values[selected])
+
+    return job
+
+def replay(config,db=None):
+    '''
+    Run the replays of a configuration (see the module description)
+    Returns list of (logging config id,rows stored,samples read)
+    '''
+    if db is None:
+        from databear.databearDB import DataBearDB
+        db = DataBearDB()
+
+    journal = None
+    if config.get('journal'):
+        journal = read_journal(config['journal'])[0]
+    #All settings are checked before any configuration is added
+    jobs = [plan_replay(db,setting,journal) for setting in config['replay']]
+    process_ids = db.process_ids
+    for job in jobs:
+        job['logging_config_id'] = db.addLoggingConfig(
+            job['measurement_id'],job['sensor_id'],job['interval'],process_ids[job['process']],None)
+    results = {job['logging_config_id']:[0,0] for job in jobs}
+
+    def store(job,dtstamps,values,nsamples):
+        configid = job['logging_config_id']
+        rows = [(dtstamp,value,job['sensor_config_id'],configid,0,0)
+                for dtstamp, value in zip(dtstamps,values)]
+        if rows:
+            db.storeDataRows(rows)
+        results[configid][0] += len(rows)
+        results[configid][1] += nsamples
+
+    if journal is not None:
+        for job in jobs:
+            timestamps, values = job['samples']
+            dtstamps, outvalues = process_samples(job['process'],job['interval'],timestamps,values)
+            store(job,dtstamps,outvalues,len(values))
+    else:
+        tasks = [(job,chunk) for job in jobs for chunk in job['chunks']]
+        args = [[job['sources'] for job,chunk in tasks],
+                [job['process'] for job,chunk in tasks],
+                [job['interval'] for job,chunk in tasks],
+                [chunk[0] for job,chunk in tasks],
+                [chunk[1] for job,chunk in tasks]]
+        workers = config.get('workers') or os.cpu_count() or 1
+        if workers == 1:
+            chunkresults = map(replay_chunk,*args)
+            for (job,chunk), ((dtstamps,values),nsamples) in zip(tasks,chunkresults):
+                store(job,dtstamps,values,nsamples)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunkresults = pool.map(replay_chunk,*args)
+                for (job,chunk), ((dtstamps,values),nsamples) in zip(tasks,chunkresults):
+                    store(job,dtstamps,values,nsamples)
+
+    output = []
+    for job in jobs:
+        configid = job['logging_config_id']
+        logging.info('Replayed {} {} as {} {}: {} rows from {} samples'.format(
+            job['sensor'],job['store'],job['process'],job['interval'],*results[configid]))
+        output.append((configid,*results[configid]))
+    return output
+
+def main(yamlfile):
+    '''
+    Run the replays of a YAML file and print the results
+    '''
+    import yaml
+
+    with open(yamlfile,'rt') as yin:
+        config = yaml.safe_load(yin.read())
+
+    starttime = time.monotonic()
+    results = replay(config)
+    elapsed = time.monotonic() - starttime
+    for configid, nrows, nsamples in results:
+        print('Logging configuration {}: {} rows from {} samples'.format(configid,nrows,nsamples))
+    print('Replay finished in {:.1f} s'.format(elapsed))
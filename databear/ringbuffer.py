@@ -0,0 +1,179 @@
+'''
+Shared memory ring buffers for live data
+
+When DBRINGDIR is set the logger publishes the recent samples of each
+sensor to a memory mapped file <DBRINGDIR>/<sensor name>.ring. Other
+processes can map the file and read samples without any IPC round trip
+using RingBufferReader (or the layout below).
+
+File layout (little endian)
+    Header, 16 bytes
+        0   4s   magic b'DBRB'
+        4   I    layout version (1)
+        8   I    capacity: slots per measurement
+        12  I    number of measurements
+    Measurement table, 72 bytes per measurement
+        0   64s  measurement name, UTF-8, null padded
+        64  Q    count: total samples written
+    Slots, capacity*24 bytes per measurement, in table order
+        0   Q    sequence
+        8   q    timestamp, integer nanoseconds since 1970-01-01
+                 (logger local time, same as stored timestamps)
+        16  d    value, NaN for readings that are not numbers
+                 (failed readings stored as None, text)
+
+Consistency (per slot seqlock)
+Sample n of a measurement is written to slot n % capacity. The writer
+sets the slot sequence to 2n+1, writes timestamp and value, then sets
+the sequence to 2n+2 and finally increments count. A reader of sample n
+reads the sequence, the data and the sequence again; the sample is valid
+only if both sequence reads equal 2n+2. Otherwise the slot was being
+written or already overwritten by a newer sample.
+'''
+
+import mmap
+import os
+import struct
+from numbers import Real
+from databear.compression import to_microseconds
+
+MAGIC = b'DBRB'
+VERSION = 1
+header = struct.Struct('<4sIII')
+entry = struct.Struct('<64sQ')
+slot = struct.Struct('<Qqd')
+sequence = struct.Struct('<Q')
+sample = struct.Struct('<qd')
+
+class RingBufferWriter:
+    '''
+    Publish sensor samples to a memory mapped ring buffer file
+    '''
+    def __init__(self,path,measurements,capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.measurements = list(measurements)
+        self.index = {name:i for i,name in enumerate(self.measurements)}
+        self.counts = [0]*len(self.measurements)
+        self.lastsample = {} #Form {<measurement>:<datetime>}
+
+        self.tableoffset = header.size
+        self.dataoffset = self.tableoffset + entry.size*len(self.measurements)
+        size = self.dataoffset + slot.size*capacity*len(self.measurements)
+
+        #Create a new file each time so readers never see stale layouts
+        tmppath = path + '.tmp'
+        with open(tmppath,'wb') as fout:
+            fout.truncate(size)
+        self.file = open(tmppath,'r+b')
+        self.map = mmap.mmap(self.file.fileno(),size)
+        header.pack_into(self.map,0,MAGIC,VERSION,capacity,len(self.measurements))
+        for i,name in enumerate(self.measurements):
+            entry.pack_into(self.map,self.tableoffset + i*entry.size,name.encode('utf-8'),0)
+        os.replace(tmppath,path)
+
+    def write(self,measurement,ts_ns,value):
+        '''
+        Write one sample, values that are not numbers are written as NaN
+        '''
+        if not isinstance(value,Real):
+            value = float('nan')
+        i = self.index[measurement]
+        n = self.counts[i]
+        offset = self.dataoffset + slot.size*(i*self.capacity + n % self.capacity)
+        sequence.pack_into(self.map,offset,2*n + 1)
+        sample.pack_into(self.map,offset + sequence.size,ts_ns,value)
+        sequence.pack_into(self.map,offset,2*n + 2)
+        self.counts[i] = n + 1
+        struct.pack_into('<Q',self.map,self.tableoffset + i*entry.size + 64,n + 1)
+
+    def publishSamples(self,sensor):
+        '''
+        Write samples in the sensor buffer newer than those already written
+        '''
+        for measurement, values in sensor.data.items():
+            if measurement not in self.index:
+                continue
+            last = self.lastsample.get(measurement)
+            newdata = []
+            for value in reversed(values):
+                if (last is not None) and (value[0] <= last):
+                    break
+                newdata.append(value)
+                if len(newdata) >= self.capacity:
+                    break
+            for dt, value in reversed(newdata):
+                self.write(measurement,to_microseconds(dt)*1000,value)
+            if newdata:
+                self.lastsample[measurement] = newdata[0][0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class RingBufferReader:
+    '''
+    Read a ring buffer file written by RingBufferWriter
+    '''
+    def __init__(self,path):
+        self.file = open(path,'rb')
+        self.map = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, self.capacity, nmeasurements = header.unpack_from(self.map,0)
+        if (magic != MAGIC) or (version != VERSION):
+            raise ValueError('Not a version {} DataBear ring buffer'.format(VERSION))
+
+        self.tableoffset = header.size
+        self.dataoffset = self.tableoffset + entry.size*nmeasurements
+        self.index = {}
+        for i in range(nmeasurements):
+            name = entry.unpack_from(self.map,self.tableoffset + i*entry.size)[0]
+            self.index[name.rstrip(b'\0').decode('utf-8')] = i
+
+    @property
+    def measurements(self):
+        return list(self.index)
+
+    def count(self,measurement):
+        '''
+        Total samples written for measurement
+        '''
+        i = self.index[measurement]
+        return struct.unpack_from('<Q',self.map,self.tableoffset + i*entry.size + 64)[0]
+
+    def read(self,measurement,n):
+        '''
+        Return sample n as (ts_ns,value) or None if it is
+        not available (not written yet or overwritten)
+        '''
+        i = self.index[measurement]
+        offset = self.dataoffset + slot.size*(i*self.capacity + n % self.capacity)
+        expected = 2*n + 2
+        seq1, ts_ns, value = slot.unpack_from(self.map,offset)
+        seq2 = sequence.unpack_from(self.map,offset)[0]
+        if (seq1 != expected) or (seq2 != expected):
+            return None
+        return (ts_ns,value)
+
+    def since(self,measurement,start):
+        '''
+        Return samples with index >= start as ([(ts_ns,value),...],next start)
+        Samples that were overwritten are skipped.
+        '''
+        end = self.count(measurement)
+        start = max(start,end - self.capacity,0)
+        samples = []
+        for n in range(start,end):
+            value = self.read(measurement,n)
+            if value:
+                samples.append(value)
+        return samples, end
+
+    def latest(self,measurement,nsamples=1):
+        '''
+        Return up to nsamples most recent samples [(ts_ns,value),...]
+        '''
+        return self.since(measurement,self.count(measurement) - nsamples)[0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,178 @@
+'''
+Compact sample buffers for sensor data
+
+Each measurement in Sensor.data is a SampleBuffer holding timestamps as
+integer nanoseconds since 1970-01-01 in logger local time (the clock of
+datetime.now()) in an array('q') and values in an array('d'), 16 bytes
+per sample. Sensors add samples with Sensor.record without creating
+datetime objects.
+
+For compatibility a SampleBuffer also behaves like the list of
+(datetime,value) tuples used before: append, len, indexing, slicing
+and iteration convert to and from datetime as needed. Values that are
+not numbers (None, strings) are kept separately.
+'''
+
+from array import array
+from bisect import bisect_left
+import time
+from databear.compression import to_microseconds, from_microseconds
+
+def now_ns():
+    '''
+    Current local time as integer nanoseconds since 1970-01-01
+    '''
+    return time.time_ns() + time.localtime().tm_gmtoff*1000000000
+
+def to_ns(dt):
+    return to_microseconds(dt)*1000
+
+def from_ns(ts_ns):
+    return from_microseconds(ts_ns//1000)
+
+class SampleBuffer:
+    '''
+    Samples of one measurement
+    '''
+    __slots__ = ('timestamps','values','objects','ordered')
+
+    def __init__(self,samples=()):
+        self.timestamps = array('q')
+        self.values = array('d')
+        self.objects = {} #Form {<index>:<value>} for values that are not numbers
+        self.ordered = True #False if a sample was recorded out of time order
+        for sample in samples:
+            self.append(sample)
+
+    def record(self,value,ts_ns):
+        '''
+        Add a sample with timestamp in nanoseconds
+        '''
+        if self.timestamps and (ts_ns < self.timestamps[-1]):
+            self.ordered = False
+        #The value is added last so readers never see a partial sample
+        self.timestamps.append(ts_ns)
+        if isinstance(value,(int,float)) and not isinstance(value,bool):
+            self.values.append(value)
+        else:
+            self.objects[len(self.values)] = value
+            self.values.append(0.0)
+
+    def record_many(self,values,timestamps,ordered=True):
+        '''
+        Add numeric samples in bulk
+        values - array('d'), timestamps - array('q') in nanoseconds
+        ordered - False if timestamps are not in time order
+        '''
+        if not timestamps:
+            return
+        if (not ordered) or (self.timestamps and (timestamps[0] < self.timestamps[-1])):
+            self.ordered = False
+        self.timestamps.extend(timestamps)
+        self.values.extend(values)
+
+    def append(self,sample):
+        '''
+        Add a (datetime,value) sample
+        '''
+        self.record(sample[1],to_ns(sample[0]))
+
+    def extend(self,samples):
+        for sample in samples:
+            self.append(sample)
+
+    def value(self,index):
+        if self.objects and (index in self.objects):
+            return self.objects[index]
+        return self.values[index]
+
+    def sample(self,index):
+        return (from_ns(self.timestamps[index]),self.value(index))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self,index):
+        n = len(self)
+        if isinstance(index,slice):
+            return [self.sample(i) for i in range(*index.indices(n))]
+        if index < 0:
+            index = index + n
+        if not 0 <= index < n:
+            raise IndexError('SampleBuffer index out of range')
+        return self.sample(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sample(i)
+
+    def __reversed__(self):
+        for i in range(len(self) - 1,-1,-1):
+            yield self.sample(i)
+
+    def __repr__(self):
+        return 'SampleBuffer({})'.format(len(self))
+
+    def indices(self,start_ns,end_ns):
+        '''
+        Indices of samples with start_ns <= timestamp < end_ns
+        '''
+        n = len(self)
+        if self.ordered:
+            first = bisect_left(self.timestamps,start_ns,0,n)
+            last = bisect_left(self.timestamps,end_ns,first,n)
+            return range(first,last)
+        return [i for i in range(n) if start_ns <= self.timestamps[i] < end_ns]
+
+    def window(self,start_ns,end_ns):
+        '''
+        Return [(datetime,value),...] with start_ns <= timestamp < end_ns
+        '''
+        return [self.sample(i) for i in self.indices(start_ns,end_ns)]
+
+    def arrays(self,start_ns,end_ns):
+        '''
+        Return NumPy arrays (timestamps,values) of samples with
+        start_ns <= timestamp < end_ns in time order.
+        Values that are not numbers are NaN.
+        '''
+        import numpy as np
+        indices = self.indices(start_ns,end_ns)
+        if isinstance(indices,range):
+            first, last = indices.start, indices.stop
+            timestamps = np.array(self.timestamps[first:last],dtype=np.int64)
+            values = np.array(self.values[first:last],dtype=np.float64)
+            nonnumeric = [i - first for i in list(self.objects) if first <= i < last]
+        else:
+            timestamps = np.array([self.timestamps[i] for i in indices],dtype=np.int64)
+            values = np.array([self.values[i] for i in indices],dtype=np.float64)
+            nonnumeric = [n for n,i in enumerate(indices) if i in self.objects]
+        values[nonnumeric] = np.nan
+        if not self.ordered:
+            order = np.argsort(timestamps,kind='stable')
+            timestamps, values = timestamps[order], values[order]
+        return timestamps, values
+
+    def reset(self,samples):
+        '''
+        Replace all samples with [(datetime,value),...], keeping
+        this buffer so references to it stay valid
+        '''
+        self.timestamps = array('q')
+        self.values = array('d')
+        self.objects = {}
+        self.ordered = True
+        self.extend(samples)
+
+    def clear(self,start_ns,end_ns):
+        '''
+        Remove samples with start_ns <= timestamp < end_ns
+        '''
+        remove = set(self.indices(start_ns,end_ns))
+        keep = [(self.timestamps[i],self.value(i)) for i in range(len(self)) if i not in remove]
+        self.timestamps = array('q')
+        self.values = array('d')
+        self.objects = {}
+        self.ordered = True
+        for ts_ns, value in keep:
+            self.record(value,ts_ns)
@@ -17,6 +17,12 @@ import datetime
 import time
 import functools
 from math import ceil
+from databear.metrics import registry
+
+scheduler_lag = registry.histogram(
+    'databear_scheduler_lag_seconds',
+    'Delay between scheduled and actual start of jobs',
+    ['job'])
 
 class Scheduler:
     """
@@ -70,6 +76,8 @@ class Scheduler:
         return 1
 
     def _run_job(self, job):
+        lag = (datetime.datetime.now() - job.next_run).total_seconds()
+        scheduler_lag.observe(lag,job=job.job_func.__name__)
         ret = job.run()
 
     def cancel_job(self, job):
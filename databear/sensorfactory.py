@@ -15,6 +15,8 @@ Sensor objects must have the following interface:
 
 '''
 
+import importlib
+
 class sensorFactory:
     '''
     Outputs sensor objects of different types
@@ -23,15 +25,30 @@ class sensorFactory:
         self.sensortypes = {}
 
     def register_sensor(self,sensortype,sensorobject):
+        '''
+        Register a sensor class, or the name of a module with a
+        dbsensor class. Modules are only imported when a sensor of
+        that type is first created.
+        '''
         self.sensortypes[sensortype] = sensorobject
 
-    def get_sensor(self,sensortype,name,sn,address):
+    def get_sensor_class(self,sensortype):
         #Note: .get method on dictionary will return none if not found
         sensorobject = self.sensortypes.get(sensortype)
         if not sensorobject:
             #Evaluates true if sensorobject is none
             raise ValueError(sensorobject)
-        
+
+        if isinstance(sensorobject,str):
+            #Import on first use
+            sensor_module = importlib.import_module(sensorobject)
+            sensorobject = getattr(sensor_module,'dbsensor')
+            self.sensortypes[sensortype] = sensorobject
+
+        return sensorobject
+
+    def get_sensor(self,sensortype,name,sn,address):
+        sensorobject = self.get_sensor_class(sensortype)
         return sensorobject(name,sn,address)
 
 #Create sensor factory and register Dyacon
@@ -2,6 +2,8 @@
 Base class for DataBear sensors
 '''
 from databear.errors import SensorConfigError, MeasureError
+from databear.samples import SampleBuffer, now_ns, to_ns, from_ns
+from databear.timeformat import TimestampFormatter
 import datetime
 import time
 
@@ -32,11 +34,13 @@ class Sensor:
         #Define characteristics of this sensor
         self.configid = None
         self.min_interval = 0  #Minimum interval that sensor can be polled
+        self.sampletime = None #Timestamp (ns) for samples of a sample group measurement
 
         #Initialize data structure
+        #Form {<measurement>:SampleBuffer}, see databear.samples
         self.data = {}
         for measure_name in self.measurements:
-            self.data[measure_name] = []
+            self.data[measure_name] = SampleBuffer()
         
         self.connected = False
     
@@ -50,9 +54,10 @@ class Sensor:
         #Get current values
         currentdata = self.getcurrentdata()
         #Create output string
+        timeformat = TimestampFormatter('microseconds',fractionsep=':')
         for m,v in currentdata.items():
             if v:
-                dtstr = v[0].strftime('%Y-%m-%d %H:%M:%S:%f')
+                dtstr = timeformat.format(v[0])
                 output = output + '{}: {}, {}\n'.format(m,dtstr,v[1])
             else:
                 output = output + '{}: No Data\n'.format(m)
@@ -64,6 +69,17 @@ class Sensor:
 
     def measure(self):
         pass
+
+    def record(self,measure,value,ts_ns=None):
+        '''
+        Add a sample to a measurement
+        ts_ns: timestamp as integer nanoseconds since 1970-01-01
+        in local time, see databear.samples.now_ns (default now,
+        or the shared time of a sample group measurement)
+        '''
+        if ts_ns is None:
+            ts_ns = self.sampletime or now_ns()
+        self.data[measure].record(value,ts_ns)
     
     def getcurrentdata(self):
         '''
@@ -91,6 +107,8 @@ class Sensor:
         output = []
         try:
             data = self.data[name]
+            if isinstance(data,SampleBuffer):
+                return data.window(to_ns(startdt),to_ns(enddt))
             for val in data:
                 if (val[0]>=startdt) and (val[0]<enddt):
                     output.append(val)
@@ -107,6 +125,9 @@ class Sensor:
         '''
         savedata = []
         data = self.data[name]
+        if isinstance(data,SampleBuffer):
+            data.clear(to_ns(startdt),to_ns(enddt))
+            return
         for val in data:
             if (val[0]<startdt) or (val[0]>=enddt):
                 savedata.append(val)
@@ -145,12 +166,21 @@ class BusSensor(Sensor):
         '''
         pass
 
+    def measuretime(self):
+        '''
+        Start time passed to readMeasure: now, or the
+        shared time of a sample group measurement
+        '''
+        if self.sampletime:
+            return from_ns(self.sampletime)
+        return datetime.datetime.now()
+
     def measure(self):
         '''
         Coordinate start and read measure with
         port locks on the bus
         '''
-        dt = datetime.datetime.now()
+        dt = self.measuretime()
         try:
             #The start measurement sequence
             self.portlock.acquire()
@@ -0,0 +1,91 @@
+'''
+Configuration snapshot
+
+Starting the logger reads the active configuration with several
+database queries. With DBSNAPSHOT set to a file path the configuration
+read from the database is also written to that file, and later starts
+and reloads read the file instead when it is still current.
+
+The database keeps a configversion in databear_configuration that
+triggers increment whenever a configuration table (sensors,
+measurements, sensor, logging and derived configuration) changes, and
+that starts at a random value so a new database doesn't match an old
+snapshot. The snapshot records the version it was made from, so
+checking it costs a single query. A stale, missing or unreadable
+snapshot is rebuilt from the database.
+'''
+
+import json
+import os
+import logging
+
+SNAPSHOT_FORMAT = 2 #Changed when the snapshot contents change
+
+def read_config(db):
+    '''
+    Active configuration from the database
+    Returns {'sensors_available':[<module>,...],
+             'sensors':[<getSensorConfigs>],
+             'logging':[<getLoggingConfigs>],
+             'derived':{<sensor id>:[<getDerivedMeasurements>]}}
+    '''
+    config = {
+        'sensors_available':db.sensors_available,
+        'sensors':db.getSensorConfigs(),
+        'logging':db.getLoggingConfigs(),
+        'derived':{}
+    }
+    for sensor in config['sensors']:
+        if sensor['module_name'] == 'databear.derived':
+            #Keys are strings as in the JSON snapshot
+            config['derived'][str(sensor['sensor_id'])] = db.getDerivedMeasurements(sensor['sensor_id'])
+    return config
+
+def load(path,configversion):
+    '''
+    Configuration from a snapshot file
+    Returns None if the file is missing, unreadable or
+    not made from configversion
+    '''
+    try:
+        with open(path,'r') as f:
+            snapshot = json.load(f)
+    except (OSError,ValueError):
+        return None
+
+    if (not isinstance(snapshot,dict)) or (snapshot.get('format') != SNAPSHOT_FORMAT) or (
+            snapshot.get('configversion') != configversion):
+        return None
+    return snapshot.get('config')
+
+def save(path,configversion,config):
+    '''
+    Write a snapshot file, replacing any old
+    snapshot only when complete
+    '''
+    snapshot = {'format':SNAPSHOT_FORMAT,'configversion':configversion,'config':config}
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+    try:
+        with open(tmppath,'w') as f:
+            json.dump(snapshot,f)
+        os.replace(tmppath,path)
+    except OSError as err:
+        logging.warning('Configuration snapshot not saved: {}'.format(err))
+
+def load_config(db,path=None):
+    '''
+    Active configuration from the snapshot at path if it is
+    current, otherwise from the database (updating the snapshot)
+    See read_config for the form
+    '''
+    if not path:
+        return read_config(db)
+
+    configversion = db.configversion
+    config = load(path,configversion)
+    if config is not None:
+        return config
+
+    config = read_config(db)
+    save(path,configversion,config)
+    return config
@@ -0,0 +1,196 @@
+'''
+Live data subscriptions
+
+Clients on the framed control socket (see databear.control) can
+subscribe to sensor measurements:
+    {'command':'subscribe',
+     'arg':{'measurements':[[<sensor>,<measurement>],...],
+            'mode':'sample' or 'stored',  #Default 'sample'
+            'maxqueue':<n>,               #Default 1000
+            'policy':'drop_oldest' or 'drop_newest'}}
+
+The logger then pushes frames without further requests:
+    {'push':'sample','sensor':<sensor>,'measurement':<measurement>,
+     'data':[[<datetime>,<value>],...],'dropped':<n>}
+'sample' pushes every new measurement, 'stored' pushes each row written
+to the database and adds 'logging_config_id'. Each subscriber has a
+bounded queue; when it is full the policy decides whether the oldest
+or newest frame is dropped. 'dropped' counts frames dropped so far.
+
+'''
+
+import collections
+import threading
+import socket
+import logging
+from databear.timeformat import TimestampFormatter
+
+class Subscriber:
+    '''
+    A single subscription on a control connection
+    '''
+    policies = ['drop_oldest','drop_newest']
+    modes = ['sample','stored']
+
+    def __init__(self,conn,keys,mode='sample',maxqueue=1000,policy='drop_oldest'):
+        if mode not in self.modes:
+            raise ValueError('Invalid mode {}'.format(mode))
+        if policy not in self.policies:
+            raise ValueError('Invalid policy {}'.format(policy))
+
+        self.conn = conn
+        self.keys = set(keys)
+        self.mode = mode
+        self.maxqueue = maxqueue
+        self.policy = policy
+        self.queue = collections.deque()
+        self.dropped = 0
+
+    def put(self,frame):
+        '''
+        Queue a frame following the drop policy,
+        called with the SubscriptionManager lock held
+        '''
+        if len(self.queue) >= self.maxqueue:
+            self.dropped = self.dropped + 1
+            if self.policy == 'drop_newest':
+                return
+            self.queue.popleft()
+        self.queue.append(frame)
+
+class SubscriptionManager:
+    '''
+    Routes published data to subscribers. Publishing may happen
+    from any thread, frames are sent from the control listener
+    thread when flush is called.
+    '''
+    def __init__(self):
+        self.subscribers = []
+        self.keys = set() #All subscribed (sensor,measurement)
+        self.lastsample = {} #Form {(sensor,measurement):datetime}
+        self.lock = threading.Lock()
+
+        #Socket pair to wake up the listener when data is published
+        self.wakeup, self.wakeupsender = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.wakeupsender.setblocking(False)
+
+    def subscribe(self,conn,arg):
+        '''
+        Add a subscription for a control connection
+        '''
+        keys = [tuple(key) for key in arg['measurements']]
+        subscriber = Subscriber(
+            conn,
+            keys,
+            arg.get('mode','sample'),
+            arg.get('maxqueue',1000),
+            arg.get('policy','drop_oldest'))
+
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.updatekeys()
+
+        return subscriber
+
+    def unsubscribe(self,conn):
+        '''
+        Remove all subscriptions of a control connection
+        '''
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s.conn is not conn]
+            self.updatekeys()
+
+    def updatekeys(self):
+        keys = set()
+        for subscriber in self.subscribers:
+            keys.update(subscriber.keys)
+        self.keys = keys
+
+        #A key subscribed again starts from its most recent sample
+        self.lastsample = {key:dt for key,dt in self.lastsample.items() if key in keys}
+
+    def wants(self,sensor,measurement):
+        return (sensor,measurement) in self.keys
+
+    def publish(self,mode,sensor,measurement,data,**extra):
+        '''
+        Queue data for subscribers
+        data - [(datetime,value),...]
+        '''
+        timeformat = TimestampFormatter('microseconds')
+        frame = {
+            'push':mode,
+            'sensor':sensor,
+            'measurement':measurement,
+            'data':[(timeformat.format(dt),value) for dt,value in data]}
+        frame.update(extra)
+
+        key = (sensor,measurement)
+        with self.lock:
+            for subscriber in self.subscribers:
+                if (subscriber.mode == mode) and (key in subscriber.keys):
+                    subscriber.put(frame)
+
+        try:
+            self.wakeupsender.send(b'\0')
+        except BlockingIOError:
+            #Listener already has a pending wake up
+            pass
+
+    def publishSamples(self,sensor):
+        '''
+        Publish measurements of sensor newer than those published before.
+        For a new subscription only the most recent sample is published.
+        '''
+        for measurement, values in sensor.data.items():
+            key = (sensor.name,measurement)
+            if (key not in self.keys) or (not values):
+                continue
+
+            last = self.lastsample.get(key)
+            newdata = []
+            for value in reversed(values):
+                if (last is not None) and (value[0] <= last):
+                    break
+                newdata.append(value)
+                if last is None:
+                    break
+
+            if newdata:
+                newdata.reverse()
+                with self.lock:
+                    if key in self.keys:
+                        self.lastsample[key] = newdata[-1][0]
+                self.publish('sample',sensor.name,measurement,newdata)
+
+    def flush(self,wakeup=None):
+        '''
+        Send queued frames. Called by the control listener.
+        '''
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            #Frames are shared by subscribers, each gets its own copy
+            with self.lock:
+                frames = [dict(frame,dropped=subscriber.dropped) for frame in subscriber.queue]
+                subscriber.queue.clear()
+
+            for frame in frames:
+                try:
+                    subscriber.conn.send(frame)
+                except OSError:
+                    logging.warning('Subscriber connection lost')
+                    self.unsubscribe(subscriber.conn)
+                    break
+
+    def close(self):
+        self.wakeup.close()
+        self.wakeupsender.close()
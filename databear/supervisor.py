@@ -0,0 +1,408 @@
+'''
+DataBear supervisor for large sites
+
+With DBSHARDS set to N > 1, 'databear run' starts this supervisor instead
+of a single logger. It:
+- Switches the database to WAL mode so several processes can write to it
+- Splits active sensors into N shards by virtual port (sensors sharing a
+  port or sample group stay in the same process) and runs a
+  databear.logger process for each shard. Shard i uses control port DBPORT + 1 + i and only runs the
+  sensors and logging of its ports. Shard 0 also runs data forwarding.
+- Restarts shards that exit unexpectedly
+- Serves the usual control API on DBPORT (default 62000):
+    status, metrics - combined from all shards
+    getdata, getsensor, stop - sent to the shard running the sensor
+    reload, profile, shutdown - sent to all shards
+    query, qcsummary, availability - answered from the shared database
+  Live data subscriptions are made directly on a shard's control port.
+
+'''
+
+import subprocess
+import sqlite3
+import selectors
+import socket
+import json
+import time
+import logging
+import sys
+import os
+from databear import control
+from databear import snapshot
+from databear.databearDB import DataBearDB
+from databear.derived import input_names
+
+def assign_ports(sensorports,nshards):
+    '''
+    Assign virtual ports to shards
+    sensorports - {<sensor name>:<virtual port>}
+    Ports with the most sensors are assigned first,
+    each to the shard with fewest sensors
+    Returns {<virtual port>:<shard>}
+    '''
+    counts = {}
+    for port in sensorports.values():
+        counts[port] = counts.get(port,0) + 1
+
+    loads = [0]*nshards
+    assignment = {}
+    for port in sorted(counts,key=lambda p: (-counts[p],str(p))):
+        shard = loads.index(min(loads))
+        assignment[port] = shard
+        loads[shard] = loads[shard] + counts[port]
+
+    return assignment
+
+def assign_sensors(config,nshards):
+    '''
+    Shard of each active sensor
+    config - active configuration, see databear.snapshot.read_config
+    Sensors of a sample group are measured by one job, so
+    all ports of a group are assigned to the same shard
+    Returns {<sensor name>:<shard>}
+    '''
+    sensorports = {}
+    groups = {} #Form {<sample group>:[<virtual port>,...]}
+    derivedsensors = {} #Form {<sensor name>:<sensor id>}
+    for sensorsettings in config['sensors']:
+        if sensorsettings['module_name'] == 'databear.derived':
+            derivedsensors[sensorsettings['name']] = sensorsettings['sensor_id']
+            continue
+        sensorports[sensorsettings['name']] = sensorsettings['virtualport']
+        if sensorsettings['sample_group']:
+            groups.setdefault(sensorsettings['sample_group'],[]).append(
+                sensorsettings['virtualport'])
+
+    #Derived sensors run in the shard of their inputs
+    for name, sensorid in derivedsensors.items():
+        ports = []
+        for derived in config['derived'][str(sensorid)]:
+            for inputsensor, measurement in input_names(derived['expression']):
+                if inputsensor in sensorports:
+                    ports.append(sensorports[inputsensor])
+        sensorports[name] = ports[0] if ports else 'derived'
+        if ports:
+            groups[('derived',name)] = ports
+
+    #Merge ports of each group, ports are then assigned by their merged port
+    merged = {} #Form {<virtual port>:<port it is merged into>}
+    def find(port):
+        while merged.get(port,port) != port:
+            port = merged[port]
+        return port
+    for ports in groups.values():
+        root = find(ports[0])
+        for port in ports[1:]:
+            if find(port) != root:
+                merged[find(port)] = root
+
+    sensorunits = {name:find(port) for name,port in sensorports.items()}
+    assignment = assign_ports(sensorunits,nshards)
+    return {name:assignment[unit] for name,unit in sensorunits.items()}
+
+def merge_metrics(texts):
+    '''
+    Combine metrics text from several shards adding a shard label
+    texts - {<shard>:<metrics text>}
+    '''
+    families = {} #Form {<name>:[<help>,<type>,[<samples>]]}
+    for shard, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split(' ',3)[2]
+                entry = families.setdefault(family,[None,None,[]])
+                entry[0 if line.startswith('# HELP') else 1] = line
+            elif line and not line.startswith('#') and family:
+                name, value = line.rsplit(' ',1)
+                label = 'shard="{}"'.format(shard)
+                if '{' in name:
+                    name = name.replace('{','{' + label + ',',1)
+                else:
+                    name = name + '{' + label + '}'
+                families[family][2].append('{} {}'.format(name,value))
+
+    lines = []
+    for helpline, typeline, samples in families.values():
+        lines.extend([line for line in (helpline,typeline) if line])
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+class Supervisor:
+    '''
+    Run and control sharded loggers
+    '''
+    #Error logging format
+    errorfmt = '%(asctime)s %(levelname)s %(lineno)s %(message)s'
+
+    def __init__(self,nshards):
+        self.nshards = nshards
+        self.workers = {} #Form {<shard>:Popen}
+        self.restarts = {} #Form {<shard>:<time of restart>}
+        self.running = False
+        self.querychunk = 1000 #Rows per streamed frame
+
+        #Shared database in WAL mode
+        self.db = DataBearDB()
+        self.db.curs.execute('PRAGMA journal_mode=WAL')
+        self.sensorshards = assign_sensors(
+            snapshot.load_config(self.db,os.environ.get('DBSNAPSHOT')),nshards)
+
+        #Configure UDP and framed control sockets for API
+        self.udpsocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.udpsocket.bind(control.tcp_address)
+        self.udpsocket.setblocking(False)
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.udpsocket,selectors.EVENT_READ,self.readUDP)
+        self.controlsockets = control.listen()
+        for csock in self.controlsockets:
+            self.sel.register(csock,selectors.EVENT_READ,self.acceptControl)
+
+        logging.basicConfig(
+            level=20,
+            format=Supervisor.errorfmt,
+            filename='databear_error.log'
+            )
+
+    def shardAddress(self,shard):
+        return (control.tcp_address[0],control.tcp_address[1] + 1 + shard)
+
+    def startWorker(self,shard):
+        '''
+        Start the logger process of a shard
+        '''
+        env = os.environ.copy()
+        env['DBSHARD'] = str(shard)
+        env['DBSHARDS'] = str(self.nshards)
+        env['DBPORT'] = str(self.shardAddress(shard)[1])
+        env.pop('DBSOCKET',None)
+        if 'DBJOURNAL' in env:
+            env['DBJOURNAL'] = '{}.shard{}'.format(env['DBJOURNAL'],shard)
+        if 'DBMETRICSPORT' in env:
+            env['DBMETRICSPORT'] = str(int(env['DBMETRICSPORT']) + 1 + shard)
+
+        self.workers[shard] = subprocess.Popen(
+            [sys.executable,'-m','databear.logger'],
+            env=env)
+        logging.info('Started shard {} pid {}'.format(shard,self.workers[shard].pid))
+
+    def checkWorkers(self):
+        '''
+        Restart shards that exited, at most every 10 seconds
+        '''
+        for shard, worker in self.workers.items():
+            if worker.poll() is None:
+                continue
+            if time.monotonic() - self.restarts.get(shard,0) < 10:
+                continue
+            logging.error('Shard {} exited with {}, restarting'.format(shard,worker.returncode))
+            self.restarts[shard] = time.monotonic()
+            self.startWorker(shard)
+
+    def forward(self,shard,command,argument=None):
+        '''
+        Send a command to a shard
+        Returns the response or None if the shard is not responding
+        '''
+        client = control.ControlClient(address=self.shardAddress(shard))
+        try:
+            response = client.request(command,argument)
+            response.pop('id',None)
+            return response
+        except (OSError,control.FrameError,ValueError):
+            return None
+        finally:
+            client.close()
+
+    def forwardAll(self,command,argument=None):
+        return {shard:self.forward(shard,command,argument) for shard in range(self.nshards)}
+
+    def readUDP(self,sock):
+        '''
+        Respond to a UDP command, see DataLogger.readUDP
+        '''
+        msgraw, address = sock.recvfrom(65535)
+        try:
+            msg = json.loads(msgraw)
+        except ValueError:
+            msg = {'command':'invalid'}
+
+        if msg.get('command') in ['query','subscribe','unsubscribe']:
+            response = {'response':'Command requires the framed control socket'}
+        else:
+            response = self.handleCommand(msg)
+        sock.sendto(json.dumps(response).encode('utf-8'),address)
+
+    def acceptControl(self,sock):
+        try:
+            conn, address = sock.accept()
+        except OSError:
+            return
+        cconn = control.ControlConnection(conn)
+        self.sel.register(conn,selectors.EVENT_READ,cconn)
+
+    def readControl(self,cconn):
+        '''
+        Read framed requests from a control connection
+        and respond to each in order
+        '''
+        requests = cconn.read()
+        if requests is None:
+            self.sel.unregister(cconn.sock)
+            cconn.close()
+            return
+
+        try:
+            for msg in requests:
+                if msg.get('command') == 'query':
+                    frames = self.queryData(msg.get('arg'))
+                else:
+                    frames = [self.handleCommand(msg)]
+                for frame in frames:
+                    frame['id'] = msg.get('id')
+                    cconn.send(frame)
+        except OSError:
+            self.sel.unregister(cconn.sock)
+            cconn.close()
+
+    def queryData(self,arg):
+        '''
+        Stream stored data from the shared database, see DataLogger.queryData
+        '''
+        try:
+            if 'record_table' in arg:
+                columns, rows = self.db.getRecords(arg['record_table'],arg['start'],arg['end'])
+                yield {'columns':columns,'rows':[],'more':True}
+            else:
+                rows = self.db.getData(arg['logging_config_id'],arg['start'],arg['end'])
+        except (KeyError,TypeError,sqlite3.Error) as err:
+            yield {'response':'Invalid query: {}'.format(err),'more':False}
+            return
+
+        for i in range(0,len(rows),self.querychunk):
+            yield {'rows':rows[i:i+self.querychunk],'more':True}
+        yield {'rows':[],'more':False}
+
+    def handleCommand(self,msg):
+        try:
+            return self.runCommand(msg)
+        except Exception as err:
+            logging.error('Command {} failed: {}'.format(msg,err))
+            return {'response':'Command failed: {}'.format(err)}
+
+    def runCommand(self,msg):
+        command = msg.get('command')
+        argument = msg.get('arg')
+        if command == 'status':
+            responses = self.forwardAll('status')
+            sensornames = []
+            shards = {}
+            for shard, response in responses.items():
+                if response:
+                    sensornames.extend(response.get('sensors',[]))
+                    shards[shard] = response.get('status')
+                else:
+                    shards[shard] = 'not responding'
+            response = {'status':'running','sensors':sensornames,'shards':shards}
+
+        elif command in ['getdata','getsensor','stop']:
+            shard = self.sensorshards.get(argument)
+            if shard is None:
+                response = {'response':'Sensor not found'}
+            else:
+                response = self.forward(shard,command,argument)
+                if response is None:
+                    response = {'response':'Shard {} not responding'.format(shard)}
+
+        elif command == 'metrics':
+            responses = self.forwardAll('metrics')
+            texts = {shard:response['metrics'] for shard,response in responses.items()
+                     if response and ('metrics' in response)}
+            response = {'metrics':merge_metrics(texts)}
+
+        elif command in ['reload','profile']:
+            if command == 'reload':
+                self.sensorshards = assign_sensors(
+                    snapshot.load_config(self.db,os.environ.get('DBSNAPSHOT')),self.nshards)
+            response = {'response':'OK','shards':self.forwardAll(command,argument)}
+
+        elif command == 'qcsummary':
+            try:
+                response = {'qc':self.db.getQCSummary(
+                    argument['start'],argument['end'],argument.get('logging_config_id'))}
+            except (KeyError,TypeError,AttributeError,sqlite3.Error) as err:
+                response = {'response':'Invalid query: {}'.format(err)}
+
+        elif command == 'availability':
+            try:
+                response = {'availability':self.db.getAvailability(
+                    argument['start'],argument['end'],argument.get('sensor'))}
+            except (KeyError,TypeError,AttributeError,sqlite3.Error) as err:
+                response = {'response':'Invalid query: {}'.format(err)}
+
+        elif command == 'shutdown':
+            self.running = False
+            response = {'response':'OK'}
+
+        elif command in ['subscribe','unsubscribe']:
+            response = {'response':'Subscribe on the control port of a shard: {}'.format(
+                [self.shardAddress(shard)[1] for shard in range(self.nshards)])}
+
+        else:
+            response = {'response':'Invalid Command'}
+
+        return response
+
+    def shutdown(self):
+        '''
+        Shut down all shards
+        '''
+        self.forwardAll('shutdown')
+        for shard, worker in self.workers.items():
+            try:
+                worker.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                logging.error('Shard {} did not shut down, terminating'.format(shard))
+                worker.terminate()
+
+    def run(self):
+        '''
+        Start the shards and serve the control API until shutdown
+        '''
+        for shard in range(self.nshards):
+            self.startWorker(shard)
+
+        logging.info('Supervisor running {} shards'.format(self.nshards))
+        self.running = True
+        try:
+            while self.running:
+                for key, mask in self.sel.select(timeout=1):
+                    if isinstance(key.data,control.ControlConnection):
+                        self.readControl(key.data)
+                    else:
+                        key.data(key.fileobj)
+                if self.running:
+                    self.checkWorkers()
+        except KeyboardInterrupt:
+            pass
+
+        print('Shutting down')
+        self.shutdown()
+
+        for key in list(self.sel.get_map().values()):
+            if isinstance(key.data,control.ControlConnection):
+                key.data.close()
+        self.udpsocket.close()
+        for csock in self.controlsockets:
+            csock.close()
+        path = control.unix_path()
+        if path and os.path.exists(path):
+            os.remove(path)
+        self.db.close()
+
+def main():
+    supervisor = Supervisor(int(os.environ.get('DBSHARDS',2)))
+    supervisor.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+Fast timestamp formatting
+
+Stored rows, control responses and sensor printouts format a timestamp
+for every value. Consecutive timestamps almost always fall in the same
+second, so TimestampFormatter caches the formatted date and time up to
+the second and only formats the fraction of a second for each value.
+When the second changes the prefix is rebuilt from the cached date and
+hour and a table of two digit strings. Output is the same as
+datetime.isoformat(sep=' ',timespec=timespec).
+'''
+
+from datetime import timedelta
+
+ONE_HOUR = timedelta(hours=1)
+twodigits = ['{:02d}'.format(i) for i in range(60)]
+
+def storage_timespec(process,interval):
+    '''
+    Timespec of stored rows for a process
+    and storage interval (seconds)
+    '''
+    #Include microseconds if dump is used
+    if (process == 'Dump') or (interval < 1):
+        return 'microseconds'
+    elif interval < 60:
+        return 'seconds'
+    return 'minutes'
+
+class TimestampFormatter:
+    '''
+    Format naive datetimes as text, caching the
+    prefix of the current hour and second
+    '''
+    __slots__ = ('timespec','fractionsep','start','end','hourprefix','second','prefix')
+
+    def __init__(self,timespec='microseconds',fractionsep='.'):
+        '''
+        Inputs
+        - timespec: minutes, seconds, milliseconds or microseconds
+        - fractionsep: separator before the fraction of a second
+        '''
+        if timespec not in ('minutes','seconds','milliseconds','microseconds'):
+            raise ValueError('Unknown timespec {}'.format(timespec))
+        self.timespec = timespec
+        self.fractionsep = fractionsep
+        self.start = None #Start and end of the cached hour
+        self.end = None
+        self.hourprefix = ''
+        self.second = None #Second of the hour of the cached prefix
+        self.prefix = ''
+
+    def format(self,dt):
+        if dt.tzinfo is not None:
+            #Not cached, would need the UTC offset
+            return dt.isoformat(sep=' ',timespec=self.timespec)
+
+        if (self.start is None) or not (self.start <= dt < self.end):
+            self.start = dt.replace(minute=0,second=0,microsecond=0)
+            self.end = self.start + ONE_HOUR
+            self.hourprefix = self.start.isoformat(sep=' ',timespec='hours') + ':'
+            self.second = None
+
+        minute = dt.minute
+        timespec = self.timespec
+        if timespec == 'minutes':
+            return self.hourprefix + twodigits[minute]
+
+        second = dt.second
+        if minute*60 + second != self.second:
+            self.second = minute*60 + second
+            self.prefix = self.hourprefix + twodigits[minute] + ':' + twodigits[second]
+            if timespec != 'seconds':
+                self.prefix = self.prefix + self.fractionsep
+
+        if timespec == 'microseconds':
+            return self.prefix + str(1000000 + dt.microsecond)[1:]
+        if timespec == 'seconds':
+            return self.prefix
+        return self.prefix + str(1000 + dt.microsecond//1000)[1:]
@@ -24,7 +24,7 @@ setuptools.setup(
     ],
     install_requires=['pyyaml'],
     include_package_data=True,
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     entry_points='''
         [console_scripts]
         databear=databear.databearCLI:main_cli
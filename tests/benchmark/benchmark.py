@@ -0,0 +1,167 @@
+'''
+End to end DataBear benchmark
+
+Runs the real DataLogger loop with in-process simulated sensors
+(simsensor.py) and a temporary database, then reports:
+- Sustained samples per second
+- Scheduler lag percentiles (ms)
+- Database rows per second
+- CPU use (fraction of one core) and memory
+
+Use:
+python benchmark.py [--duration <s>] [--scenario <name> ...] [--output <json>]
+
+Results are saved as JSON so regressions can be tracked.
+Note: The logger binds the API ports, so stop any running logger first.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+#Scenarios - Form {<name>:(<number of sensors>,<rate Hz>)}
+scenarios = {
+    '1x100Hz':(1,100),
+    '100x1Hz':(100,1),
+    '1000x0.1Hz':(1000,0.1)
+}
+
+storage_interval = 10 #Dump storage interval for all scenarios
+
+def percentile(values,p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(p/100*(len(values)-1))),len(values)-1)
+    return values[index]
+
+def writeConfig(path,nsensors,rate):
+    '''
+    Write a YAML configuration for the scenario
+    '''
+    import yaml
+    config = {
+        'sensors':[],
+        'datalogger':{'name':'benchmark','settings':[]}
+    }
+    for i in range(nsensors):
+        name = 'sim{}'.format(i)
+        config['sensors'].append({
+            'name':name,
+            'sensortype':'simsensor',
+            'serialnumber':str(i),
+            'address':0,
+            'virtualport':'port0',
+            'measure_interval':1/rate})
+        config['datalogger']['settings'].append({
+            'store':'value',
+            'sensor':name,
+            'process':'Dump',
+            'storage_interval':storage_interval})
+
+    with open(path,'w') as yout:
+        yaml.safe_dump(config,yout)
+
+def runScenario(name,nsensors,rate,duration):
+    '''
+    Run one scenario in a temporary directory
+    Returns a dictionary of results
+    '''
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        os.environ['DBDATABASE'] = os.path.join(tmpdir,'benchmark.db')
+        os.environ['DBDRIVER'] = 'databear.drivers.dbdriver'
+        os.environ['DBSENSORPATH'] = os.path.dirname(os.path.abspath(__file__))
+        try:
+            from databear import databearCLI
+            from databear.logger import DataLogger
+
+            writeConfig('benchmark.yaml',nsensors,rate)
+            databearCLI.loadYAML('benchmark.yaml')
+
+            logger = DataLogger()
+
+            #Record scheduler lag of every job
+            lags = []
+            run_job = logger.logschedule._run_job
+            def timedRun(job):
+                lags.append((datetime.datetime.now() - job.next_run).total_seconds())
+                run_job(job)
+            logger.logschedule._run_job = timedRun
+
+            runner = threading.Thread(target=logger.run)
+            cpustart = time.process_time()
+            start = time.monotonic()
+            runner.start()
+            time.sleep(duration)
+            logger.messages.append('shutdown')
+            runner.join()
+            elapsed = time.monotonic() - start
+            cputime = time.process_time() - cpustart
+
+            samples = sum(len(sensor.data['value']) for sensor in logger.sensors.values())
+            conn = sqlite3.connect(os.environ['DBDATABASE'])
+            rows = conn.execute('SELECT COUNT(*) FROM data').fetchone()[0]
+            conn.close()
+
+            from databear.metrics import process_rss
+            results = {
+                'sensors':nsensors,
+                'rate_hz':rate,
+                'duration_s':elapsed,
+                'samples':samples,
+                'samples_per_s':samples/elapsed,
+                'expected_samples_per_s':nsensors*rate,
+                'rows':rows,
+                'rows_per_s':rows/elapsed,
+                'lag_ms':{
+                    'p50':percentile(lags,50)*1000 if lags else None,
+                    'p90':percentile(lags,90)*1000 if lags else None,
+                    'p99':percentile(lags,99)*1000 if lags else None,
+                    'max':max(lags)*1000 if lags else None
+                },
+                'cpu':cputime/elapsed,
+                'rss_bytes':process_rss(),
+                'maxrss_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            }
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='DataBear end to end benchmark')
+    parser.add_argument('--duration',type=float,default=60,help='Seconds per scenario')
+    parser.add_argument('--scenario',action='append',choices=list(scenarios),
+                        help='Scenario to run (default all)')
+    parser.add_argument('--output',default='benchmark_results.json',help='JSON results file')
+    args = parser.parse_args()
+
+    output = {
+        'timestamp':datetime.datetime.now().isoformat(),
+        'python':sys.version,
+        'platform':platform.platform(),
+        'scenarios':{}
+    }
+    for name in args.scenario or scenarios:
+        nsensors, rate = scenarios[name]
+        print('Running {} for {}s'.format(name,args.duration))
+        results = runScenario(name,nsensors,rate,args.duration)
+        output['scenarios'][name] = results
+        print(json.dumps(results,indent=2))
+
+    with open(args.output,'w') as fout:
+        json.dump(output,fout,indent=2)
+    print('Results saved to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
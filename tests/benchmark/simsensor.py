@@ -0,0 +1,19 @@
+'''
+Simulated sensor for benchmarking
+Generates a sine wave without any hardware. The measurement
+rate is set by measure_interval in the configuration.
+'''
+
+import math
+from databear.sensors import sensor
+from databear.samples import now_ns
+
+class dbsensor(sensor.Sensor):
+    measurements = ['value']
+    units = {'value':'-'}
+    measurement_description = {'value':'Simulated sine wave'}
+    min_interval = 0
+
+    def measure(self):
+        ts_ns = now_ns()
+        self.record('value',math.sin(ts_ns/1e9),ts_ns)
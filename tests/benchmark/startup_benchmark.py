@@ -0,0 +1,47 @@
+'''
+Logger start up benchmark
+
+Reports the cumulative import time of databear.logger from
+python -X importtime, best of several runs (the first may
+compile bytecode).
+
+Use:
+python startup_benchmark.py [--runs <n>] [--budget <ms>]
+With --budget the exit status is 1 if the import takes longer.
+'''
+
+import argparse
+import subprocess
+import sys
+
+def import_time(module):
+    '''
+    Cumulative import time (us) of a module reported by python -X importtime
+    '''
+    output = subprocess.run(
+        [sys.executable,'-X','importtime','-c','import {}'.format(module)],
+        capture_output=True,text=True,check=True).stderr
+    for line in output.splitlines():
+        #Form: import time: <self us> | <cumulative us> | <module>
+        fields = line.split('|')
+        if (len(fields) == 3) and (fields[2].strip() == module):
+            return int(fields[1])
+    raise ValueError('No import time for {}'.format(module))
+
+def main():
+    parser = argparse.ArgumentParser(description='Logger start up benchmark')
+    parser.add_argument('--runs',type=int,default=5)
+    parser.add_argument('--budget',type=float,help='maximum import time (ms)')
+    parser.add_argument('--module',default='databear.logger')
+    args = parser.parse_args()
+
+    times = [import_time(args.module)/1000 for i in range(args.runs)]
+    best = min(times)
+    print('{} imports in {:.1f} ms (best of {}, worst {:.1f} ms)'.format(
+        args.module,best,args.runs,max(times)))
+    if (args.budget is not None) and (best > args.budget):
+        print('Over budget of {:.1f} ms'.format(args.budget))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Timestamp formatting micro-benchmark
+
+Compares datetime.isoformat and strftime with
+databear.timeformat.TimestampFormatter for timestamps
+at typical Dump sample rates.
+
+Use:
+python timeformat_benchmark.py [--samples <n>] [--rate <Hz> ...]
+'''
+
+import argparse
+import datetime
+import time
+from databear.timeformat import TimestampFormatter
+
+def best_of(func,repeat=5):
+    times = []
+    for i in range(repeat):
+        starttime = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - starttime)
+    return min(times)
+
+def run(samples,rate):
+    start = datetime.datetime(2021,5,1,12,0,0)
+    step = datetime.timedelta(seconds=1/rate)
+    dts = [start + step*i for i in range(samples)]
+
+    def cached(timespec):
+        #A new formatter per run, as for each storage window
+        def func():
+            timeformat = TimestampFormatter(timespec)
+            return [timeformat.format(dt) for dt in dts]
+        return func
+
+    cases = [
+        ('isoformat microseconds',
+         lambda: [dt.isoformat(sep=' ',timespec='microseconds') for dt in dts],
+         cached('microseconds')),
+        ('isoformat seconds',
+         lambda: [dt.isoformat(sep=' ',timespec='seconds') for dt in dts],
+         cached('seconds')),
+        ('strftime minutes',
+         lambda: [dt.strftime('%Y-%m-%d %H:%M') for dt in dts],
+         cached('minutes'))
+    ]
+
+    print('{} samples at {} Hz'.format(samples,rate))
+    for name, baseline, formatter in cases:
+        tbase = best_of(baseline)
+        tcached = best_of(formatter)
+        print('  {:<24} {:8.0f} ns/value  cached {:8.0f} ns/value  speedup {:.1f}x'.format(
+            name,tbase/samples*1e9,tcached/samples*1e9,tbase/tcached))
+
+def main():
+    parser = argparse.ArgumentParser(description='Timestamp formatting benchmark')
+    parser.add_argument('--samples',type=int,default=100000)
+    parser.add_argument('--rate',type=float,nargs='+',default=[1,10,100])
+    args = parser.parse_args()
+    for rate in args.rate:
+        run(args.samples,rate)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Unit tests for databear.adaptive
+'''
+
+import queue
+import threading
+import unittest
+from datetime import datetime, timedelta
+from databear import schedule
+from databear.adaptive import AdaptiveRate
+from databear.errors import DataLogConfigError
+from databear.jobplan import MeasurePlan
+from databear.logger import DataLogger
+from databear.portworkers import PortWorkerPool
+from databear.sensors.sensor import Sensor
+from databear.subscriptions import SubscriptionManager
+
+class testSensor(Sensor):
+    measurements = ['temp']
+
+    def measure(self):
+        self.record('temp',self.value)
+
+def make_logger(sensor):
+    '''
+    A DataLogger with one sensor and port worker, without
+    database, driver or control sockets
+    '''
+    sensor.virtualport = 'port0'
+    logger = DataLogger.__new__(DataLogger)
+    logger.sensors = {sensor.name:sensor}
+    logger.adaptive = {}
+    logger.samplegroups = {}
+    logger.logschedule = schedule.Scheduler()
+    logger.inflight = {}
+    logger.inflightlock = threading.Lock()
+    logger.results = queue.SimpleQueue()
+    logger.wakeup = threading.Event()
+    logger.workerpool = PortWorkerPool(logger.results,logger.wakeup)
+    logger.latedata = {}
+    logger.subscriptions = SubscriptionManager()
+    logger.ringbuffers = {}
+    logger.journal = None
+    return logger
+
+def run(rate,values):
+    '''
+    Schedule rate every second with sensor values, in the order
+    of the logger: doMeasurement then endMeasurement
+    Returns [(seconds,interval),...] of the measurements made
+    '''
+    sensor = testSensor('tph1','1',0)
+    logger = make_logger(sensor)
+    logger.adaptive['tph1'] = rate
+    plan = MeasurePlan('tph1',sensor,rate.fast_interval,rate)
+    start = datetime.now()
+    measured = []
+    for second,value in enumerate(values):
+        sensor.value = value
+        logger.doMeasurement(plan,start + timedelta(seconds=second),None)
+        if not logger.inflight.get('tph1'):
+            continue
+        logger.endMeasurement(logger.results.get(timeout=2))
+        measured.append((second,rate.interval))
+    logger.workerpool.shutdown()
+    return measured
+
+class testAdaptive(unittest.TestCase):
+
+    def test_stable(self):
+        #The interval doubles up to the adaptive interval
+        rate = AdaptiveRate(1,8,threshold=0.5)
+        self.assertEqual(run(rate,[20.0]*30),
+                         [(0,2),(2,4),(6,8),(14,8),(22,8)])
+
+    def test_threshold(self):
+        rate = AdaptiveRate(1,8,threshold=0.5)
+        values = [20.0]*7 + [20.4]*8 + [21.0]*10
+        #A change within the threshold keeps slowing down,
+        #a larger change returns to the measure interval
+        self.assertEqual(run(rate,values),
+                         [(0,2),(2,4),(6,8),(14,8),(22,1),(23,2)])
+
+    def test_any_change(self):
+        rate = AdaptiveRate(1,4)
+        self.assertEqual(run(rate,[1.0,1.0,1.0,1.0,1.1,1.1,1.1]),
+                         [(0,2),(2,4),(6,1)])
+
+    def test_not_numbers(self):
+        rate = AdaptiveRate(1,4,threshold=0.5)
+        self.assertEqual(run(rate,[1.0,1.0,None,None,None,None,1.0]),
+                         [(0,2),(2,4),(6,4)])
+
+    def test_due_tolerance(self):
+        start = datetime(2021,5,1,12,0,0)
+        rate = AdaptiveRate(2,8)
+        self.assertTrue(rate.due(start))
+        rate.update({'temp':[]},start)
+        #Scheduled times can be early by up to half the measure interval
+        self.assertFalse(rate.due(start + timedelta(seconds=2.9)))
+        self.assertTrue(rate.due(start + timedelta(seconds=3)))
+
+    def test_invalid(self):
+        with self.assertRaises(DataLogConfigError):
+            AdaptiveRate(10,5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+'''
+Unit tests for databear.compression and compacting data blocks
+'''
+
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from databear import compression
+
+class testCompression(unittest.TestCase):
+
+    def test_timestamps(self):
+        start = compression.to_microseconds(datetime(2021,5,1))
+        timestamps = [start + i*1000000 for i in range(100)]
+        timestamps += [timestamps[-1] + random.randint(0,10**10) for i in range(100)]
+        timestamps.sort()
+        data = compression.encode_timestamps(timestamps)
+        self.assertEqual(compression.decode_timestamps(data,len(timestamps)),timestamps)
+
+    def test_values(self):
+        values = [20.5]*10 + [random.uniform(-100,100) for i in range(200)]
+        values += [0.0,-0.0,1e300,float('inf'),5e-324]
+        data = compression.encode_values(values)
+        self.assertEqual(compression.decode_values(data,len(values)),values)
+
+    def test_block(self):
+        dt = datetime(2021,5,1,12,0,0,500)
+        for timespec in ['minutes','seconds','microseconds']:
+            rows = []
+            for i in range(50):
+                rows.append((
+                    (dt + timedelta(seconds=i*60)).isoformat(sep=' ',timespec=timespec),
+                    random.random(),
+                    random.choice([0,1,None]),
+                    random.choice([0,2,None])))
+            encoded = compression.encode_block(rows)
+            self.assertEqual(compression.decode_block(len(rows),*encoded),rows)
+
+    def test_compact(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            dt = datetime(2021,5,1)
+            for i in range(1000):
+                dtstr = (dt + timedelta(seconds=i)).isoformat(sep=' ',timespec='seconds')
+                db.storeData(dtstr,i/3,1,1,0)
+            before = db.getData(1,'2021-05-01','2021-05-02')
+
+            compacted = db.compactData(1,'2021-05-01 00:10:00',blocksize=256)
+            self.assertEqual(compacted,600)
+            self.assertEqual(db.getData(1,'2021-05-01','2021-05-02'),before)
+            self.assertEqual(
+                db.getData(1,'2021-05-01 00:05:00','2021-05-01 00:12:00'),
+                before[300:720])
+            self.assertEqual(db.compactData(1,'2021-05-01 00:10:00'),0)
+
+            #Runs of other sensor configurations and timestamp formats
+            for i in range(100):
+                db.storeData((dt + timedelta(minutes=i)).isoformat(sep=' ',timespec='minutes'),
+                             float(i),2,1,0)
+            before = db.getData(1,'2021-05-01','2021-05-02')
+            self.assertEqual(db.compactData(1,'2021-05-01 01:00',blocksize=64),460)
+            self.assertEqual(db.getData(1,'2021-05-01','2021-05-02'),before)
+            db.curs.execute('SELECT COUNT(*) FROM data WHERE dtstamp<?',('2021-05-01 01:00',))
+            self.assertEqual(db.curs.fetchone()[0],0)
+            db.close()
+            del os.environ['DBDATABASE']
+
+    def test_data_view(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            dt = datetime(2021,5,1)
+            for name in ['tph1','tph2']:
+                sensor_id = db.addSensor('tph',name,name,0,'port0')
+                sensor_config_id = db.addSensorConfig(sensor_id,5)
+                configid = db.addLoggingConfig(measurement_id,sensor_id,60,db.process_ids['Max'],1)
+                for i in range(120):
+                    dtstr = (dt + timedelta(minutes=i)).isoformat(sep=' ',timespec='minutes')
+                    db.storeData(dtstr,i/4,sensor_config_id,configid,0)
+
+            db.curs.execute('SELECT * FROM dataview')
+            before = sorted((dict(row) for row in db.curs.fetchall()),
+                            key=lambda row: (row['dtstamp'],row['sensor_name']))
+            self.assertEqual(len(before),240)
+            db.compactData(1,'2021-05-01 01:00')
+
+            #Compacted rows leave the view but not getDataView
+            db.curs.execute('SELECT COUNT(*) FROM dataview')
+            self.assertEqual(db.curs.fetchone()[0],180)
+            rows = db.getDataView('2021-05-01','2021-05-02')
+            self.assertEqual(sorted(rows,key=lambda row: (row['dtstamp'],row['sensor_name'])),before)
+            self.assertEqual(rows[0],{'dtstamp':'2021-05-01 00:00','value':0.0,'sensor_name':'tph1',
+                                      'measurement':'air_temperature','process':'Max',
+                                      'measure_interval':5})
+            self.assertEqual(len(db.getDataView('2021-05-01','2021-05-01 00:30','tph2')),30)
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
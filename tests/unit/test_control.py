@@ -0,0 +1,42 @@
+'''
+Unit tests for the framed control protocol in databear.control
+'''
+
+import socket
+import threading
+import unittest
+from databear import control
+
+class testControl(unittest.TestCase):
+
+    def test_pipelined_frames(self):
+        server, client = socket.socketpair()
+        conn = control.ControlConnection(server)
+
+        #Two requests, the second split across writes
+        frames = (control.encode_frame({'command':'status','id':1}) +
+                  control.encode_frame({'command':'getdata','arg':'x'*70000,'id':2}))
+        client.sendall(frames[:10])
+        self.assertEqual(conn.read(),[])
+        sender = threading.Thread(target=client.sendall,args=(frames[10:],))
+        sender.start()
+
+        requests = []
+        while len(requests) < 2:
+            requests.extend(conn.read())
+        sender.join()
+        self.assertEqual([r['id'] for r in requests],[1,2])
+        self.assertEqual(len(requests[1]['arg']),70000)
+
+        #Large response read back by the client
+        sender = threading.Thread(target=conn.send,args=({'rows':list(range(100000)),'more':False},))
+        sender.start()
+        self.assertEqual(len(control.recv_frame(client)['rows']),100000)
+        sender.join()
+
+        client.close()
+        self.assertIsNone(conn.read())
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
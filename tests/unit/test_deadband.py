@@ -0,0 +1,94 @@
+'''
+Unit tests for databear.deadband
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from databear import process
+from databear.deadband import (Deadband, STORE_INITIAL, STORE_CHANGE,
+                               STORE_HEARTBEAT)
+from databear.jobplan import StoragePlan
+from databear.logger import DataLogger
+from databear.records import RecordBuffer
+from databear.samples import to_ns
+from databear.sensors.sensor import Sensor
+from databear.subscriptions import SubscriptionManager
+
+class testSensor(Sensor):
+    measurements = ['value']
+
+start = datetime(2021,5,1,12,0,0)
+
+def minutes(values):
+    '''
+    Processed data with one value per minute
+    '''
+    return [(start + timedelta(minutes=i),value) for i,value in enumerate(values)]
+
+class testDeadband(unittest.TestCase):
+
+    def test_any_change(self):
+        deadband = Deadband()
+        output = deadband.filter(minutes([1.0,1.0,1.5,1.5]))
+        self.assertEqual([(value,reason) for dt,value,reason in output],
+                         [(1.0,STORE_INITIAL),(1.5,STORE_CHANGE)])
+
+    def test_absolute(self):
+        deadband = Deadband(absolute=0.5)
+        output = deadband.filter(minutes([10.0,10.4,10.6,10.2,9.9]))
+        #Changes are measured from the last stored value
+        self.assertEqual([(value,reason) for dt,value,reason in output],
+                         [(10.0,STORE_INITIAL),(10.6,STORE_CHANGE),(9.9,STORE_CHANGE)])
+
+    def test_relative(self):
+        deadband = Deadband(relative=0.1)
+        output = deadband.filter(minutes([100.0,109.0,111.0,-100.0]))
+        self.assertEqual([value for dt,value,reason in output],[100.0,111.0,-100.0])
+
+    def test_heartbeat(self):
+        deadband = Deadband(absolute=1,heartbeat=180)
+        output = deadband.filter(minutes([5.0]*7))
+        self.assertEqual([(dt.minute,reason) for dt,value,reason in output],
+                         [(0,STORE_INITIAL),(3,STORE_HEARTBEAT),(6,STORE_HEARTBEAT)])
+
+    def test_not_numbers(self):
+        #Failed readings are skipped and don't reset the deadband
+        deadband = Deadband(absolute=0.5)
+        output = deadband.filter(minutes([None,'error',1.0,1.2,None,'error',1.8]))
+        self.assertEqual([(value,reason) for dt,value,reason in output],
+                         [(1.0,STORE_INITIAL),(1.8,STORE_CHANGE)])
+
+    def test_store_failed_readings(self):
+        #Failed readings are dropped by the storage job, with or without a deadband
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            measurement_id = db.addMeasurement('tph','value','C')
+            sensor_id = db.addSensor('tph','tph1','1',0,'port0')
+            sensor = testSensor('tph1','1',0)
+            sensor.configid = db.addSensorConfig(sensor_id,1)
+            for i,value in enumerate([1.0,None,'error',float('nan'),2.0]):
+                sensor.record('value',value,to_ns(start + timedelta(seconds=i)))
+
+            logger = DataLogger.__new__(DataLogger)
+            logger.db = db
+            logger.journal = None
+            logger.records = RecordBuffer()
+            logger.subscriptions = SubscriptionManager()
+            for deadband in [None,Deadband()]:
+                configid = db.addLoggingConfig(measurement_id,sensor_id,60,db.process_ids['Dump'],1)
+                plan = StoragePlan(configid,'value','tph1',sensor,sensor.data['value'],'Dump',
+                                   process.processes['Dump'],60,deadband,None,None,None)
+                with self.assertLogs(level='WARNING'):
+                    dtstamps = logger.storeWindow(plan,start,start + timedelta(minutes=1))
+                self.assertEqual(len(dtstamps),2)
+                self.assertEqual([row[1] for row in db.getData(configid,'2021-05-01','2021-05-02')],
+                                 [1.0,2.0])
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''
+Unit tests for databear.derived
+'''
+
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+from databear.sensors.sensor import Sensor
+from databear.samples import to_ns
+from databear.errors import SensorConfigError
+from databear.derived import DerivedSensor, compile_expression, input_names
+
+class testSensor(Sensor):
+    measurements = ['temp','rh']
+
+class testDerived(unittest.TestCase):
+
+    def test_expressions(self):
+        function, inputs = compile_expression('tph1.temp*9/5 + 32')
+        self.assertEqual(inputs,[('tph1','temp')])
+        self.assertEqual(function(100.0),212.0)
+        self.assertEqual(input_names('dewpoint(tph1.temp,tph2.rh) - tph1.temp'),
+                         [('tph1','temp'),('tph2','rh')])
+
+        for expression in ['__import__("os")','tph1.temp.real','tph1.temp(1)',
+                           'open(tph1.temp)','[tph1.temp]','x + tph1.temp','2 +','"a"','1 + 2']:
+            with self.assertRaises(SensorConfigError):
+                compile_expression(expression)
+
+    def test_derived_sensor(self):
+        start = datetime(2021,5,1,12,0,0)
+        t = lambda s: to_ns(start + timedelta(seconds=s))
+        tph1 = testSensor('tph1','1',0)
+        tph2 = testSensor('tph2','2',0)
+        derived = DerivedSensor('calc','calc',0)
+        derived.addMeasurement('diff','tph1.temp - tph2.temp',{'tph1':tph1,'tph2':tph2})
+
+        tph1.record('temp',10.0,t(0))
+        tph2.record('temp',1.0,t(0))
+        tph1.record('temp',20.0,t(1))
+        tph1.record('temp',None,t(2))
+        tph1.record('temp',40.0,t(3))
+        tph2.record('temp',3.0,t(2.5))
+
+        #The newest sample waits for tph2
+        self.assertEqual([v for dt,v in derived.getdata('diff',start,start + timedelta(1))],
+                         [9.0,19.0])
+        self.assertEqual(len(derived.data['diff']),2)
+        tph2.record('temp',4.0,t(3))
+        self.assertEqual(derived.getcurrentdata(),{'diff':(start + timedelta(seconds=3),36.0)})
+
+    def test_concurrent_reads(self):
+        #Storage and getdata commands read from different threads
+        start = datetime(2021,5,1,12,0,0)
+        tph1 = testSensor('tph1','1',0)
+        derived = DerivedSensor('calc','calc',0)
+        derived.addMeasurement('temp_f','tph1.temp*9/5 + 32',{'tph1':tph1})
+        barrier = threading.Barrier(2)
+        switchinterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) #Switch threads often
+        self.addCleanup(sys.setswitchinterval,switchinterval)
+
+        def read(function,*args):
+            barrier.wait()
+            for i in range(50):
+                function(*args)
+
+        for i in range(10):
+            for s in range(200):
+                tph1.record('temp',float(s),to_ns(start + timedelta(seconds=200*i + s)))
+            threads = [threading.Thread(target=read,args=(derived.getcurrentdata,)),
+                       threading.Thread(target=read,args=(derived.getdata,'temp_f',
+                                                          start,start + timedelta(1)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(derived.data['temp_f']),len(tph1.data['temp']))
+
+if __name__ == '__main__':
+    unittest.main()
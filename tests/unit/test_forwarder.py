@@ -0,0 +1,156 @@
+'''
+Unit tests for databear.forwarder using local stand-in servers
+'''
+
+import os
+import json
+import zlib
+import struct
+import socket
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import http.server
+from databear.databearDB import DataBearDB
+from databear.forwarder import Forwarder
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Fails the first request then accepts payloads
+    '''
+    def do_POST(self):
+        payload = self.rfile.read(int(self.headers['Content-Length']))
+        if not self.server.failed:
+            self.server.failed = True
+            self.send_response(503)
+        else:
+            self.server.received.append(json.loads(zlib.decompress(payload)))
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self,*args):
+        pass
+
+def tcpServer(listener,received):
+    conn, address = listener.accept()
+    with conn:
+        while True:
+            header = conn.recv(4,socket.MSG_WAITALL)
+            if not header:
+                break
+            length = struct.unpack('>I',header)[0]
+            payload = conn.recv(length,socket.MSG_WAITALL)
+            received.append(json.loads(zlib.decompress(payload)))
+            conn.sendall(struct.pack('>I',2) + b'OK')
+
+class testForwarder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['DBDATABASE'] = os.path.join(self.tmpdir.name,'test.db')
+        self.db = DataBearDB()
+
+        #Minimal configuration for a logging config
+        self.db.curs.executescript(
+            "INSERT INTO sensors_available (sensor_module) VALUES ('sim');"
+            "INSERT INTO sensors (name,serial_number,address,virtualport,module_name) "
+            "VALUES ('sim1','1',0,'port0','sim');"
+            "INSERT INTO measurements (name,units,sensor_module) VALUES ('temp','C','sim');")
+        sensorconfig = self.db.addSensorConfig(1,1)
+        loggingconfig = self.db.addLoggingConfig(1,1,1,5,1)
+        for i in range(25):
+            self.db.storeData('2021-05-01 00:00:{:02d}'.format(i),i,sensorconfig,loggingconfig,0)
+
+    def tearDown(self):
+        self.db.close()
+        del os.environ['DBDATABASE']
+        self.tmpdir.cleanup()
+
+    def waitForRows(self,received,nrows):
+        for i in range(100):
+            if sum(len(batch['rows']) for batch in received) >= nrows:
+                return
+            threading.Event().wait(0.05)
+
+    def test_http(self):
+        server = http.server.HTTPServer(('localhost',0),StandInHandler)
+        server.failed = False
+        server.received = []
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+
+        url = 'http://localhost:{}/data'.format(server.server_port)
+        self.db.addForwardDestination('central',url,batch_size=10)
+        forwarder = Forwarder('central',url,10,interval=0.05,backoff=0.05)
+        forwarder.start()
+        self.waitForRows(server.received,25)
+        forwarder.stop()
+        server.shutdown()
+        server.server_close()
+
+        #First batch retried after failure, then batches of 10
+        self.assertEqual([len(b['rows']) for b in server.received],[10,10,5])
+        self.assertEqual(server.received[0]['rows'][0][1:5],
+                         ['2021-05-01 00:00:00',0.0,'sim1','temp'])
+        self.assertEqual(self.db.getForwardDestinations()[0]['last_data_id'],25)
+
+    def test_resume(self):
+        listener = socket.socket()
+        listener.bind(('localhost',0))
+        listener.listen(1)
+        received = []
+        threading.Thread(target=tcpServer,args=(listener,received),daemon=True).start()
+
+        url = 'tcp://localhost:{}'.format(listener.getsockname()[1])
+        self.db.addForwardDestination('central',url,batch_size=100)
+        self.db.setForwardMark('central',20)
+        forwarder = Forwarder('central',url,100,interval=0.05)
+        forwarder.start()
+        self.waitForRows(received,5)
+        forwarder.stop()
+        listener.close()
+
+        #Only rows after the high water mark are sent
+        self.assertEqual([row[0] for row in received[0]['rows']],[21,22,23,24,25])
+
+    def test_database_errors(self):
+        server = http.server.HTTPServer(('localhost',0),StandInHandler)
+        server.failed = True
+        server.received = []
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+
+        #Each database call of the forwarder fails once
+        failed = set()
+        def failOnce(method):
+            original = getattr(DataBearDB,method)
+            def call(db,*args):
+                if method not in failed:
+                    failed.add(method)
+                    raise sqlite3.OperationalError('database is locked')
+                return original(db,*args)
+            return mock.patch.object(DataBearDB,method,call)
+
+        url = 'http://localhost:{}/data'.format(server.server_port)
+        self.db.addForwardDestination('central',url,batch_size=100)
+        forwarder = Forwarder('central',url,100,interval=0.05,backoff=0.05)
+        with failOnce('getForwardDestinations'), failOnce('getForwardData'), \
+                failOnce('setForwardMark'), self.assertLogs(level='WARNING') as logs:
+            forwarder.start()
+            self.waitForRows(server.received,25)
+            for i in range(100):
+                if self.db.getForwardDestinations()[0]['last_data_id'] == 25:
+                    break
+                threading.Event().wait(0.05)
+        forwarder.stop()
+        server.shutdown()
+        server.server_close()
+
+        #The forwarder keeps running and each batch is sent once
+        self.assertEqual(len(logs.output),3)
+        self.assertIn('database is locked',logs.output[0])
+        self.assertEqual([len(b['rows']) for b in server.received],[25])
+        self.assertEqual(self.db.getForwardDestinations()[0]['last_data_id'],25)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+'''
+Unit tests for databear.gaps and the gaps table
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from databear.gaps import GAP_NO_DATA, gap_window
+
+class testGaps(unittest.TestCase):
+
+    def test_gap_window(self):
+        enddt = datetime(2021,5,1,12,1)
+        self.assertEqual(gap_window(datetime(2021,4,30,12,1),enddt,60),
+                         (datetime(2021,5,1,12),enddt))
+
+    def test_gaps(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            sensor_id = db.addSensor('tph','tph1','1',0,'port0')
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            configid = db.addLoggingConfig(measurement_id,sensor_id,60,2,1)
+
+            #Consecutive missing windows are one gap
+            for minute in range(3):
+                db.addGap(configid,'2021-05-01 12:0{}:00'.format(minute),
+                          '2021-05-01 12:0{}:00'.format(minute + 1),GAP_NO_DATA)
+            db.addGap(configid,'2021-05-01 12:10:00','2021-05-01 12:11:00',GAP_NO_DATA)
+            self.assertEqual(db.getGaps(configid,'2021-05-01','2021-05-02'),[
+                ('2021-05-01 12:00:00','2021-05-01 12:03:00',GAP_NO_DATA),
+                ('2021-05-01 12:10:00','2021-05-01 12:11:00',GAP_NO_DATA)])
+
+            #Late data filled the middle window
+            db.removeGap(configid,'2021-05-01 12:01:00','2021-05-01 12:02:00')
+            self.assertEqual(len(db.getGaps(configid,'2021-05-01','2021-05-02')),3)
+
+            availability = db.getAvailability('2021-05-01 12:00:00','2021-05-01 12:20:00','tph1')
+            self.assertEqual(availability[0]['gaps'],3)
+            self.assertAlmostEqual(availability[0]['missing_seconds'],180,places=1)
+            self.assertAlmostEqual(availability[0]['completeness'],0.85,places=3)
+            self.assertEqual(db.getAvailability('2021-05-01','2021-05-02','other'),[])
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
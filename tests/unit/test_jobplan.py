@@ -0,0 +1,51 @@
+'''
+Unit tests for job plans and the set-based configuration queries
+'''
+
+import os
+import tempfile
+import unittest
+from databear import process
+from databear.jobplan import StoragePlan
+
+class testJobPlan(unittest.TestCase):
+
+    def test_configs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            configids = []
+            for i in range(3):
+                sensor_id = db.addSensor('tph','tph{}'.format(i),str(i),0,'port{}'.format(i))
+                db.addSensorConfig(sensor_id,1,sample_group='met' if i else None)
+                configids.append(db.addLoggingConfig(
+                    measurement_id,sensor_id,60,2,1,qc={'max':50}))
+            db.setConfigStatus('logging',configids[0],'deactivate')
+
+            #One query returns the same settings as the queries by id
+            sensors = db.getSensorConfigs()
+            self.assertEqual([sensor['name'] for sensor in sensors],['tph0','tph1','tph2'])
+            for sensor in sensors:
+                self.assertEqual(sensor,dict(db.getSensorConfig(sensor['sensor_id']),
+                                             sensor_id=sensor['sensor_id']))
+            configs = db.getLoggingConfigs()
+            self.assertEqual([config['logging_config_id'] for config in configs],configids[1:])
+            for config in configs:
+                self.assertEqual(config,dict(db.getLoggingConfig(config['logging_config_id']),
+                                             logging_config_id=config['logging_config_id']))
+            self.assertEqual(configs[0]['qc'],{'max':50})
+            db.close()
+            del os.environ['DBDATABASE']
+
+    def test_plan(self):
+        plan = StoragePlan(1,'air_temperature','tph1',None,None,'Max',
+                           process.processes['Max'],60,None,None,None,None)
+        with self.assertRaises(AttributeError):
+            plan.interval = 10
+        self.assertEqual(plan.calculate([(None,1.0),(None,3.0)],'end'),[('end',3.0)])
+        self.assertEqual(process.calculate('Sample',[('start',2.0)],'end'),[('start',2.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+'''
+Unit tests for databear.journal
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from databear.journal import Journal, JOURNAL_MAGIC
+
+class testSensor:
+    def __init__(self):
+        self.name = 'tph1'
+        self.data = {'temp':[],'status':[]}
+
+class testJournal(unittest.TestCase):
+
+    def test_replay(self):
+        start = datetime(2021,5,1,12,0,0,250)
+        sensor = testSensor()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'journal')
+            journal = Journal(path)
+            for i in range(5):
+                sensor.data['temp'].append((start + timedelta(seconds=i),i/4))
+            sensor.data['status'].append((start,None))
+            sensor.data['status'].append((start + timedelta(seconds=1),'ok'))
+            journal.publishSamples(sensor,['temp','status'])
+            journal.publishSamples(sensor,['temp','status'])
+            journal.checkpoint(3,start + timedelta(seconds=2))
+            journal.close()
+
+            #Torn write at the end is ignored
+            with open(path,'ab') as fout:
+                fout.write(b'S\x12\x00')
+            journal = Journal(path)
+            samples, checkpoints, size = journal.read()
+            self.assertEqual(size,os.path.getsize(path))
+            self.assertEqual(samples[('tph1','temp')],sensor.data['temp'])
+            self.assertEqual(samples[('tph1','status')],sensor.data['status'])
+            self.assertEqual(checkpoints,{3:start + timedelta(seconds=2)})
+
+            #Appending continues the same keys after reopening
+            journal.replayed(('tph1','temp'),sensor.data['temp'][-1][0])
+            sensor.data['temp'].append((start + timedelta(seconds=5),2.0))
+            journal.publishSamples(sensor,['temp'])
+            journal.flush(force=True)
+            self.assertEqual(journal.read()[0][('tph1','temp')],sensor.data['temp'])
+
+            #Rotation keeps only the samples given
+            journal.rotate(lambda: {('tph1','temp'):sensor.data['temp'][3:]})
+            samples, checkpoints, size = journal.read()
+            self.assertEqual(samples,{('tph1','temp'):sensor.data['temp'][3:]})
+            self.assertEqual(checkpoints,{3:start + timedelta(seconds=2)})
+            journal.close()
+
+    def test_values(self):
+        start = datetime(2021,5,1,12,0,0)
+        sensor = testSensor()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'journal')
+            journal = Journal(path)
+            #A value over 64 kB and one JSON can't encode
+            spectrum = [i/7 for i in range(20000)]
+            sensor.data['status'].append((start,spectrum))
+            sensor.data['status'].append((start + timedelta(seconds=1),object()))
+            with self.assertLogs(level='WARNING'):
+                journal.publishSamples(sensor,['status'])
+            journal.close()
+
+            samples = Journal(path).read()[0]
+            self.assertEqual(samples[('tph1','status')],
+                             [(start,spectrum),(start + timedelta(seconds=1),None)])
+
+    def test_not_journal(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'journal')
+            with open(path,'wb') as fout:
+                fout.write(b'not a journal')
+            with self.assertRaises(ValueError):
+                Journal(path)
+            with open(path,'rb') as fin:
+                self.assertEqual(fin.read(),b'not a journal')
+
+            #A file torn before the magic was written is started again
+            with open(path,'wb') as fout:
+                fout.write(JOURNAL_MAGIC[:2])
+            Journal(path).close()
+            with open(path,'rb') as fin:
+                self.assertEqual(fin.read(),JOURNAL_MAGIC)
+
+if __name__ == '__main__':
+    unittest.main()
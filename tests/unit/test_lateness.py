@@ -0,0 +1,26 @@
+'''
+Unit tests for databear.lateness
+'''
+
+import unittest
+from datetime import datetime, timedelta
+from databear.lateness import LateData
+
+class testLateData(unittest.TestCase):
+
+    def test_late(self):
+        start = datetime(2021,5,1,12,0,0)
+        t = lambda s: start + timedelta(seconds=s)
+        latedata = LateData(0.5,maxwindows=2)
+        data = [(t(0),1.0),(t(1),2.0)]
+
+        #Nothing is late before a window is stored
+        self.assertEqual(latedata.late(data),([],0,0))
+        latedata.stored(t(0),t(2),['a'])
+        latedata.stored(t(2),t(4),['b'])
+        latedata.stored(t(4),t(6),['c'])
+
+        #Samples are only checked once
+        data.extend([(t(6.5),3.0),(t(5),4.0),(t(1.5),5.0),(t(4.5),6.0)])
+        self.assertEqual(latedata.late(data),([[t(4),t(6),['c']]],2,1))
+        self.assertEqual(latedata.late(data),([],0,0))
@@ -0,0 +1,67 @@
+'''
+Unit tests for databear.metrics
+'''
+
+import unittest
+from databear.metrics import Registry, Timer
+
+class testMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        rows = registry.counter('rows_total','Rows written',['sensor'])
+        rows.inc(sensor='tph1')
+        rows.inc(2,sensor='tph1')
+        rows.inc(sensor='wind "1"')
+        registry.gauge('queue','Queue length',callback=lambda: {():4})
+        latency = registry.histogram('latency_seconds','Latency',['port'],buckets=(0.1,1))
+        latency.observe(0.05,port='port0')
+        latency.observe(0.5,port='port0')
+
+        self.assertEqual(registry.render().splitlines(),[
+            '# HELP rows_total Rows written',
+            '# TYPE rows_total counter',
+            'rows_total{sensor="tph1"} 3.0',
+            'rows_total{sensor="wind \\"1\\""} 1.0',
+            '# HELP queue Queue length',
+            '# TYPE queue gauge',
+            'queue 4.0',
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{port="port0",le="0.1"} 1.0',
+            'latency_seconds_bucket{port="port0",le="1.0"} 2.0',
+            'latency_seconds_bucket{port="port0",le="+Inf"} 2.0',
+            'latency_seconds_sum{port="port0"} 0.55',
+            'latency_seconds_count{port="port0"} 2.0'])
+
+    def test_register(self):
+        #A metric with the same name replaces the old one
+        registry = Registry()
+        registry.counter('rows_total','Rows written').inc()
+        rows = registry.counter('rows_total','Rows written')
+        self.assertEqual(list(registry.metrics.values()),[rows])
+        self.assertEqual(rows.samples(),[])
+
+    def test_gauge(self):
+        registry = Registry()
+        depth = registry.gauge('depth','Queue depth',['port'])
+        depth.set(3,port='port0')
+        depth.set(1,port='port0')
+        self.assertEqual(depth.samples(),[('depth','{port="port0"}',1)])
+
+        def failed():
+            raise RuntimeError('no value')
+        broken = registry.gauge('broken','Failing callback',callback=failed)
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(broken.samples(),[])
+
+    def test_timer(self):
+        registry = Registry()
+        latency = registry.histogram('latency_seconds','Latency',buckets=(10,))
+        with Timer(latency):
+            pass
+        self.assertEqual(latency.samples()[0],('latency_seconds_bucket','{le="10.0"}',1))
+        self.assertEqual(latency.samples()[-1],('latency_seconds_count','',1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Unit tests for databear.portworkers
+'''
+
+import queue
+import threading
+import time
+import unittest
+from datetime import datetime
+from databear.sensors.sensor import Sensor, BusSensor
+from databear.samples import to_ns
+from databear.portworkers import PortWorkerPool, PortJob
+
+class testBusSensor(BusSensor):
+    measurements = ['value']
+
+    def startMeasure(self):
+        self.started = time.monotonic()
+        return 0.2
+
+    def readMeasure(self,starttime):
+        if self.name == 'bad':
+            raise ValueError('No response')
+        self.data['value'].append((starttime,time.monotonic() - self.started))
+
+class testSensor(Sensor):
+    measurements = ['value']
+
+    def measure(self):
+        self.record('value',threading.current_thread().name)
+
+class testPortWorkers(unittest.TestCase):
+
+    def test_jobs(self):
+        results = queue.SimpleQueue()
+        wakeup = threading.Event()
+        pool = PortWorkerPool(results,wakeup)
+        sensors = [testBusSensor(name,'1',i) for i,name in enumerate(['b1','b2','bad'])]
+        simsensor = testSensor('sim','1',0)
+
+        starttime = time.monotonic()
+        for sensor in sensors:
+            pool.submit('port1',PortJob(sensor,sensor.name,None))
+        pool.submit('port0',PortJob(simsensor,simsensor.name,None))
+        pool.submit('port0',PortJob(simsensor,simsensor.name,None))
+        self.assertTrue(wakeup.wait(1))
+
+        #Shutdown finishes bus reads in progress
+        pool.shutdown()
+        elapsed = time.monotonic() - starttime
+        jobs = {}
+        while not results.empty():
+            job = results.get()
+            jobs.setdefault(job.sname,[]).append(job)
+
+        #Bus waits overlap on one thread per port
+        self.assertLess(elapsed,0.5)
+        self.assertEqual(sorted(jobs),['b1','b2','bad','sim'])
+        self.assertIsNone(jobs['b1'][0].exception())
+        self.assertIsInstance(jobs['bad'][0].exception(),ValueError)
+        self.assertEqual(len(sensors[0].data['value']),1)
+        self.assertEqual([v[1] for v in simsensor.data['value']],['port-port0','port-port0'])
+
+    def test_sampletime(self):
+        #Jobs of a sample group stamp samples with the shared time
+        results = queue.SimpleQueue()
+        pool = PortWorkerPool(results)
+        dt = datetime(2021,5,1,12,0,0)
+        busSensor = testBusSensor('b1','1',0)
+        simsensor = testSensor('sim','1',0)
+        pool.submit('port1',PortJob(busSensor,'b1',dt,to_ns(dt)))
+        pool.submit('port0',PortJob(simsensor,'sim',dt,to_ns(dt)))
+        pool.submit('port0',PortJob(simsensor,'sim',dt))
+        pool.shutdown()
+
+        self.assertEqual(busSensor.data['value'][0][0],dt)
+        self.assertEqual(simsensor.data['value'][0][0],dt)
+        self.assertGreater(simsensor.data['value'][1][0],dt)
+        self.assertIsNone(simsensor.sampletime)
@@ -0,0 +1,80 @@
+'''
+Unit tests for databear.profiler
+'''
+
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from databear.logger import DataLogger
+from databear.profiler import Profiler
+
+def busy(stopevent):
+    while not stopevent.is_set():
+        sum(range(1000))
+
+class testProfiler(unittest.TestCase):
+
+    def test_start_and_dump(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler = Profiler(60,os.path.join(tmpdir,'profile'),interval=0.001)
+            self.assertEqual(profiler.stop(),[]) #Never started
+
+            stopevent = threading.Event()
+            worker = threading.Thread(target=busy,args=(stopevent,),name='worker')
+            worker.start()
+            profiler.start()
+            time.sleep(0.1)
+            self.assertFalse(profiler.expired)
+
+            #Stop early
+            profiler.expire()
+            self.assertTrue(profiler.expired)
+            outputs = profiler.stop()
+            stopevent.set()
+            worker.join()
+
+            pstatsfile, collapsedfile = outputs
+            self.assertEqual(outputs,profiler.outputs)
+            functions = [func[2] for func in pstats.Stats(pstatsfile).stats]
+            self.assertIn('sleep',str(functions))
+
+            with open(collapsedfile) as collapsed:
+                lines = collapsed.read().splitlines()
+            stacks = {}
+            for line in lines:
+                stack, count = line.rsplit(' ',1)
+                stacks[stack] = int(count)
+            self.assertTrue(any(stack.startswith('worker;') and stack.endswith('test_profiler.py:busy')
+                                for stack in stacks))
+            self.assertFalse(any(stack.startswith('profiler;') for stack in stacks))
+
+    def test_expire_before_start(self):
+        #Expired as soon as the run loop starts it
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profiler = Profiler(60,os.path.join(tmpdir,'profile'))
+            profiler.expire()
+            self.assertFalse(profiler.expired)
+            profiler.start()
+            self.assertTrue(profiler.expired)
+            self.assertEqual(profiler.stop(),profiler.outputs)
+            self.assertTrue(all(os.path.exists(output) for output in profiler.outputs))
+
+    def test_shard_prefix(self):
+        #Shards write separate files
+        logger = DataLogger.__new__(DataLogger)
+        logger.profiler = None
+        logger.messages = []
+        os.environ['DBSHARD'] = '1'
+        try:
+            response = logger.runCommand({'command':'profile','arg':5})
+        finally:
+            del os.environ['DBSHARD']
+        self.assertEqual(logger.messages,['profile'])
+        self.assertTrue(all(os.path.basename(output).startswith('databear_profile_') and
+                            ('.shard1.' in output) for output in response['files']))
+
+if __name__ == '__main__':
+    unittest.main()
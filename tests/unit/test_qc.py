@@ -0,0 +1,67 @@
+'''
+Unit tests for databear.qc
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+import numpy as np
+from databear.qc import (QualityControl, row_flags,
+                         QC_RANGE, QC_STEP, QC_PERSISTENCE, QC_GAP)
+from databear.samples import SampleBuffer, to_ns
+
+class testQC(unittest.TestCase):
+
+    def test_check(self):
+        qc = QualityControl(minimum=0,maximum=10,step=3,persistence=3,gap=1.5)
+        start = to_ns(datetime(2021,5,1,12))
+        timestamps = start + np.array([0,1,2,3,5,6],dtype=np.int64)*1000000000
+        values = np.array([1.0,2.0,12.0,5.0,5.0,5.0])
+        self.assertEqual(qc.check(timestamps,values).tolist(),[
+            0,0,QC_RANGE|QC_STEP,QC_STEP,QC_GAP,QC_PERSISTENCE])
+
+        #Runs and steps continue from the last window
+        timestamps = start + np.array([7,8],dtype=np.int64)*1000000000
+        values = np.array([5.0,9.0])
+        self.assertEqual(qc.check(timestamps,values).tolist(),[QC_PERSISTENCE,QC_STEP])
+
+        #An earlier window checked again doesn't use or change the state
+        values = np.array([9.0,9.0])
+        self.assertEqual(qc.check(timestamps,values,carry=False).tolist(),[0,0])
+        self.assertEqual(qc.lastvalue,9.0)
+        self.assertEqual(qc.check(timestamps[:0],values[:0]).tolist(),[])
+
+    def test_row_flags(self):
+        buffer = SampleBuffer()
+        dts = [datetime(2021,5,1,12,0,s) for s in range(3)]
+        for dt, value in zip(dts,[1.0,'error',50.0]):
+            buffer.append((dt,value))
+        timestamps, values = buffer.arrays(to_ns(dts[0]),to_ns(datetime(2021,5,1,13)))
+        self.assertTrue(np.isnan(values[1]))
+
+        flags = QualityControl(maximum=10).check(timestamps,values)
+        rows = [(dts[0],1.0,0),(dts[2],50.0,0)]
+        self.assertEqual(row_flags('Dump',rows,timestamps,flags),[0,QC_RANGE])
+        self.assertEqual(row_flags('Average',[(dts[2],25.5,0)],timestamps,flags),[QC_RANGE])
+
+    def test_summary(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            for second, flag in enumerate([0,QC_RANGE,QC_RANGE|QC_GAP,0]):
+                db.storeData('2021-05-01 12:00:0{}'.format(second),1.0,1,1,flag)
+            db.compactData(1,'2021-05-01 12:00:02')
+            db.storeData('2021-05-01 12:00:00',1.0,1,2,QC_STEP)
+
+            summary = db.getQCSummary('2021-05-01','2021-05-02')
+            self.assertEqual(summary[1],
+                {'count':4,'flagged':2,'range':2,'step':0,'persistence':0,'gap':1})
+            self.assertEqual(summary[2]['step'],1)
+            self.assertEqual(list(db.getQCSummary('2021-05-01','2021-05-02',2)),[2])
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+'''
+Unit tests for databear.records and record tables
+'''
+
+import os
+import tempfile
+import unittest
+from databear.errors import DataLogConfigError
+from databear.logger import DataLogger
+from databear.records import RecordBuffer, column_name
+from databear.sensors.sensor import Sensor
+
+class testSensor(Sensor):
+    measurements = ['air_temperature']
+
+class testRecords(unittest.TestCase):
+
+    def test_records(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            columns = [column_name('tph1','air_temperature','Average'),
+                       column_name('tph1','air_temperature','Max'),
+                       column_name('wind1','speed','Average')]
+            db.createRecordTable('met',columns[:2])
+            db.createRecordTable('met',columns[1:])
+
+            #Values of one pass are written as one row per timestamp
+            records = RecordBuffer()
+            for i, column in enumerate(columns):
+                records.add('met',column,'2021-05-01 12:00:00',i)
+                records.add('met',column,'2021-05-01 12:01:00',i + 10)
+            self.assertEqual(records.flush(db),2)
+            self.assertEqual(records.pending,{})
+
+            #Later values update existing rows
+            records.add('met',columns[2],'2021-05-01 12:01:00',20)
+            records.flush(db)
+            db.clearRecords('met',columns[0],['2021-05-01 12:00:00'])
+
+            self.assertEqual(db.getRecords('met','2021-05-01','2021-05-02'),(
+                ['dtstamp'] + columns,
+                [('2021-05-01 12:00:00',None,1.0,2.0),
+                 ('2021-05-01 12:01:00',10.0,11.0,20.0)]))
+            db.close()
+            del os.environ['DBDATABASE']
+
+    def test_settings(self):
+        #Settings that can't be stored in a record table
+        logger = DataLogger.__new__(DataLogger)
+        logger.sensors = {'tph1':testSensor('tph1','1',0)}
+        logger.deadbands = {}
+        with self.assertRaises(DataLogConfigError):
+            logger.scheduleStorage(1,'air_temperature','tph1',60,'Dump',record_table='met')
+        with self.assertRaises(DataLogConfigError):
+            logger.scheduleStorage(2,'air_temperature','tph1',60,'Average',
+                                   record_table='met',qc={'max':50})
+
+if __name__ == '__main__':
+    unittest.main()
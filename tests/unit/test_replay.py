@@ -0,0 +1,79 @@
+'''
+Unit tests for databear.replay and process.calculate_windows
+'''
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from databear import process, replay
+from databear.samples import to_ns, from_ns
+
+class testReplay(unittest.TestCase):
+
+    def test_calculate_windows(self):
+        #Same rows as the logger's storage jobs
+        start = datetime(2021,5,1,12)
+        data = [(start + timedelta(seconds=7*i),float((i*37)%11)) for i in range(40)]
+        timestamps = np.array([to_ns(dt) for dt,val in data],dtype=np.int64)
+        values = np.array([val for dt,val in data])
+        for processtype in ['Dump','Sample','Average','Max','Min']:
+            outtimes, outvalues = process.calculate_windows(
+                processtype,timestamps,values,60*1000000000)
+            expected = []
+            for minute in range(5):
+                storetime = start + timedelta(minutes=minute + 1)
+                window = [row for row in data if storetime - timedelta(minutes=1) <= row[0] < storetime]
+                expected.extend(process.calculate(processtype,window,storetime))
+            self.assertEqual([from_ns(ts) for ts in outtimes.tolist()],[row[0] for row in expected])
+            np.testing.assert_allclose(outvalues,[row[1] for row in expected])
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            sensor_id = db.addSensor('tph','tph1','1',0,'port0')
+            sensorconfigid = db.addSensorConfig(sensor_id,1)
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            dumpid = db.addLoggingConfig(measurement_id,sensor_id,60,db.process_ids['Dump'],1)
+
+            #Two days of 10 s samples, the first day compressed
+            start = datetime(2021,5,1)
+            rows = [((start + timedelta(seconds=10*i)).isoformat(sep=' ',timespec='microseconds'),
+                     float(i%30),sensorconfigid,dumpid,0,0) for i in range(2*8640)]
+            db.storeDataRows(rows)
+            db.compactData(dumpid,'2021-05-02')
+            self.assertEqual(db.getDataRange(dumpid),(rows[0][0],rows[-1][0]))
+
+            results = replay.replay({'workers':1,'replay':[
+                {'sensor':'tph1','store':'air_temperature','process':'Max','storage_interval':300},
+                {'sensor':'tph1','store':'air_temperature','process':'Average','storage_interval':3600,
+                 'start':'2021-05-01 06:00','end':'2021-05-01 08:00'}]},db)
+            self.assertEqual([result[1:] for result in results],[(576,2*8640),(2,720)])
+
+            maxid = results[0][0]
+            #Replays are not active configurations
+            self.assertEqual(db.getLoggingConfig(maxid)['process'],'Max')
+            self.assertEqual([config['logging_config_id'] for config in db.getLoggingConfigs()],[dumpid])
+            data = db.getData(maxid,'2021-05-01','2021-05-04')
+            self.assertEqual(data[0][:2],('2021-05-01 00:05',29.0))
+            self.assertEqual(data[-1][0],'2021-05-03 00:00')
+            data = db.getData(results[1][0],'2021-05-01','2021-05-03')
+            self.assertEqual(data,[('2021-05-01 07:00',14.5,0,0),('2021-05-01 08:00',14.5,0,0)])
+
+            #No configuration is added unless all settings are valid
+            configids = db.getConfigIDs('logging')
+            for setting in [{'process':'Median'},{'sensor':'tph2'},{'store':'pressure'}]:
+                invalid = dict({'sensor':'tph1','store':'air_temperature',
+                                'process':'Max','storage_interval':60},**setting)
+                with self.assertRaises(replay.DataLogConfigError):
+                    replay.replay({'replay':[{'sensor':'tph1','store':'air_temperature',
+                                              'process':'Max','storage_interval':60},invalid]},db)
+            self.assertEqual(db.getConfigIDs('logging'),configids)
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+'''
+Unit tests for databear.ringbuffer
+'''
+
+import math
+import os
+import tempfile
+from datetime import datetime
+import unittest
+from databear.ringbuffer import RingBufferWriter, RingBufferReader
+
+class testRingBuffer(unittest.TestCase):
+
+    def test_write_read(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'sensor.ring')
+            writer = RingBufferWriter(path,['temp','rh'],capacity=8)
+            reader = RingBufferReader(path)
+            self.assertEqual(reader.measurements,['temp','rh'])
+            self.assertEqual(reader.latest('temp',5),[])
+
+            for i in range(20):
+                writer.write('temp',i*1000,i/2)
+            writer.write('rh',5,50.0)
+
+            #Only the last capacity samples are available
+            self.assertEqual(reader.count('temp'),20)
+            self.assertEqual(reader.latest('temp',3),[(17000,8.5),(18000,9.0),(19000,9.5)])
+            samples, nextstart = reader.since('temp',0)
+            self.assertEqual([s[0] for s in samples],[i*1000 for i in range(12,20)])
+            self.assertEqual(reader.since('temp',nextstart),([],20))
+            self.assertIsNone(reader.read('temp',3))
+            self.assertEqual(reader.latest('rh',10),[(5,50.0)])
+
+            reader.close()
+            writer.close()
+
+    def test_failed_readings(self):
+        #Readings that are not numbers are published as NaN
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'sensor.ring')
+            writer = RingBufferWriter(path,['temp'],capacity=8)
+            reader = RingBufferReader(path)
+
+            class sensor:
+                data = {'temp':[(datetime(2021,5,1,12,0,i),value)
+                                for i,value in enumerate([1.5,None,'ERR',2])]}
+            writer.publishSamples(sensor)
+            values = [value for ts_ns,value in reader.latest('temp',4)]
+            self.assertEqual(values[0],1.5)
+            self.assertTrue(math.isnan(values[1]) and math.isnan(values[2]))
+            self.assertEqual(values[3],2.0)
+
+            reader.close()
+            writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+'''
+Unit tests for sample group measurement and storage
+'''
+
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from databear import schedule
+from databear.errors import DataLogConfigError
+from databear.logger import DataLogger
+from databear.portworkers import PortWorkerPool
+from databear.sensors.sensor import Sensor, BusSensor
+
+class testSensor(Sensor):
+    measurements = ['value']
+
+    def measure(self):
+        self.record('value',1.0)
+
+class testBusSensor(BusSensor):
+    measurements = ['value']
+
+    def startMeasure(self):
+        return 0.05
+
+    def readMeasure(self,starttime):
+        self.data['value'].append((starttime,2.0))
+
+class nowSensor(Sensor):
+    measurements = ['value']
+
+    def measure(self):
+        self.data['value'].append((datetime.now(),3.0))
+
+def make_logger(sensors):
+    '''
+    A DataLogger with sensors and port workers, without
+    database, driver or control sockets
+    '''
+    logger = DataLogger.__new__(DataLogger)
+    logger.sensors = {}
+    for port, sensor in sensors:
+        sensor.virtualport = port
+        logger.sensors[sensor.name] = sensor
+    logger.adaptive = {}
+    logger.samplegroups = {}
+    logger.logschedule = schedule.Scheduler()
+    logger.inflight = {}
+    logger.inflightlock = threading.Lock()
+    logger.results = queue.SimpleQueue()
+    logger.wakeup = threading.Event()
+    logger.workerpool = PortWorkerPool(logger.results,logger.wakeup)
+    return logger
+
+class testSampleGroups(unittest.TestCase):
+
+    def test_group_measurement(self):
+        logger = make_logger([('port0',testSensor('tph1','1',0)),
+                              ('port1',testBusSensor('wind1','2',1)),
+                              ('port1',testSensor('rain1','3',2))])
+        for name in ['tph1','wind1','rain1']:
+            logger.scheduleMeasurement(name,1,sample_group='met')
+        with self.assertRaises(DataLogConfigError):
+            logger.scheduleMeasurement('rain1',2,sample_group='met')
+        self.assertEqual(len(logger.logschedule.jobs),1)
+
+        #All samples share the scheduled time
+        groupplan = logger.samplegroups['met']['plan']
+        scheduled_time = datetime.now().replace(microsecond=0)
+        logger.doGroupMeasurement(groupplan,scheduled_time,None)
+        results = [logger.results.get(timeout=2) for i in range(3)]
+        logger.workerpool.shutdown()
+        self.assertEqual([result.exception() for result in results],[None]*3)
+        for sensor in logger.sensors.values():
+            self.assertEqual([dt for dt,value in sensor.data['value']],[scheduled_time])
+
+        #Too late, skipped
+        logger.doGroupMeasurement(groupplan,scheduled_time - timedelta(seconds=5),None)
+        self.assertTrue(logger.results.empty())
+
+        #A stopped member leaves the group job, the last one cancels it
+        self.assertEqual(logger.stopSensor('wind1'),1)
+        self.assertEqual([plan.sensorname for plan in groupplan.members],['tph1','rain1'])
+        self.assertEqual(len(logger.logschedule.jobs),1)
+        logger.stopSensor('tph1')
+        self.assertEqual(logger.stopSensor('rain1'),1)
+        self.assertEqual(logger.logschedule.jobs,[])
+
+    def test_unaligned_sensor(self):
+        logger = make_logger([('port0',nowSensor('now1','1',0))])
+        logger.scheduleMeasurement('now1',1,sample_group='met')
+        groupplan = logger.samplegroups['met']['plan']
+        with self.assertLogs(level='WARNING') as logs:
+            logger.doGroupMeasurement(groupplan,datetime.now(),None)
+            logger.results.get(timeout=2)
+        logger.workerpool.shutdown()
+        self.assertIn('now1:value',logs.output[0])
+
+    def test_group_data(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            configids = {}
+            for i,(name,group) in enumerate([('tph1','met'),('tph2','met'),('tph3',None)]):
+                sensor_id = db.addSensor('tph',name,str(i),0,'port0')
+                db.addSensorConfig(sensor_id,1,sample_group=group)
+                configids[name] = db.addLoggingConfig(measurement_id,sensor_id,60,2,1)
+
+            for minute in range(2):
+                dtstamp = '2021-05-01 12:0{}'.format(minute)
+                for i,name in enumerate(['tph1','tph2','tph3']):
+                    db.storeData(dtstamp,float(10*i + minute),1,configids[name],0)
+            db.storeData('2021-05-01 12:02',20.0,1,configids['tph1'],0)
+
+            self.assertEqual(db.getGroupData('met','2021-05-01','2021-05-02'),[
+                ('2021-05-01 12:00',{'tph1:air_temperature':0.0,'tph2:air_temperature':10.0}),
+                ('2021-05-01 12:01',{'tph1:air_temperature':1.0,'tph2:air_temperature':11.0}),
+                ('2021-05-01 12:02',{'tph1:air_temperature':20.0})])
+            self.assertEqual(db.getGroupData('other','2021-05-01','2021-05-02'),[])
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
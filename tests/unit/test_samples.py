@@ -0,0 +1,45 @@
+'''
+Unit tests for databear.samples and the sensor sample API
+'''
+
+import unittest
+from datetime import datetime, timedelta
+from databear.sensors.sensor import Sensor
+from databear.samples import SampleBuffer, to_ns
+
+class testSensor(Sensor):
+    measurements = ['temp','status']
+
+class testSamples(unittest.TestCase):
+
+    def test_record(self):
+        start = datetime(2021,5,1,12,0,0,500)
+        t = lambda s: start + timedelta(seconds=s)
+        sensor = testSensor('tph1','1',0)
+        for i in range(5):
+            sensor.record('temp',i/2,to_ns(t(i)))
+
+        #Tuples are still accepted and returned
+        sensor.data['temp'].append((t(5),7))
+        sensor.data['status'].append((t(0),None))
+        sensor.record('status','ok',to_ns(t(1)))
+
+        self.assertEqual(len(sensor.data['temp']),6)
+        self.assertEqual(sensor.getcurrentdata(),{'temp':(t(5),7.0),'status':(t(1),'ok')})
+        self.assertEqual(sensor.getdata('temp',t(1),t(3)),[(t(1),0.5),(t(2),1.0)])
+        self.assertEqual(list(sensor.data['status']),[(t(0),None),(t(1),'ok')])
+        self.assertEqual(sensor.data['temp'][-2:],[(t(4),2.0),(t(5),7.0)])
+        self.assertEqual(next(reversed(sensor.data['temp'])),(t(5),7.0))
+
+        #Out of order samples are still found
+        sensor.record('temp',9.0,to_ns(t(1.5)))
+        self.assertEqual(sensor.getdata('temp',t(1),t(2)),[(t(1),0.5),(t(1.5),9.0)])
+
+        sensor.cleardata('temp',t(0),t(2))
+        self.assertEqual(sensor.data['temp'][:],[(t(2),1.0),(t(3),1.5),(t(4),2.0),(t(5),7.0)])
+
+    def test_buffer(self):
+        buf = SampleBuffer([(datetime(2021,1,1),1.0)])
+        self.assertEqual(buf.timestamps.itemsize + buf.values.itemsize,16)
+        with self.assertRaises(IndexError):
+            buf[1]
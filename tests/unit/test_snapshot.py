@@ -0,0 +1,47 @@
+'''
+Unit tests for databear.snapshot
+'''
+
+import os
+import tempfile
+import unittest
+from databear import snapshot
+
+class testSnapshot(unittest.TestCase):
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['DBDATABASE'] = os.path.join(tmpdir,'test.db')
+            path = os.path.join(tmpdir,'config.snapshot')
+            from databear.databearDB import DataBearDB
+            db = DataBearDB()
+            sensor_id = db.addSensor('tph','tph1','1',0,'port0')
+            db.addSensorConfig(sensor_id,1)
+
+            config = snapshot.load_config(db,path)
+            self.assertEqual([sensor['name'] for sensor in config['sensors']],['tph1'])
+            self.assertEqual(snapshot.load(path,db.configversion),config)
+
+            #Any configuration change makes the snapshot stale
+            version = db.configversion
+            measurement_id = db.addMeasurement('tph','air_temperature','C')
+            db.addLoggingConfig(measurement_id,sensor_id,60,2,1)
+            self.assertNotEqual(db.configversion,version)
+            self.assertIsNone(snapshot.load(path,db.configversion))
+            config = snapshot.load_config(db,path)
+            self.assertEqual(config['logging'][0]['measurement_name'],'air_temperature')
+            self.assertEqual(snapshot.load(path,db.configversion),config)
+
+            #Storing data doesn't change the configuration
+            version = db.configversion
+            db.storeData('2021-05-01 12:00:00',1.0,1,1,0)
+            self.assertEqual(db.configversion,version)
+
+            with open(path,'w') as f:
+                f.write('{not json')
+            self.assertIsNone(snapshot.load(path,version))
+            db.close()
+            del os.environ['DBDATABASE']
+
+if __name__ == '__main__':
+    unittest.main()
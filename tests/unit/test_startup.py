@@ -0,0 +1,39 @@
+'''
+Unit tests for logger startup cost
+'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from databear import sensorfactory
+
+class testStartup(unittest.TestCase):
+
+    def test_import_logger(self):
+        #Heavy modules are only imported when a feature is used
+        code = 'import sys, databear.logger; print(" ".join(sys.modules))'
+        output = subprocess.run(
+            [sys.executable,'-c',code],
+            capture_output=True,text=True,check=True).stdout
+        modules = output.split()
+        for name in ['numpy','http.server','urllib.request','cProfile','mmap']:
+            self.assertNotIn(name,modules)
+
+    def test_lazy_sensor_module(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir,'lazysensor.py'),'w') as fout:
+                fout.write('class dbsensor:\n    pass\n')
+            sys.path.insert(0,tmpdir)
+            try:
+                factory = sensorfactory.sensorFactory()
+                factory.register_sensor('lazysensor','lazysensor')
+                self.assertNotIn('lazysensor',sys.modules)
+
+                sensorclass = factory.get_sensor_class('lazysensor')
+                self.assertEqual(sensorclass.__name__,'dbsensor')
+                self.assertIs(factory.sensortypes['lazysensor'],sensorclass)
+            finally:
+                sys.path.remove(tmpdir)
+                sys.modules.pop('lazysensor',None)
@@ -0,0 +1,119 @@
+'''
+Unit tests for databear.subscriptions
+'''
+
+import unittest
+from datetime import datetime, timedelta
+from databear.subscriptions import SubscriptionManager, Subscriber
+
+class testConnection:
+    def __init__(self,fail=False):
+        self.frames = []
+        self.fail = fail
+
+    def send(self,frame):
+        if self.fail:
+            raise OSError('Connection closed')
+        self.frames.append(frame)
+
+class testSensor:
+    def __init__(self):
+        self.name = 'tph1'
+        self.data = {'temp':[],'rh':[]}
+
+start = datetime(2021,5,1,12,0,0)
+
+class testSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = SubscriptionManager()
+        self.addCleanup(self.manager.close)
+
+    def test_subscribe(self):
+        conn = testConnection()
+        self.manager.subscribe(conn,{'measurements':[['tph1','temp']]})
+        self.assertTrue(self.manager.wants('tph1','temp'))
+        self.assertFalse(self.manager.wants('tph1','rh'))
+
+        self.manager.publish('sample','tph1','temp',[(start,1.0)])
+        self.manager.publish('stored','tph1','temp',[(start,2.0)],logging_config_id=1)
+        self.manager.publish('sample','tph1','rh',[(start,3.0)])
+        self.manager.flush()
+        self.assertEqual(conn.frames,[{'push':'sample','sensor':'tph1','measurement':'temp',
+                                       'data':[('2021-05-01 12:00:00.000000',1.0)],'dropped':0}])
+
+        self.manager.unsubscribe(conn)
+        self.assertFalse(self.manager.wants('tph1','temp'))
+        self.manager.publish('sample','tph1','temp',[(start,1.0)])
+        self.manager.flush()
+        self.assertEqual(len(conn.frames),1)
+
+        with self.assertRaises(ValueError):
+            self.manager.subscribe(conn,{'measurements':[],'policy':'drop_all'})
+
+    def test_policies(self):
+        oldest = testConnection()
+        newest = testConnection()
+        self.manager.subscribe(oldest,{'measurements':[['tph1','temp']],'maxqueue':2})
+        self.manager.subscribe(newest,{'measurements':[['tph1','temp']],'maxqueue':2,
+                                       'policy':'drop_newest'})
+        for i in range(5):
+            self.manager.publish('sample','tph1','temp',[(start,float(i))])
+        self.manager.flush()
+
+        self.assertEqual([frame['data'][0][1] for frame in oldest.frames],[3.0,4.0])
+        self.assertEqual([frame['data'][0][1] for frame in newest.frames],[0.0,1.0])
+        #Each subscriber gets its own frames and dropped count
+        self.assertEqual([frame['dropped'] for frame in oldest.frames + newest.frames],[3,3,3,3])
+        self.assertIsNot(oldest.frames[0],newest.frames[0])
+
+        self.manager.publish('sample','tph1','temp',[(start,5.0)])
+        self.manager.flush()
+        self.assertEqual(oldest.frames[-1]['dropped'],3)
+
+    def test_publish_samples(self):
+        conn = testConnection()
+        sensor = testSensor()
+        for i in range(3):
+            sensor.data['temp'].append((start + timedelta(seconds=i),float(i)))
+
+        #Not subscribed yet
+        self.manager.publishSamples(sensor)
+        self.manager.subscribe(conn,{'measurements':[['tph1','temp']]})
+
+        #A new subscription gets only the most recent sample, then each new one
+        self.manager.publishSamples(sensor)
+        sensor.data['temp'].append((start + timedelta(seconds=3),3.0))
+        sensor.data['temp'].append((start + timedelta(seconds=4),4.0))
+        self.manager.publishSamples(sensor)
+        self.manager.publishSamples(sensor)
+        self.manager.flush()
+        self.assertEqual([[value for dt,value in frame['data']] for frame in conn.frames],
+                         [[2.0],[3.0,4.0]])
+
+        #Subscribing again after all subscribers left starts from the most recent sample
+        self.manager.unsubscribe(conn)
+        self.assertEqual(self.manager.lastsample,{})
+        for i in range(5,10):
+            sensor.data['temp'].append((start + timedelta(seconds=i),float(i)))
+        again = testConnection()
+        self.manager.subscribe(again,{'measurements':[['tph1','temp']]})
+        self.manager.publishSamples(sensor)
+        self.manager.flush()
+        self.assertEqual([[value for dt,value in frame['data']] for frame in again.frames],
+                         [[9.0]])
+
+    def test_lost_connection(self):
+        conn = testConnection(fail=True)
+        self.manager.subscribe(conn,{'measurements':[['tph1','temp']]})
+        self.manager.publish('sample','tph1','temp',[(start,1.0)])
+        with self.assertLogs(level='WARNING'):
+            self.manager.flush()
+        self.assertEqual(self.manager.subscribers,[])
+
+    def test_subscriber(self):
+        with self.assertRaises(ValueError):
+            Subscriber(None,[],mode='live')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+'''
+Unit tests for databear.supervisor
+'''
+
+import unittest
+from databear.supervisor import assign_ports, merge_metrics
+
+class testSupervisor(unittest.TestCase):
+
+    def test_assign_ports(self):
+        sensorports = {'a':'port1','b':'port1','c':'port1','d':'port2','e':'port3','f':'port4'}
+        assignment = assign_ports(sensorports,2)
+        self.assertEqual(assignment,{'port1':0,'port2':1,'port3':1,'port4':1})
+        self.assertEqual(assign_ports(sensorports,1),{'port1':0,'port2':0,'port3':0,'port4':0})
+
+    def test_merge_metrics(self):
+        text = ('# HELP rows Rows\n# TYPE rows counter\n'
+                'rows{sensor="tph1"} 3.0\n# HELP rss RSS\n# TYPE rss gauge\nrss 10.0\n')
+        merged = merge_metrics({0:text,1:text.replace('tph1','tph2')})
+        self.assertEqual(merged.splitlines(),[
+            '# HELP rows Rows','# TYPE rows counter',
+            'rows{shard="0",sensor="tph1"} 3.0','rows{shard="1",sensor="tph2"} 3.0',
+            '# HELP rss RSS','# TYPE rss gauge',
+            'rss{shard="0"} 10.0','rss{shard="1"} 10.0'])
@@ -0,0 +1,38 @@
+'''
+Unit tests for databear.timeformat
+'''
+
+import unittest
+from datetime import datetime, timedelta, timezone
+from databear.timeformat import TimestampFormatter
+
+class testTimeFormat(unittest.TestCase):
+
+    def test_matches_isoformat(self):
+        #Steps cross second, minute, hour, day and year boundaries
+        start = datetime(2020,12,31,23,58,59,990000)
+        steps = [timedelta(microseconds=7),timedelta(milliseconds=3),
+                 timedelta(seconds=0.5),timedelta(seconds=17),timedelta(seconds=61)]
+        for timespec in ['minutes','seconds','milliseconds','microseconds']:
+            timeformat = TimestampFormatter(timespec)
+            for step in steps:
+                dt = start
+                for i in range(200):
+                    self.assertEqual(timeformat.format(dt),
+                                     dt.isoformat(sep=' ',timespec=timespec))
+                    dt = dt + step
+                #Out of order timestamps
+                self.assertEqual(timeformat.format(start),
+                                 start.isoformat(sep=' ',timespec=timespec))
+
+    def test_separator_and_timezone(self):
+        dt = datetime(2021,5,1,12,0,3,45)
+        timeformat = TimestampFormatter('microseconds',fractionsep=':')
+        self.assertEqual(timeformat.format(dt),dt.strftime('%Y-%m-%d %H:%M:%S:%f'))
+
+        dt = dt.replace(tzinfo=timezone.utc)
+        timeformat = TimestampFormatter('seconds')
+        self.assertEqual(timeformat.format(dt),'2021-05-01 12:00:03+00:00')
+
+if __name__ == '__main__':
+    unittest.main()